@@ -2,8 +2,8 @@ from __future__ import annotations
 
 from datetime import date, datetime
 
-from sqlalchemy import Boolean, Date, DateTime, Float, ForeignKey, Integer, Numeric, String, UniqueConstraint
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import BigInteger, Boolean, Date, DateTime, Float, ForeignKey, Index, Integer, Numeric, String, UniqueConstraint, delete, event, func, inspect, insert, literal_column, select, text
+from sqlalchemy.orm import Mapped, aliased, mapped_column, relationship
 
 from app.db import Base
 
@@ -59,6 +59,10 @@ class Cardholder(Base):
     # Legacy display_name column (kept for backwards compatibility during migration)
     # Can be removed in future once all code uses name+surname
     display_name: Mapped[str | None] = mapped_column(String(200), nullable=True)
+
+    # cardholder_lookup_key(get_display_name()), e.g. "tim bell"; set on every
+    # insert/update by the listener below. Indexed for name lookups and autocomplete.
+    lookup_key: Mapped[str | None] = mapped_column(String(200), nullable=True, index=True)
     
     # Computed property that uses name+surname if display_name is not set
     def get_display_name(self) -> str:
@@ -74,11 +78,32 @@ class Cardholder(Base):
     )
 
 
+def cardholder_display_name():
+    """SQL expression for Cardholder.get_display_name(), for queries that never load the row."""
+    return func.coalesce(
+        func.nullif(Cardholder.display_name, ""),
+        func.trim(Cardholder.name + " " + Cardholder.surname),
+    )
+
+
+def cardholder_lookup_key(display_name: str) -> str:
+    """Case- and whitespace-insensitive form of a cardholder display name."""
+    return " ".join(display_name.lower().split())
+
+
+@event.listens_for(Cardholder, "before_insert")
+@event.listens_for(Cardholder, "before_update")
+def _set_cardholder_lookup_key(mapper, connection, target: Cardholder) -> None:
+    target.lookup_key = cardholder_lookup_key(target.get_display_name())
+
+
 class Manager(Base):
     __tablename__ = "managers"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int | None] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"))
+    # Manager this manager reports to (department head); closure rows in manager_hierarchy
+    parent_manager_id: Mapped[int | None] = mapped_column(ForeignKey("managers.id", ondelete="SET NULL"), nullable=True)
 
     user: Mapped["User | None"] = relationship(back_populates="manager")
     cardholders: Mapped[list["CardholderManager"]] = relationship(
@@ -86,6 +111,65 @@ class Manager(Base):
     )
 
 
+# Closure table of the manager hierarchy: one row per (ancestor, descendant)
+# pair at any depth, including (m, m, 0) for every manager, so "everything
+# under manager X" is a single indexed join. Kept in step with
+# Manager.parent_manager_id by the mapper events below; see
+# app.services.manager_hierarchy for the queries and the full rebuild.
+class ManagerHierarchy(Base):
+    __tablename__ = "manager_hierarchy"
+    __table_args__ = (Index("ix_manager_hierarchy_descendant", "descendant_id", "ancestor_id"),)
+
+    ancestor_id: Mapped[int] = mapped_column(ForeignKey("managers.id", ondelete="CASCADE"), primary_key=True)
+    descendant_id: Mapped[int] = mapped_column(ForeignKey("managers.id", ondelete="CASCADE"), primary_key=True)
+    depth: Mapped[int] = mapped_column(Integer, default=0)
+
+
+def _attach_manager(connection, manager_id: int, parent_id: int) -> None:
+    """Link the subtree rooted at manager_id under parent_id and all its ancestors."""
+    above = aliased(ManagerHierarchy)
+    below = aliased(ManagerHierarchy)
+    connection.execute(
+        insert(ManagerHierarchy).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(above.ancestor_id, below.descendant_id, above.depth + below.depth + 1)
+            .join(below, below.ancestor_id == manager_id)
+            .where(above.descendant_id == parent_id),
+        )
+    )
+
+
+def _detach_manager(connection, manager_id: int) -> None:
+    """Remove the paths from outside the subtree rooted at manager_id into it."""
+    subtree = select(ManagerHierarchy.descendant_id).where(ManagerHierarchy.ancestor_id == manager_id)
+    # Materialised first: the DELETE below removes rows the subquery reads.
+    descendant_ids = list(connection.execute(subtree).scalars())
+    connection.execute(
+        delete(ManagerHierarchy).where(
+            ManagerHierarchy.descendant_id.in_(descendant_ids),
+            ManagerHierarchy.ancestor_id.not_in(descendant_ids),
+        )
+    )
+
+
+@event.listens_for(Manager, "after_insert")
+def _insert_closure_rows(mapper, connection, target: Manager) -> None:
+    connection.execute(
+        insert(ManagerHierarchy).values(ancestor_id=target.id, descendant_id=target.id, depth=0)
+    )
+    if target.parent_manager_id is not None:
+        _attach_manager(connection, target.id, target.parent_manager_id)
+
+
+@event.listens_for(Manager, "after_update")
+def _move_closure_rows(mapper, connection, target: Manager) -> None:
+    if not inspect(target).attrs.parent_manager_id.history.has_changes():
+        return
+    _detach_manager(connection, target.id)
+    if target.parent_manager_id is not None:
+        _attach_manager(connection, target.id, target.parent_manager_id)
+
+
 class CardholderManager(Base):
     __tablename__ = "cardholder_managers"
     __table_args__ = (UniqueConstraint("cardholder_id", "manager_id", name="uq_cardholder_manager"),)
@@ -132,6 +216,9 @@ class Transaction(Base):
     __table_args__ = (
         # Composite key string to uniquely identify a transaction across imports.
         UniqueConstraint("composite_key", name="uq_transaction_composite_key"),
+        Index("ix_transactions_import_job_id", "import_job_id"),
+        # Spend rollup slices: one account's transactions in a date range.
+        Index("ix_transactions_account_date", "account_id", "date"),
     )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
@@ -175,6 +262,13 @@ class Transaction(Base):
 
 class ClassificationBatch(Base):
     __tablename__ = "classification_batches"
+    __table_args__ = (
+        # Finance inbox: batches per import job, and child batches per finance batch.
+        Index("ix_classification_batches_import_job_owner", "import_job_id", "owner_type"),
+        Index("ix_classification_batches_parent_owner", "parent_batch_id", "owner_type"),
+        # Manager inbox: submitted batches of the manager's cardholders.
+        Index("ix_classification_batches_owner_status", "owner_type", "owner_id", "status"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     owner_type: Mapped[str] = mapped_column(String(50))  # finance, cardholder, manager
@@ -191,6 +285,17 @@ class ClassificationBatch(Base):
     submitted_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
     approved_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
 
+    # Denormalised counters over the batch's classifications, kept current by
+    # app.services.batch_counters on every write that moves or reclassifies lines.
+    transaction_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    unclassified_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    predicted_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    confirmed_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)  # user_confirmed
+    approved_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)  # manager_approved
+    rejected_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    debit_total: Mapped[Numeric] = mapped_column(Numeric(18, 2), default=0, server_default="0", nullable=False)
+    credit_total: Mapped[Numeric] = mapped_column(Numeric(18, 2), default=0, server_default="0", nullable=False)
+
     parent_batch: Mapped["ClassificationBatch | None"] = relationship(
         "ClassificationBatch", remote_side=[id], backref="child_batches"
     )
@@ -200,6 +305,12 @@ class ClassificationBatch(Base):
 
 class Classification(Base):
     __tablename__ = "classifications"
+    __table_args__ = (
+        # Watermark scans by training runs and the similar-transactions index.
+        Index("ix_classifications_last_updated_at", "last_updated_at"),
+        # Batch item listings and batch counter refreshes.
+        Index("ix_classifications_batch_status", "batch_id", "status"),
+    )
 
     transaction_id: Mapped[int] = mapped_column(
         ForeignKey("transactions.id", ondelete="CASCADE"), primary_key=True
@@ -214,6 +325,12 @@ class Classification(Base):
     last_updated_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
     source: Mapped[str | None] = mapped_column(String(50), nullable=True)  # ml, user, manager
     rejection_reason: Mapped[str | None] = mapped_column(String(1000), nullable=True)  # Manager rejection note
+    # Labels this row contributed to the published model, so training can retract
+    # them when the row is relabelled (trained_at is NULL when it contributed none).
+    trained_project: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    trained_cost_category: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    trained_gl_account: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    trained_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
 
     transaction: Mapped["Transaction"] = relationship(back_populates="classification")
     batch: Mapped["ClassificationBatch | None"] = relationship(back_populates="classifications")
@@ -239,12 +356,84 @@ class FinanceExtension(Base):
     export_batch: Mapped["ExportBatch | None"] = relationship(back_populates="finance_rows")
 
 
+# Materialised Format 3 (finance/Pronto) view: one row per transaction joining
+# Transaction, Classification and FinanceExtension. Maintained by
+# app.services.format3_projection.refresh_format3_rows after writes to the
+# source rows, so Finance reads never repeat the three-way join.
+class Format3Row(Base):
+    __tablename__ = "format3_rows"
+    __table_args__ = (
+        # Keyset pagination is newest first on (date, transaction_id).
+        Index("ix_format3_rows_date", "date", "transaction_id"),
+        Index("ix_format3_rows_status_date", "status", "date", "transaction_id"),
+        Index("ix_format3_rows_import_job", "import_job_id"),
+    )
+
+    transaction_id: Mapped[int] = mapped_column(
+        ForeignKey("transactions.id", ondelete="CASCADE"), primary_key=True
+    )
+    import_job_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    bank_account: Mapped[str] = mapped_column(String(100))
+    date: Mapped[date] = mapped_column(Date)
+    narrative: Mapped[str] = mapped_column(String(1000))
+    debit_amount: Mapped[Numeric | None] = mapped_column(Numeric(18, 2), nullable=True)
+    credit_amount: Mapped[Numeric | None] = mapped_column(Numeric(18, 2), nullable=True)
+
+    # Format 2 (Classification)
+    description: Mapped[str | None] = mapped_column(String(500), nullable=True)
+    project: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    cost_category: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    gl_account: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    status: Mapped[str] = mapped_column(String(50), default="unclassified")
+
+    # Format 3 (FinanceExtension)
+    account: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    reference: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    tax: Mapped[Numeric | None] = mapped_column(Numeric(18, 2), nullable=True)
+    amount: Mapped[Numeric | None] = mapped_column(Numeric(18, 2), nullable=True)
+    tax_code: Mapped[str | None] = mapped_column(String(50), nullable=True)
+    cbs: Mapped[str | None] = mapped_column(String(50), nullable=True)
+    export_batch_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    ready_for_pronto: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    exported_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    refreshed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow)
+
+
+# Precomputed spend aggregates for finance reporting, one row per
+# (grain, period_start, account, cardholder, cost_category, gl_account).
+# grain is "day" or "month" (period_start = first day of the month).
+# Maintained by app.services.spend_rollups, which recomputes the affected
+# (period, account) slices whenever transactions are imported or their
+# classifications change.
+class SpendRollup(Base):
+    __tablename__ = "spend_rollups"
+    __table_args__ = (
+        Index("ix_spend_rollups_slice", "grain", "period_start", "account_id"),
+        Index("ix_spend_rollups_cardholder", "grain", "cardholder_id", "period_start"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    grain: Mapped[str] = mapped_column(String(10))  # day, month
+    period_start: Mapped[date] = mapped_column(Date)
+    account_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    cardholder_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    cost_category: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    gl_account: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    transaction_count: Mapped[int] = mapped_column(Integer, default=0)
+    debit_total: Mapped[Numeric] = mapped_column(Numeric(18, 2), default=0)
+    credit_total: Mapped[Numeric] = mapped_column(Numeric(18, 2), default=0)
+    refreshed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow)
+
+
 class ExportBatch(Base):
     __tablename__ = "export_batches"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     format: Mapped[str] = mapped_column(String(50), default="PRONTO_UPLOAD")
-    file_name: Mapped[str | None] = mapped_column(String(500), nullable=True)
+    file_name: Mapped[str | None] = mapped_column(String(500), nullable=True)  # Artifact store key of the generated file
+    checksum: Mapped[str | None] = mapped_column(String(64), nullable=True)  # SHA-256 hex of the file
+    file_size: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
     record_count: Mapped[int | None] = mapped_column(Integer, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow)
     created_by_user_id: Mapped[int | None] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"))
@@ -254,6 +443,10 @@ class ExportBatch(Base):
 
 class MLPrediction(Base):
     __tablename__ = "ml_predictions"
+    __table_args__ = (
+        # Latest prediction run per transaction/field: rows of one run share predicted_at.
+        Index("ix_ml_predictions_latest", "transaction_id", "field_name", "predicted_at"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     transaction_id: Mapped[int] = mapped_column(ForeignKey("transactions.id", ondelete="CASCADE"))
@@ -275,3 +468,33 @@ class UsageMetric(Base):
     metric_value: Mapped[float] = mapped_column(Float)
 
 
+
+
+class MLTrainingRun(Base):
+    __tablename__ = "ml_training_runs"
+    __table_args__ = (
+        # At most one pending or running run, so concurrent /train requests can't both queue one.
+        Index(
+            "uq_ml_training_runs_active",
+            literal_column("(1)"),
+            unique=True,
+            sqlite_where=text("status IN ('pending', 'running')"),
+            postgresql_where=text("status IN ('pending', 'running')"),
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    status: Mapped[str] = mapped_column(String(50), default="pending")  # pending, running, completed, failed
+    # Full retrain from the cached training dataset instead of an incremental update.
+    full_retrain: Mapped[bool] = mapped_column(Boolean, default=False, server_default="0", nullable=False)
+    # Classifications with last_updated_at in (watermark_from, watermark_to] are trained on
+    # (re-read from WATERMARK_OVERLAP before watermark_from, see ml_training).
+    watermark_from: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    watermark_to: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    base_model_version: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    model_version: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    examples_trained: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    error: Mapped[str | None] = mapped_column(String(1000), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    completed_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
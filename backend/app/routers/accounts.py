@@ -3,11 +3,14 @@ from __future__ import annotations
 from typing import List
 
 from fastapi import APIRouter, HTTPException, status
-from sqlalchemy import func, select
+from sqlalchemy import select
 
 from app.db import get_session
-from app.models import Account, Cardholder, Transaction
+from app.models import Account, Cardholder
 from app.schemas import AccountOut, AssignCardholderRequest, CardholderOut
+from app.services import account_sync
+from app.services.cardholder_listing import find_cardholder_by_name
+from app.services.spend_rollups import refresh_spend_rollups
 
 
 router = APIRouter()
@@ -16,26 +19,13 @@ router = APIRouter()
 @router.post("/sync-from-transactions", response_model=dict)
 async def sync_accounts_from_transactions() -> dict:
     """
-    Ensure there is an Account row for each distinct Transaction.bank_account.
+    Ensure there is an Account row for each distinct Transaction.bank_account
+    (bank accounts already matched by last 4 digits are skipped).
 
     This is a quick utility for bootstrapping accounts from existing ledger data.
     """
-    created = 0
     with get_session() as session:
-        # Find distinct bank accounts in transactions.
-        distinct_accounts = session.execute(
-            select(func.distinct(Transaction.bank_account))
-        ).scalars()
-        existing_accounts = {
-            acc.bank_account_number for acc in session.execute(select(Account)).scalars()
-        }
-
-        for bank_account in distinct_accounts:
-            if bank_account in existing_accounts:
-                continue
-            acc = Account(bank_account_number=bank_account, label=bank_account)
-            session.add(acc)
-            created += 1
+        created = account_sync.sync_accounts_from_transactions(session)
 
     return {"created": created}
 
@@ -49,36 +39,8 @@ async def link_transactions_to_accounts() -> dict:
     1. Exact match on bank_account_number
     2. Last 4 digits match (if account number is 4+ digits)
     """
-    linked = 0
     with get_session() as session:
-        # Build account map
-        account_map: dict[str, int | None] = {}
-        all_accounts = list(session.execute(select(Account)).scalars())
-        for acc in all_accounts:
-            # Store exact match
-            account_map[acc.bank_account_number] = acc.id
-            # Also store last 4 digits if account number is longer
-            if len(acc.bank_account_number) >= 4:
-                last4 = acc.bank_account_number[-4:]
-                if last4 not in account_map:
-                    account_map[last4] = acc.id
-
-        # Update transactions without account_id
-        transactions = session.execute(
-            select(Transaction).where(Transaction.account_id.is_(None))
-        ).scalars().all()
-
-        for tx in transactions:
-            bank_acc = tx.bank_account
-            # Try exact match first
-            account_id = account_map.get(bank_acc)
-            # If no exact match, try last 4 digits
-            if account_id is None and len(bank_acc) >= 4:
-                account_id = account_map.get(bank_acc[-4:])
-            
-            if account_id:
-                tx.account_id = account_id
-                linked += 1
+        linked = account_sync.link_transactions_to_accounts(session)
 
     return {"linked": linked, "message": f"Linked {linked} transactions to accounts"}
 
@@ -149,12 +111,8 @@ async def assign_cardholder(
                 cardholder_name = name
                 cardholder_surname = ""
             
-            # Try to find by matching display_name (computed property)
-            existing = None
-            for ch in session.execute(select(Cardholder)).scalars():
-                if ch.get_display_name().lower() == name.lower():
-                    existing = ch
-                    break
+            # Indexed lookup on the normalised display name
+            existing = find_cardholder_by_name(session, name)
 
             if existing:
                 cardholder = existing
@@ -170,6 +128,8 @@ async def assign_cardholder(
 
         account.cardholder_id = cardholder.id
         session.flush()
+        # Rollup rows carry the account's cardholder.
+        refresh_spend_rollups(session, account_ids=[account.id])
 
         # Extract data while session is open.
         # For accounts, we return a lightweight summary for the cardholder
@@ -193,6 +153,7 @@ async def unassign_cardholder(account_id: int) -> AccountOut:
 
         account.cardholder_id = None
         session.flush()
+        refresh_spend_rollups(session, account_ids=[account.id])
 
         return AccountOut(
             id=account.id,
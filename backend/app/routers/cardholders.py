@@ -1,75 +1,64 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException, status
-from sqlalchemy import func, select, update
+from fastapi import APIRouter, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import or_, select, update
 
 from app.db import get_session
 from app.models import Cardholder, Manager, CardholderManager, ClassificationBatch, Transaction, Account, Classification
 from app.schemas import (
     CardholderOut,
     CardholderCreate,
+    CardholderSuggestion,
     CardholderUpdate,
-    ManagerOut,
     ClassificationBatchCreate,
     ClassificationBatchOut,
     ClassificationBatchUpdate,
-    Format2Item,
 )
-from app.services.format2_projection import project_to_format2
+from app.services import cardholder_listing
+from app.services.batch_counters import refresh_batch_counters
+from app.services.batch_items import parse_item_cursor, stream_batch_items
+from app.services.batch_prediction import predict_batch
+from app.services.batch_release import release_finance_batch
+from app.services.manager_directory import manager_directory
+from app.services.spend_rollups import refresh_spend_rollups
 
 
 router = APIRouter()
 
-# Manager email mapping (from import data)
-# This will be replaced with proper User/Manager linking when SSO is implemented
-MANAGER_EMAIL_MAP = {
-    1: "andrewe@gekkos.com",
-    2: "melindap@gekkos.com",
-    3: "nigelg@gekkos.com",
-    4: "markd@gekkos.com",
-    5: "dano@gekkos.com",
-    6: "timb@gekkos.com",
-    7: "michaelt@gekkos.com",
-    8: "waynel@gekkos.com",
-}
+@router.get("", response_model=List[CardholderOut])
+async def list_cardholders(
+    q: Optional[str] = Query(default=None, description="Match name, surname or email"),
+    sort: str = Query(default="id", pattern="^(id|name|surname|email)$"),
+    order: str = Query(default="asc", pattern="^(asc|desc)$"),
+    limit: Optional[int] = Query(default=None, ge=1, le=1000, description="Page size; all cardholders when omitted"),
+    offset: int = Query(default=0, ge=0),
+) -> List[CardholderOut]:
+    """
+    List cardholders with their managers (if assigned), optionally searched,
+    sorted and paged.
+    """
+    with get_session() as session:
+        return cardholder_listing.list_cardholders(session, q, sort, order == "desc", limit, offset)
 
 
-@router.get("", response_model=List[CardholderOut])
-async def list_cardholders() -> List[CardholderOut]:
+@router.get("/autocomplete", response_model=List[CardholderSuggestion])
+async def autocomplete_cardholders(
+    q: str = Query(min_length=1, description="Start of the cardholder's display name"),
+    limit: int = Query(default=10, ge=1, le=50),
+) -> List[CardholderSuggestion]:
     """
-    List all cardholders with their managers (if assigned).
+    Cardholders whose display name starts with `q` (case-insensitive), for
+    pickers such as assigning a card to a cardholder.
     """
     with get_session() as session:
-        cardholders = list(session.execute(select(Cardholder)).scalars())
-        items = []
-        for ch in cardholders:
-            # Get manager if assigned
-            manager_link = session.execute(
-                select(CardholderManager).where(CardholderManager.cardholder_id == ch.id).limit(1)
-            ).scalar_one_or_none()
-            
-            manager = None
-            if manager_link:
-                manager_obj = session.get(Manager, manager_link.manager_id)
-                if manager_obj:
-                    manager_email = MANAGER_EMAIL_MAP.get(manager_obj.id)
-                    manager = ManagerOut(id=manager_obj.id, user_id=manager_obj.user_id, email=manager_email)
-            
-            items.append(
-                CardholderOut(
-                    id=ch.id,
-                    name=ch.name,
-                    surname=ch.surname,
-                    email=ch.email,
-                    user_id=ch.user_id,
-                    display_name=ch.get_display_name(),
-                    manager=manager,
-                )
-            )
-    return items
+        return [
+            CardholderSuggestion(id=ch.id, display_name=ch.get_display_name(), email=ch.email)
+            for ch in cardholder_listing.autocomplete_cardholders(session, q, limit)
+        ]
 
 
 @router.post("", response_model=CardholderOut)
@@ -123,16 +112,7 @@ async def create_cardholder(payload: CardholderCreate) -> CardholderOut:
             session.add(link)
             session.flush()
 
-        # Get manager if assigned
-        manager_link = session.execute(
-            select(CardholderManager).where(CardholderManager.cardholder_id == cardholder.id).limit(1)
-        ).scalar_one_or_none()
-        
-        manager = None
-        if manager_link:
-            manager_obj = session.get(Manager, manager_link.manager_id)
-            if manager_obj:
-                manager = ManagerOut(id=manager_obj.id, user_id=manager_obj.user_id)
+        manager = manager_directory(session).manager_for_cardholder(cardholder.id)
 
         result = CardholderOut(
             id=cardholder.id,
@@ -209,16 +189,7 @@ async def update_cardholder(
 
         session.flush()
 
-        # Get manager if assigned
-        manager_link = session.execute(
-            select(CardholderManager).where(CardholderManager.cardholder_id == cardholder_id).limit(1)
-        ).scalar_one_or_none()
-        
-        manager = None
-        if manager_link:
-            manager_obj = session.get(Manager, manager_link.manager_id)
-            if manager_obj:
-                manager = ManagerOut(id=manager_obj.id, user_id=manager_obj.user_id)
+        manager = manager_directory(session).manager_for_cardholder(cardholder_id)
 
         return CardholderOut(
             id=cardholder.id,
@@ -244,16 +215,7 @@ async def get_cardholder(cardholder_id: int) -> CardholderOut:
                 detail="Cardholder not found.",
             )
         
-        # Get manager if assigned
-        manager_link = session.execute(
-            select(CardholderManager).where(CardholderManager.cardholder_id == cardholder_id).limit(1)
-        ).scalar_one_or_none()
-        
-        manager = None
-        if manager_link:
-            manager_obj = session.get(Manager, manager_link.manager_id)
-            if manager_obj:
-                manager = ManagerOut(id=manager_obj.id, user_id=manager_obj.user_id)
+        manager = manager_directory(session).manager_for_cardholder(cardholder_id)
         
         return CardholderOut(
             id=cardholder.id,
@@ -280,7 +242,15 @@ async def delete_cardholder(cardholder_id: int):
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Cardholder not found.",
             )
+        # Rollup slices attributed to the cardholder, directly or through an account.
+        transaction_ids = session.execute(
+            select(Transaction.id)
+            .outerjoin(Account, Account.id == Transaction.account_id)
+            .where(or_(Transaction.cardholder_id == cardholder_id, Account.cardholder_id == cardholder_id))
+        ).scalars().all()
         session.delete(cardholder)
+        session.flush()
+        refresh_spend_rollups(session, transaction_ids)
         session.commit()
 
 
@@ -309,18 +279,12 @@ async def get_cardholder_inbox(cardholder_id: int) -> dict:
         
         items = []
         for batch in batches:
-            tx_count = session.execute(
-                select(func.count(Classification.transaction_id)).where(
-                    Classification.batch_id == batch.id
-                )
-            ).scalar() or 0
-            
             items.append({
                 "batch_id": batch.id,
                 "label": batch.label or batch.title,
                 "title": batch.title,
                 "status": batch.status,
-                "transaction_count": tx_count,
+                "transaction_count": batch.transaction_count,
                 "created_at": batch.created_at,
                 "submitted_at": batch.submitted_at,
             })
@@ -368,12 +332,6 @@ async def create_cardholder_batch_from_finance(
         
         if existing_batch:
             # Return existing batch instead of creating a duplicate
-            tx_count = session.execute(
-                select(func.count(Classification.transaction_id)).where(
-                    Classification.batch_id == existing_batch.id
-                )
-            ).scalar() or 0
-            
             return ClassificationBatchOut(
                 id=existing_batch.id,
                 owner_type=existing_batch.owner_type,
@@ -389,82 +347,34 @@ async def create_cardholder_batch_from_finance(
                 completed_at=existing_batch.completed_at,
                 submitted_at=existing_batch.submitted_at,
                 approved_at=existing_batch.approved_at,
-                transaction_count=tx_count,
+                transaction_count=existing_batch.transaction_count,
             )
         
-        # Get transactions for this cardholder from the parent batch
-        # First, get accounts for this cardholder
-        accounts = list(
-            session.execute(
-                select(Account.bank_account_number).where(Account.cardholder_id == cardholder_id)
-            ).scalars()
-        )
-        
-        if not accounts:
+        has_account = session.execute(
+            select(Account.id).where(Account.cardholder_id == cardholder_id).limit(1)
+        ).first()
+        if not has_account:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Cardholder has no accounts assigned.",
             )
         
-        # Get transactions from parent batch that match this cardholder's accounts
-        from sqlalchemy import or_
-        conditions = []
-        for acc_num in accounts:
-            if len(acc_num) >= 4:
-                last4 = acc_num[-4:]
-                conditions.append(Transaction.bank_account.like(f"%{last4}"))
-        
-        if not conditions:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="No matching transactions found for cardholder accounts.",
-            )
-        
-        # Get transactions from the parent batch's import job
         if not parent_batch.import_job_id:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Parent batch has no import job associated.",
             )
         
-        # Get all transactions from the import job that match this cardholder's accounts
-        matching_txs = list(
-            session.execute(
-                select(Transaction).where(
-                    Transaction.import_job_id == parent_batch.import_job_id,
-                    or_(*conditions)
-                )
-            ).scalars()
+        # Same set-based release as the finance endpoint, for this cardholder only.
+        created_ids, _ = release_finance_batch(
+            session, parent_batch, cardholder_ids=[cardholder_id], label=payload.label, title=payload.title
         )
-        
-        if not matching_txs:
+        if not created_ids:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="No matching transactions found in parent batch.",
             )
-        
-        # Create cardholder batch
-        batch = ClassificationBatch(
-            owner_type="cardholder",
-            owner_id=cardholder_id,
-            parent_batch_id=payload.parent_batch_id,
-            status="open",
-            title=payload.title or f"{cardholder.get_display_name()} - Classification",
-            label=payload.label,
-        )
-        session.add(batch)
-        session.flush()
-        
-        # Link transactions to batch via classifications
-        for tx in matching_txs:
-            classification = session.get(Classification, tx.id)
-            if not classification:
-                classification = Classification(transaction_id=tx.id)
-                session.add(classification)
-            classification.batch_id = batch.id
-            session.flush()
-        
-        tx_count = len(matching_txs)
+        batch = session.get(ClassificationBatch, created_ids[0])
         
         return ClassificationBatchOut(
             id=batch.id,
@@ -481,17 +391,25 @@ async def create_cardholder_batch_from_finance(
             completed_at=batch.completed_at,
             submitted_at=batch.submitted_at,
             approved_at=batch.approved_at,
-            transaction_count=tx_count,
+            transaction_count=batch.transaction_count,
         )
 
 
-@router.get("/{cardholder_id}/batches/{batch_id}/items", response_model=dict)
+@router.get("/{cardholder_id}/batches/{batch_id}/items")
 async def get_cardholder_batch_items(
     cardholder_id: int,
     batch_id: int,
-) -> dict:
+    sort: str = Query(default="date", pattern="^(date|amount)$"),
+    order: str = Query(default="asc", pattern="^(asc|desc)$"),
+    cursor: Optional[str] = Query(default=None, description="next_cursor from the previous page"),
+    limit: Optional[int] = Query(default=None, ge=1, le=5000, description="Page size; all items when omitted"),
+) -> StreamingResponse:
     """
     Get Format 2 items for a cardholder batch.
+
+    Items come from one joined query, sorted by `sort` (date or amount) and
+    streamed as {"items": [...], "next_cursor": ...}. With `limit`, pass the
+    returned `next_cursor` as `cursor` to fetch the next page.
     """
     with get_session() as session:
         batch = session.get(ClassificationBatch, batch_id)
@@ -506,20 +424,21 @@ async def get_cardholder_batch_items(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Batch does not belong to this cardholder.",
             )
-        
-        classifications = list(
-            session.execute(
-                select(Classification).where(Classification.batch_id == batch_id)
-            ).scalars()
-        )
-        
-        items: List[Format2Item] = []
-        for classification in classifications:
-            transaction = session.get(Transaction, classification.transaction_id)
-            if transaction:
-                items.append(project_to_format2(transaction, classification))
-        
-        return {"items": items}
+
+    after = None
+    if cursor:
+        try:
+            after = parse_item_cursor(sort, cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid cursor: {cursor}",
+            )
+    
+    return StreamingResponse(
+        stream_batch_items(batch_id, sort, order == "desc", after, limit),
+        media_type="application/json",
+    )
 
 
 @router.post("/{cardholder_id}/batches/{batch_id}/submit", response_model=ClassificationBatchOut)
@@ -557,25 +476,31 @@ async def submit_cardholder_batch(
         if payload.transaction_ids and len(payload.transaction_ids) > 0:
             # Partial submission: only submit selected transactions
             # Verify all selected transactions are user_confirmed and belong to this batch
-            for tx_id in payload.transaction_ids:
-                classification = session.execute(
-                    select(Classification).where(
-                        Classification.transaction_id == tx_id,
-                        Classification.batch_id == batch_id
-                    )
-                ).scalar_one_or_none()
-                
-                if not classification:
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail=f"Transaction {tx_id} is not in this batch.",
-                    )
-                
-                if classification.status != "user_confirmed":
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail=f"Transaction {tx_id} is not confirmed (status: {classification.status}). Only user_confirmed transactions can be submitted.",
+            selected_ids = sorted(set(payload.transaction_ids))
+            statuses = dict(
+                session.execute(
+                    select(Classification.transaction_id, Classification.status).where(
+                        Classification.transaction_id.in_(selected_ids),
+                        Classification.batch_id == batch_id,
                     )
+                ).all()
+            )
+
+            missing = [tx_id for tx_id in selected_ids if tx_id not in statuses]
+            if missing:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Transactions not in this batch: {', '.join(map(str, missing))}.",
+                )
+
+            unconfirmed = [
+                f"{tx_id} ({tx_status})" for tx_id, tx_status in statuses.items() if tx_status != "user_confirmed"
+            ]
+            if unconfirmed:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Only user_confirmed transactions can be submitted. Not confirmed: {', '.join(unconfirmed)}.",
+                )
             
             # Create a new sub-batch for the submitted transactions
             sub_batch = ClassificationBatch(
@@ -590,25 +515,20 @@ async def submit_cardholder_batch(
             session.flush()
             
             # Move selected classifications to the sub-batch
-            for tx_id in payload.transaction_ids:
-                classification = session.execute(
-                    select(Classification).where(
-                        Classification.transaction_id == tx_id,
-                        Classification.batch_id == batch_id
-                    )
-                ).scalar_one_or_none()
-                if classification:
-                    classification.batch_id = sub_batch.id
-            
-            # Update parent batch status
-            remaining_count = session.execute(
-                select(func.count(Classification.transaction_id)).where(
+            session.execute(
+                update(Classification)
+                .where(
+                    Classification.transaction_id.in_(selected_ids),
                     Classification.batch_id == batch_id,
-                    Classification.status == "user_confirmed"
+                    Classification.status == "user_confirmed",
                 )
-            ).scalar() or 0
+                .values(batch_id=sub_batch.id)
+                .execution_options(synchronize_session=False)
+            )
+            refresh_batch_counters(session, [batch_id, sub_batch.id])
             
-            if remaining_count == 0:
+            # Update parent batch status
+            if batch.confirmed_count == 0:
                 # All confirmed transactions were submitted
                 batch.status = "completed"
                 batch.submitted_at = datetime.utcnow()
@@ -619,7 +539,6 @@ async def submit_cardholder_batch(
                     batch.submitted_at = datetime.utcnow()
             
             # Return the sub-batch info
-            sub_tx_count = len(payload.transaction_ids)
             return ClassificationBatchOut(
                 id=sub_batch.id,
                 owner_type=sub_batch.owner_type,
@@ -635,18 +554,11 @@ async def submit_cardholder_batch(
                 completed_at=sub_batch.completed_at,
                 submitted_at=sub_batch.submitted_at,
                 approved_at=sub_batch.approved_at,
-                transaction_count=sub_tx_count,
+                transaction_count=sub_batch.transaction_count,
             )
         else:
             # Full submission: submit all user_confirmed transactions
-            confirmed_count = session.execute(
-                select(func.count(Classification.transaction_id)).where(
-                    Classification.batch_id == batch_id,
-                    Classification.status == "user_confirmed"
-                )
-            ).scalar() or 0
-            
-            if confirmed_count == 0:
+            if batch.confirmed_count == 0:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Cannot submit batch: no transactions have been classified (user_confirmed).",
@@ -660,12 +572,6 @@ async def submit_cardholder_batch(
         
         session.flush()
         
-        tx_count = session.execute(
-            select(func.count(Classification.transaction_id)).where(
-                Classification.batch_id == batch.id
-            )
-        ).scalar() or 0
-        
         return ClassificationBatchOut(
             id=batch.id,
             owner_type=batch.owner_type,
@@ -681,7 +587,7 @@ async def submit_cardholder_batch(
             completed_at=batch.completed_at,
             submitted_at=batch.submitted_at,
             approved_at=batch.approved_at,
-            transaction_count=tx_count,
+            transaction_count=batch.transaction_count,
         )
 
 
@@ -707,31 +613,11 @@ async def auto_predict_batch(
                 detail="Batch does not belong to this cardholder.",
             )
         
-        from app.services.ml_service import predict_classification as ml_predict
-        
-        classifications = list(
-            session.execute(
-                select(Classification).where(
-                    Classification.batch_id == batch_id,
-                    Classification.status.in_(["unclassified", None])
-                )
-            ).scalars()
-        )
-        
-        predicted_count = 0
-        for classification in classifications:
-            transaction = session.get(Transaction, classification.transaction_id)
-            if transaction:
-                predictions = ml_predict(transaction)
-                classification.description = predictions.get("description")
-                classification.project = predictions.get("project")
-                classification.cost_category = predictions.get("cost_category")
-                classification.gl_account = predictions.get("gl_account")
-                classification.status = "predicted"
-                classification.source = "ml"
-                classification.last_updated_at = datetime.utcnow()
-                predicted_count += 1
-        
-        session.flush()
+        result = predict_batch(session, batch_id)
+        predicted_count = len(result["transaction_ids"])
         
-        return {"predicted_count": predicted_count, "message": f"Predicted {predicted_count} transactions"}
+        return {
+            "predicted_count": predicted_count,
+            "message": f"Predicted {predicted_count} transactions",
+            "timings_ms": result["timings_ms"],
+        }
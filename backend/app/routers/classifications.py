@@ -8,9 +8,21 @@ from sqlalchemy import select
 
 from app.db import get_session
 from app.models import Classification, Transaction
-from app.schemas import ClassificationUpdate, Format2Item
+from app.schemas import (
+    ClassificationUpdate,
+    Format2Item,
+    MLPredictionOut,
+    PredictionAlternativesOut,
+    SimilarTransactionOut,
+    SimilarTransactionsOut,
+)
+from app.services.batch_counters import refresh_batch_counters
 from app.services.format2_projection import project_to_format2
-from app.services.ml_service import predict_classification as ml_predict
+from app.services.format3_projection import refresh_format3_rows
+from app.services.ml_predictions import latest_predictions, prediction_rows, record_predictions
+from app.services.ml_service import active_model, model_version, predict_top_k, top_predictions
+from app.services.similarity_index import mark_similarity_index_stale, similarity_index
+from app.services.spend_rollups import refresh_spend_rollups
 
 
 router = APIRouter()
@@ -89,17 +101,12 @@ async def list_manager_classifications(
     """
     List Format 2 items for all cardholders under a manager.
     """
-    from app.models import CardholderManager, Account
+    from app.models import Account
+    from app.services.manager_hierarchy import managed_cardholder_ids
     
     with get_session() as session:
-        # Get cardholder IDs for this manager
-        cardholder_ids = list(
-            session.execute(
-                select(CardholderManager.cardholder_id).where(
-                    CardholderManager.manager_id == manager_id
-                )
-            ).scalars()
-        )
+        # Get cardholder IDs under this manager (at any depth)
+        cardholder_ids = list(session.execute(managed_cardholder_ids(manager_id).distinct()).scalars())
         
         if not cardholder_ids:
             return {"items": []}
@@ -235,8 +242,15 @@ async def update_classification(
         classification.last_updated_at = datetime.utcnow()
         classification.source = "user"
         session.flush()
+        refresh_format3_rows(session, [transaction_id])
+        refresh_spend_rollups(session, [transaction_id])
+        refresh_batch_counters(session, [classification.batch_id])
         
-        return project_to_format2(transaction, classification)
+        item = project_to_format2(transaction, classification)
+    
+    # Picked up by the similar-transactions index once committed.
+    mark_similarity_index_stale()
+    return item
 
 
 @router.post("/{transaction_id}/predict", response_model=Format2Item)
@@ -258,8 +272,14 @@ async def predict_classification_endpoint(transaction_id: int) -> Format2Item:
             classification = Classification(transaction_id=transaction_id)
             session.add(classification)
         
-        # Run ML prediction stub
-        predictions = ml_predict(transaction)
+        # Run ML prediction stub and keep the ranked alternatives for the UI
+        now = datetime.utcnow()
+        model = active_model()
+        alternatives = predict_top_k(transaction, model=model)
+        record_predictions(
+            session, prediction_rows(transaction_id, alternatives, model_version(model), now)
+        )
+        predictions = top_predictions(alternatives)
         
         # Update classification with predictions
         classification.description = predictions.get("description")
@@ -268,10 +288,76 @@ async def predict_classification_endpoint(transaction_id: int) -> Format2Item:
         classification.gl_account = predictions.get("gl_account")
         classification.status = "predicted"
         classification.source = "ml"
-        classification.last_updated_at = datetime.utcnow()
+        classification.last_updated_at = now
         
         session.flush()
+        refresh_format3_rows(session, [transaction_id])
+        refresh_spend_rollups(session, [transaction_id])
+        refresh_batch_counters(session, [classification.batch_id])
         
         return project_to_format2(transaction, classification)
 
 
+@router.get("/{transaction_id}/predictions", response_model=PredictionAlternativesOut)
+async def get_prediction_alternatives(transaction_id: int) -> PredictionAlternativesOut:
+    """
+    Return the latest recorded ML predictions for a transaction, with the
+    top-k alternatives per field, without re-running the model.
+    """
+    with get_session() as session:
+        transaction = session.get(Transaction, transaction_id)
+        if not transaction:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Transaction not found.",
+            )
+        
+        fields = latest_predictions(session, [transaction_id]).get(transaction_id, {})
+        
+        return PredictionAlternativesOut(
+            transaction_id=transaction_id,
+            predictions={
+                field_name: [MLPredictionOut(**alt) for alt in alternatives]
+                for field_name, alternatives in fields.items()
+            },
+        )
+
+
+@router.get("/{transaction_id}/similar", response_model=SimilarTransactionsOut)
+async def get_similar_transactions(
+    transaction_id: int,
+    k: int = Query(default=5, ge=1, le=50),
+) -> SimilarTransactionsOut:
+    """
+    Return the k previously confirmed or approved transactions whose
+    narratives are most similar to this one, with how they were coded.
+    """
+    with get_session() as session:
+        transaction = session.get(Transaction, transaction_id)
+        if not transaction:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Transaction not found.",
+            )
+        
+        neighbours = similarity_index(session).query(transaction.narrative, k=k, exclude=transaction_id)
+        
+        return SimilarTransactionsOut(
+            transaction_id=transaction_id,
+            items=[
+                SimilarTransactionOut(
+                    transaction_id=row["transaction_id"],
+                    date=row["date"],
+                    narrative=row["narrative"],
+                    debit_amount=row["debit_amount"],
+                    credit_amount=row["credit_amount"],
+                    description=row["description"],
+                    project=row["project"],
+                    cost_category=row["cost_category"],
+                    gl_account=row["gl_account"],
+                    status=row["status"],
+                    similarity=round(similarity, 4),
+                )
+                for row, similarity in neighbours
+            ],
+        )
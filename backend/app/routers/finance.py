@@ -1,110 +1,498 @@
 from __future__ import annotations
 
-from datetime import datetime
-from typing import List
+from datetime import date, datetime
+from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException, status
-from sqlalchemy import func, select
+from fastapi import APIRouter, Header, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import aliased
 
 from app.db import get_session
-from app.models import ClassificationBatch, Classification, ImportJob, Transaction
-from app.schemas import ClassificationBatchCreate, ClassificationBatchOut, ClassificationBatchUpdate
+from app.models import (
+    Account,
+    CardholderManager,
+    ClassificationBatch,
+    ExportBatch,
+    Format3Row,
+    ImportJob,
+    SpendRollup,
+    Transaction,
+)
+from app.schemas import (
+    BatchReleaseRequest,
+    ClassificationBatchCreate,
+    ClassificationBatchOut,
+    ClassificationBatchUpdate,
+    ExportBatchCreate,
+    ExportBatchOut,
+    Format3Item,
+    SpendReportRow,
+)
+from app.services.account_matching import account_matches
+from app.services.artifact_store import artifact_path, iter_artifact, parse_byte_range, put_artifact, staging_path
+from app.services.batch_counters import refresh_batch_counters
+from app.services.batch_release import link_to_batch, release_finance_batch
+from app.services.format3_projection import refresh_format3_rows, refresh_import_job
+from app.services.pronto_export import claim_ready_rows, export_file_name, write_export_file
+from app.services.spend_rollups import ROLLUP_GRAINS, refresh_spend_rollups
 
 
 router = APIRouter()
 
 
-@router.get("/transactions")
-async def list_finance_transactions() -> dict:
+def _parse_cursor(cursor: str) -> tuple[date, int]:
+    """Split a "YYYY-MM-DD:transaction_id" keyset cursor."""
+    try:
+        day, _, transaction_id = cursor.partition(":")
+        return date.fromisoformat(day), int(transaction_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid cursor: {cursor}",
+        )
+
+
+@router.get("/transactions", response_model=dict)
+async def list_finance_transactions(
+    status_filter: Optional[str] = Query(default=None, alias="status"),
+    date_from: Optional[date] = Query(default=None, alias="from"),
+    date_to: Optional[date] = Query(default=None, alias="to"),
+    import_job_id: Optional[int] = Query(default=None),
+    bank_account: Optional[str] = Query(default=None),
+    project: Optional[str] = Query(default=None),
+    cost_category: Optional[str] = Query(default=None),
+    ready_for_pronto: Optional[bool] = Query(default=None),
+    exported: Optional[bool] = Query(default=None),
+    cursor: Optional[str] = Query(default=None, description="next_cursor from the previous page"),
+    limit: int = Query(default=100, ge=1, le=1000),
+) -> dict:
     """
-    MVP stub:
-    - Returns Format 3 (finance/Pronto) view rows.
-    - Restricted to Admin/Finance in the future.
+    Format 3 (finance/Pronto) view rows, newest first.
+
+    Reads the materialised format3_rows projection and pages by keyset on
+    (date, transaction_id): pass the returned `next_cursor` as `cursor` to
+    fetch the next page. Restricted to Admin/Finance in the future.
     """
-    return {"items": [], "message": "Stub: list finance transactions (Format 3 view)"}
+    conditions = []
+    if status_filter:
+        conditions.append(Format3Row.status == status_filter)
+    if date_from:
+        conditions.append(Format3Row.date >= date_from)
+    if date_to:
+        conditions.append(Format3Row.date <= date_to)
+    if import_job_id is not None:
+        conditions.append(Format3Row.import_job_id == import_job_id)
+    if bank_account:
+        conditions.append(Format3Row.bank_account == bank_account)
+    if project:
+        conditions.append(Format3Row.project == project)
+    if cost_category:
+        conditions.append(Format3Row.cost_category == cost_category)
+    if ready_for_pronto is not None:
+        conditions.append(Format3Row.ready_for_pronto == ready_for_pronto)
+    if exported is not None:
+        conditions.append(Format3Row.exported_at.is_not(None) if exported else Format3Row.exported_at.is_(None))
+    if cursor:
+        after_date, after_id = _parse_cursor(cursor)
+        conditions.append(
+            or_(
+                Format3Row.date < after_date,
+                and_(Format3Row.date == after_date, Format3Row.transaction_id < after_id),
+            )
+        )
+
+    with get_session() as session:
+        rows = list(
+            session.execute(
+                select(Format3Row)
+                .where(*conditions)
+                .order_by(Format3Row.date.desc(), Format3Row.transaction_id.desc())
+                .limit(limit + 1)
+            ).scalars()
+        )
+        items = [Format3Item.model_validate(row) for row in rows[:limit]]
 
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = f"{last.date.isoformat()}:{last.transaction_id}"
+    return {"items": items, "next_cursor": next_cursor}
 
-@router.post("/export-batches")
-async def create_export_batch() -> dict:
+
+@router.post("/transactions/refresh", response_model=dict)
+async def refresh_finance_transactions(
+    import_job_id: Optional[int] = Query(default=None, description="Only refresh this import job's transactions"),
+) -> dict:
     """
-    MVP stub:
-    - Creates an export batch from selected transactions.
+    Rebuild the Format 3 projection from Transaction, Classification and
+    FinanceExtension (all rows, or one import job).
+
+    Write paths keep the projection current; this is for backfills and
+    repairs after out-of-band changes.
     """
-    return {"batch_id": 0, "message": "Stub: create export batch"}
+    with get_session() as session:
+        if import_job_id is not None:
+            refreshed = refresh_import_job(session, import_job_id)
+        else:
+            refreshed = refresh_format3_rows(session)
+    return {"refreshed": refreshed}
+
+
+# Dimensions a spend report can group by.
+SPEND_REPORT_DIMENSIONS = ("period", "account", "cardholder", "manager", "cost_category", "gl_account")
 
 
-@router.get("/export-batches")
-async def list_export_batches() -> dict:
+@router.get("/reports/spend", response_model=dict)
+async def spend_report(
+    grain: str = Query(default="month", description="day or month"),
+    group_by: str = Query(default="period", description=f"Comma-separated: {', '.join(SPEND_REPORT_DIMENSIONS)}"),
+    date_from: Optional[date] = Query(default=None, alias="from"),
+    date_to: Optional[date] = Query(default=None, alias="to"),
+    account_id: Optional[int] = Query(default=None),
+    cardholder_id: Optional[int] = Query(default=None),
+    manager_id: Optional[int] = Query(default=None),
+    cost_category: Optional[str] = Query(default=None),
+    gl_account: Optional[str] = Query(default=None),
+) -> dict:
     """
-    MVP stub:
-    - Lists export batches.
+    Spend totals grouped by the requested dimensions, answered from the
+    SpendRollup tables rather than the ledger.
+
+    For month grain, `from`/`to` select whole months (the months containing
+    them). A cardholder with several managers counts towards each of them
+    when grouping or filtering by manager.
     """
-    return {"items": [], "message": "Stub: list export batches"}
+    if grain not in ROLLUP_GRAINS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid grain: {grain}",
+        )
+    dimensions = [name.strip() for name in group_by.split(",") if name.strip()]
+    unknown = [name for name in dimensions if name not in SPEND_REPORT_DIMENSIONS]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid group_by dimension(s): {', '.join(unknown)}",
+        )
+
+    columns = {
+        "period": SpendRollup.period_start,
+        "account": SpendRollup.account_id,
+        "cardholder": SpendRollup.cardholder_id,
+        "manager": CardholderManager.manager_id,
+        "cost_category": SpendRollup.cost_category,
+        "gl_account": SpendRollup.gl_account,
+    }
+    labels = {
+        "period": "period_start",
+        "account": "account_id",
+        "cardholder": "cardholder_id",
+        "manager": "manager_id",
+        "cost_category": "cost_category",
+        "gl_account": "gl_account",
+    }
+    group_columns = [columns[name] for name in dimensions]
+
+    with get_session() as session:
+        stmt = select(
+            *(column.label(labels[name]) for name, column in zip(dimensions, group_columns)),
+            func.sum(SpendRollup.transaction_count).label("transaction_count"),
+            func.sum(SpendRollup.debit_total).label("debit_total"),
+            func.sum(SpendRollup.credit_total).label("credit_total"),
+        ).where(SpendRollup.grain == grain)
+        if "manager" in dimensions or manager_id is not None:
+            stmt = stmt.join(CardholderManager, CardholderManager.cardholder_id == SpendRollup.cardholder_id)
+        if manager_id is not None:
+            stmt = stmt.where(CardholderManager.manager_id == manager_id)
+        if date_from:
+            stmt = stmt.where(SpendRollup.period_start >= (date_from.replace(day=1) if grain == "month" else date_from))
+        if date_to:
+            stmt = stmt.where(SpendRollup.period_start <= date_to)
+        if account_id is not None:
+            stmt = stmt.where(SpendRollup.account_id == account_id)
+        if cardholder_id is not None:
+            stmt = stmt.where(SpendRollup.cardholder_id == cardholder_id)
+        if cost_category is not None:
+            stmt = stmt.where(SpendRollup.cost_category == cost_category)
+        if gl_account is not None:
+            stmt = stmt.where(SpendRollup.gl_account == gl_account)
+        if group_columns:
+            stmt = stmt.group_by(*group_columns).order_by(*group_columns)
+
+        rows = session.execute(stmt).mappings().all()
+        # An ungrouped report over no rollups yields a single all-NULL row.
+        items = [SpendReportRow(**row) for row in rows if row["transaction_count"]]
+
+    return {"grain": grain, "group_by": dimensions, "items": items}
 
 
-@router.get("/export-batches/{batch_id}")
-async def get_export_batch(batch_id: int) -> dict:
+@router.post("/reports/spend/refresh", response_model=dict)
+async def refresh_spend_report(
+    import_job_id: Optional[int] = Query(default=None, description="Only refresh the periods this import job touches"),
+) -> dict:
     """
-    MVP stub:
-    - Returns metadata for a single export batch.
+    Rebuild the spend rollups from the ledger (all of it, or the (period,
+    account) slices of one import job). Imports and classification edits keep
+    the rollups current; this is for backfills and repairs.
     """
-    return {"batch_id": batch_id, "message": "Stub: get export batch"}
+    with get_session() as session:
+        refreshed = refresh_spend_rollups(session, import_job_id=import_job_id)
+    return {"refreshed": refreshed}
+
+
+@router.post("/batches/counters/refresh", response_model=dict)
+async def refresh_batch_counters_endpoint(
+    batch_id: Optional[int] = Query(default=None, description="Only recompute this batch"),
+) -> dict:
+    """
+    Recompute the line counters and totals stored on classification batches
+    (all of them, or one). Batch writes keep the counters current; this is
+    for backfills and repairs after out-of-band changes.
+    """
+    with get_session() as session:
+        refreshed = refresh_batch_counters(session, [batch_id] if batch_id is not None else None)
+    return {"refreshed": refreshed}
+
+
+@router.post("/export-batches", response_model=ExportBatchOut)
+async def create_export_batch(payload: ExportBatchCreate) -> ExportBatchOut:
+    """
+    Create an ExportBatch from all rows ready for Pronto and not yet exported
+    (optionally limited by transaction date range or import job), and write
+    the Pronto upload file.
+    """
+    with get_session() as session:
+        now = datetime.utcnow()
+        batch = ExportBatch(format="PRONTO_UPLOAD", created_at=now, created_by_user_id=payload.created_by_user_id)
+        session.add(batch)
+        session.flush()
+
+        claimed = claim_ready_rows(
+            session,
+            batch.id,
+            now,
+            date_from=payload.date_from,
+            date_to=payload.date_to,
+            import_job_id=payload.import_job_id,
+        )
+        if not claimed:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="No rows are ready for Pronto export.",
+            )
+
+        path = staging_path(export_file_name(batch.id, now))
+        try:
+            batch.record_count = write_export_file(session, batch.id, path)
+        except Exception:
+            # The claim is rolled back with the session; don't leave a staged file.
+            path.unlink(missing_ok=True)
+            raise
+        batch.file_name, batch.checksum, batch.file_size = put_artifact(path, suffix=".csv")
+        session.flush()
+
+        return ExportBatchOut.model_validate(batch)
+
+
+@router.get("/export-batches", response_model=dict)
+async def list_export_batches(
+    limit: int = Query(default=50, ge=1, le=500),
+    before_id: Optional[int] = Query(default=None, description="Return batches older than this id (from next_before_id)"),
+) -> dict:
+    """
+    List export batches, newest first.
+    """
+    with get_session() as session:
+        stmt = select(ExportBatch).order_by(ExportBatch.id.desc())
+        if before_id is not None:
+            stmt = stmt.where(ExportBatch.id < before_id)
+        batches = list(session.execute(stmt.limit(limit + 1)).scalars())
+        items = [ExportBatchOut.model_validate(batch) for batch in batches[:limit]]
+
+    return {
+        "items": items,
+        "next_before_id": items[-1].id if len(batches) > limit else None,
+    }
+
+
+@router.get("/export-batches/{batch_id}", response_model=ExportBatchOut)
+async def get_export_batch(batch_id: int) -> ExportBatchOut:
+    """
+    Return metadata for a single export batch.
+    """
+    with get_session() as session:
+        batch = session.get(ExportBatch, batch_id)
+        if not batch:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Export batch {batch_id} not found.",
+            )
+        return ExportBatchOut.model_validate(batch)
+
+
+@router.get("/export-batches/{batch_id}/download")
+async def download_export_batch(
+    batch_id: int,
+    range_header: Optional[str] = Header(default=None, alias="Range"),
+    if_range: Optional[str] = Header(default=None, alias="If-Range"),
+    if_none_match: Optional[str] = Header(default=None, alias="If-None-Match"),
+) -> Response:
+    """
+    Download the Pronto upload file for an export batch.
+
+    The file is an immutable artifact, so the response carries a strong ETag
+    (its SHA-256) and long-lived cache headers; If-None-Match returns 304 and
+    single byte ranges (Range / If-Range) return 206.
+    """
+    with get_session() as session:
+        batch = session.get(ExportBatch, batch_id)
+        if not batch:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Export batch {batch_id} not found.",
+            )
+        if not batch.checksum:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Export batch {batch_id} has no stored file.",
+            )
+        file_key, checksum, file_size = batch.file_name, batch.checksum, batch.file_size
+        download_name = export_file_name(batch.id, batch.created_at)
+
+    path = artifact_path(file_key)
+    if not path.exists():
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail=f"Export file for batch {batch_id} is missing from the artifact store.",
+        )
+
+    etag = f'"{checksum}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "Content-Disposition": f'attachment; filename="{download_name}"',
+    }
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    byte_range = None
+    # If-Range with a stale validator means the client's partial copy is outdated: send it all.
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = parse_byte_range(range_header, file_size)
+        except ValueError:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={**headers, "Content-Range": f"bytes */{file_size}"},
+            )
+
+    if byte_range is None:
+        return StreamingResponse(
+            iter_artifact(path),
+            media_type="text/csv",
+            headers={**headers, "Content-Length": str(file_size)},
+        )
+
+    start, end = byte_range
+    return StreamingResponse(
+        iter_artifact(path, start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type="text/csv",
+        headers={
+            **headers,
+            "Content-Length": str(end - start + 1),
+            "Content-Range": f"bytes {start}-{end}/{file_size}",
+        },
+    )
 
 
 # Finance Inbox endpoints
 @router.get("/inbox", response_model=dict)
-async def get_finance_inbox() -> dict:
+async def get_finance_inbox(
+    limit: int = Query(default=50, ge=1, le=500),
+    before_id: Optional[int] = Query(default=None, description="Return import jobs older than this id (from next_before_id)"),
+) -> dict:
     """
     Get Finance inbox: list of recent ImportJobs with batch status.
+
+    Newest first, one page of `limit` jobs per call; pass the returned
+    `next_before_id` as `before_id` to load the next page.
     """
     with get_session() as session:
         try:
-            import_jobs = list(
-                session.execute(
-                    select(ImportJob).order_by(ImportJob.id.desc()).limit(50)
-                ).scalars()
+            page_stmt = select(ImportJob.id, ImportJob.file_name, ImportJob.started_at).order_by(ImportJob.id.desc())
+            if before_id is not None:
+                page_stmt = page_stmt.where(ImportJob.id < before_id)
+            # One extra row tells us whether another page exists.
+            page = page_stmt.limit(limit + 1).cte("page")
+
+            # First finance batch per job, as the old per-job lookup picked.
+            finance_batches = (
+                select(
+                    ClassificationBatch.import_job_id,
+                    func.min(ClassificationBatch.id).label("finance_batch_id"),
+                )
+                .where(
+                    ClassificationBatch.owner_type == "finance",
+                    ClassificationBatch.import_job_id.in_(select(page.c.id)),
+                )
+                .group_by(ClassificationBatch.import_job_id)
+                .subquery()
+            )
+            tx_counts = (
+                select(Transaction.import_job_id, func.count(Transaction.id).label("transaction_count"))
+                .where(Transaction.import_job_id.in_(select(page.c.id)))
+                .group_by(Transaction.import_job_id)
+                .subquery()
+            )
+            child_counts = (
+                select(ClassificationBatch.parent_batch_id, func.count(ClassificationBatch.id).label("child_count"))
+                .where(
+                    ClassificationBatch.owner_type == "cardholder",
+                    ClassificationBatch.parent_batch_id.in_(select(finance_batches.c.finance_batch_id)),
+                )
+                .group_by(ClassificationBatch.parent_batch_id)
+                .subquery()
             )
+            finance_batch = aliased(ClassificationBatch)
+
+            rows = session.execute(
+                select(
+                    page.c.id,
+                    page.c.file_name,
+                    page.c.started_at,
+                    func.coalesce(tx_counts.c.transaction_count, 0),
+                    finance_batches.c.finance_batch_id,
+                    finance_batch.status,
+                    func.coalesce(child_counts.c.child_count, 0),
+                )
+                .outerjoin(tx_counts, tx_counts.c.import_job_id == page.c.id)
+                .outerjoin(finance_batches, finance_batches.c.import_job_id == page.c.id)
+                .outerjoin(finance_batch, finance_batch.id == finance_batches.c.finance_batch_id)
+                .outerjoin(child_counts, child_counts.c.parent_batch_id == finance_batches.c.finance_batch_id)
+                .order_by(page.c.id.desc())
+            ).all()
             
             items = []
-            for job in import_jobs:
-                # Find associated finance batch if any
-                finance_batch = session.execute(
-                    select(ClassificationBatch).where(
-                        ClassificationBatch.import_job_id == job.id,
-                        ClassificationBatch.owner_type == "finance"
-                    ).limit(1)
-                ).scalar_one_or_none()
-                
-                # Count transactions
-                tx_count = session.execute(
-                    select(func.count(Transaction.id)).where(Transaction.import_job_id == job.id)
-                ).scalar() or 0
-                
-                # Use started_at as created_at, or fallback to None
-                created_at = job.started_at.isoformat() if job.started_at else None
-                
-                # Check if finance batch has been released to cardholders (has child batches)
-                released_to_cardholders = False
-                if finance_batch:
-                    child_batch_count = session.execute(
-                        select(func.count(ClassificationBatch.id)).where(
-                            ClassificationBatch.parent_batch_id == finance_batch.id,
-                            ClassificationBatch.owner_type == "cardholder"
-                        )
-                    ).scalar() or 0
-                    released_to_cardholders = child_batch_count > 0
-                
+            for job_id, file_name, started_at, tx_count, finance_batch_id, batch_status, child_batch_count in rows[:limit]:
                 items.append({
-                    "import_job_id": job.id,
-                    "file_name": job.file_name or "",
-                    "created_at": created_at,
+                    "import_job_id": job_id,
+                    "file_name": file_name or "",
+                    # Use started_at as created_at, or fallback to None
+                    "created_at": started_at.isoformat() if started_at else None,
                     "transaction_count": tx_count,
-                    "finance_batch_id": finance_batch.id if finance_batch else None,
-                    "status": finance_batch.status if finance_batch else "pending",
-                    "released_to_cardholders": released_to_cardholders,
+                    "finance_batch_id": finance_batch_id,
+                    "status": batch_status if finance_batch_id else "pending",
+                    # Released once the finance batch has cardholder child batches
+                    "released_to_cardholders": child_batch_count > 0,
                 })
             
-            return {"items": items}
+            return {
+                "items": items,
+                "next_before_id": items[-1]["import_job_id"] if len(rows) > limit else None,
+            }
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -157,26 +545,13 @@ async def open_finance_batch(
                 session.add(batch)
                 session.flush()
                 
-                # Optionally link transactions to batch via classifications
-                if payload.transaction_ids:
-                    from app.models import Classification
-                    for tx_id in payload.transaction_ids:
-                        classification = session.execute(
-                            select(Classification).where(Classification.transaction_id == tx_id)
-                        ).scalar_one_or_none()
-                        if not classification:
-                            classification = Classification(transaction_id=tx_id)
-                            session.add(classification)
-                        classification.batch_id = batch.id
-                        session.flush()
-            
-            # Count transactions in batch
-            from app.models import Classification
-            tx_count = session.execute(
-                select(func.count(Classification.transaction_id)).where(
-                    Classification.batch_id == batch.id
+                # Link the given transactions (default: the whole import job) in one upsert
+                link_to_batch(
+                    session,
+                    batch.id,
+                    transaction_ids=payload.transaction_ids,
+                    import_job_id=import_job_id,
                 )
-            ).scalar() or 0
             
             result = ClassificationBatchOut(
                 id=batch.id,
@@ -193,7 +568,7 @@ async def open_finance_batch(
                 completed_at=batch.completed_at,
                 submitted_at=batch.submitted_at,
                 approved_at=batch.approved_at,
-                transaction_count=tx_count,
+                transaction_count=batch.transaction_count,
             )
             return result
     except HTTPException:
@@ -244,12 +619,6 @@ async def complete_finance_batch(
         
         session.flush()
         
-        tx_count = session.execute(
-            select(func.count(Classification.transaction_id)).where(
-                Classification.batch_id == batch.id
-            )
-        ).scalar() or 0
-        
         return ClassificationBatchOut(
             id=batch.id,
             owner_type=batch.owner_type,
@@ -265,15 +634,17 @@ async def complete_finance_batch(
             completed_at=batch.completed_at,
             submitted_at=batch.submitted_at,
             approved_at=batch.approved_at,
-            transaction_count=tx_count,
+            transaction_count=batch.transaction_count,
         )
 
 
-@router.get("/batches/{batch_id}/cardholders-with-transactions", response_model=dict)
-async def get_cardholders_with_transactions(batch_id: int) -> dict:
+@router.post("/batches/{batch_id}/release", response_model=dict)
+async def release_finance_batch_endpoint(batch_id: int, payload: BatchReleaseRequest) -> dict:
     """
-    Get list of cardholders who have transactions in this finance batch.
-    Used to filter the "Release to Cardholders" dialog.
+    Release a Finance batch to cardholders in one call: creates a child batch
+    for each cardholder (all with transactions in the import job, or
+    `cardholder_ids`) and assigns the matching transactions to it.
+    Cardholders already released to are skipped.
     """
     with get_session() as session:
         batch = session.get(ClassificationBatch, batch_id)
@@ -295,59 +666,118 @@ async def get_cardholders_with_transactions(batch_id: int) -> dict:
                 detail="Batch has no import job associated.",
             )
         
-        # Get all transactions from the import job
-        transactions = list(
-            session.execute(
-                select(Transaction.bank_account).where(
-                    Transaction.import_job_id == batch.import_job_id
-                ).distinct()
-            ).scalars()
+        created_ids, skipped_ids = release_finance_batch(
+            session, batch, cardholder_ids=payload.cardholder_ids, label=payload.label
         )
         
-        if not transactions:
-            return {"cardholder_ids": []}
+        released: List[ClassificationBatchOut] = []
+        if created_ids:
+            children = session.execute(
+                select(ClassificationBatch).where(ClassificationBatch.id.in_(created_ids)).order_by(ClassificationBatch.id)
+            ).scalars()
+            for child in children:
+                released.append(
+                    ClassificationBatchOut(
+                        id=child.id,
+                        owner_type=child.owner_type,
+                        owner_id=child.owner_id,
+                        parent_batch_id=child.parent_batch_id,
+                        import_job_id=child.import_job_id,
+                        status=child.status,
+                        title=child.title,
+                        label=child.label,
+                        note=child.note,
+                        rejection_reason=child.rejection_reason,
+                        created_at=child.created_at,
+                        completed_at=child.completed_at,
+                        submitted_at=child.submitted_at,
+                        approved_at=child.approved_at,
+                        transaction_count=child.transaction_count,
+                    )
+                )
         
-        # Extract last 4 digits from each transaction bank account
-        from sqlalchemy import or_, func
-        from app.models import Account, Cardholder
+        return {
+            "released": released,
+            "already_released_ids": skipped_ids,
+            "transaction_count": sum(child.transaction_count for child in released),
+        }
+
+
+@router.get("/batches/{batch_id}/cardholders-with-transactions", response_model=dict)
+async def get_cardholders_with_transactions(batch_id: int) -> dict:
+    """
+    Get list of cardholders who have transactions in this finance batch, with
+    per-cardholder transaction counts and debit/credit totals.
+    Used to filter the "Release to Cardholders" dialog.
+    """
+    with get_session() as session:
+        batch = session.get(ClassificationBatch, batch_id)
+        if not batch:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Batch not found.",
+            )
         
-        conditions = []
-        for tx_account in transactions:
-            if len(tx_account) >= 4:
-                last4 = tx_account[-4:]
-                conditions.append(Account.bank_account_number.like(f"%{last4}"))
+        if batch.owner_type != "finance":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Batch is not a Finance batch.",
+            )
         
-        if not conditions:
-            return {"cardholder_ids": []}
+        if not batch.import_job_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Batch has no import job associated.",
+            )
         
-        # Find accounts that match any of these last 4 digits
-        matching_accounts = list(
-            session.execute(
-                select(Account.cardholder_id).where(
-                    Account.cardholder_id.isnot(None),
-                    or_(*conditions)
-                ).distinct()
-            ).scalars()
+        # Distinct (transaction, cardholder) pairs, so a cardholder with two
+        # accounts sharing a last-4 suffix does not count a transaction twice.
+        pairs = (
+            select(Transaction.id.label("transaction_id"), Account.cardholder_id)
+            .join(Account, account_matches(Transaction.bank_account, Account.bank_account_number))
+            .where(
+                Transaction.import_job_id == batch.import_job_id,
+                Account.cardholder_id.is_not(None),
+            )
+            .distinct()
+            .subquery()
         )
-        
-        # Get unique cardholder IDs
-        cardholder_ids = list(set([cid for cid in matching_accounts if cid is not None]))
-        
-        # Check which cardholders already have batches from this finance batch
-        existing_batches = list(
-            session.execute(
-                select(ClassificationBatch.owner_id).where(
-                    ClassificationBatch.parent_batch_id == batch_id,
-                    ClassificationBatch.owner_type == "cardholder",
-                    ClassificationBatch.owner_id.in_(cardholder_ids) if cardholder_ids else False
-                )
-            ).scalars()
+        released = (
+            select(ClassificationBatch.owner_id)
+            .where(
+                ClassificationBatch.parent_batch_id == batch_id,
+                ClassificationBatch.owner_type == "cardholder",
+            )
+            .distinct()
+            .subquery()
         )
-        already_released_ids = list(set([bid for bid in existing_batches if bid is not None]))
+        rows = session.execute(
+            select(
+                pairs.c.cardholder_id,
+                func.count(Transaction.id),
+                func.coalesce(func.sum(Transaction.debit_amount), 0),
+                func.coalesce(func.sum(Transaction.credit_amount), 0),
+                func.max(released.c.owner_id),
+            )
+            .join(Transaction, Transaction.id == pairs.c.transaction_id)
+            .outerjoin(released, released.c.owner_id == pairs.c.cardholder_id)
+            .group_by(pairs.c.cardholder_id)
+            .order_by(pairs.c.cardholder_id)
+        ).all()
+        
+        cardholders = [
+            {
+                "cardholder_id": cardholder_id,
+                "transaction_count": tx_count,
+                "debit_total": float(debit_total),
+                "credit_total": float(credit_total),
+                "already_released": released_id is not None,
+            }
+            for cardholder_id, tx_count, debit_total, credit_total, released_id in rows
+        ]
         
         return {
-            "cardholder_ids": cardholder_ids,
-            "already_released_ids": already_released_ids,
+            "cardholder_ids": [item["cardholder_id"] for item in cardholders],
+            "already_released_ids": [item["cardholder_id"] for item in cardholders if item["already_released"]],
+            "cardholders": cardholders,
         }
-
-
@@ -9,7 +9,11 @@ from fastapi import APIRouter, File, HTTPException, UploadFile, status
 from sqlalchemy.dialects.postgresql import insert
 
 from app.db import get_session
-from app.models import ImportJob, Transaction, Account
+from app.models import Format3Row, ImportJob, SpendRollup, Transaction, Account
+from app.services.batch_counters import refresh_batch_counters
+from app.services.format3_projection import refresh_import_job
+from app.services.similarity_index import mark_similarity_index_stale, reset_similarity_index
+from app.services.spend_rollups import refresh_spend_rollups
 from sqlalchemy import select, func, delete
 
 
@@ -230,10 +234,14 @@ async def create_import_format1(file: UploadFile = File(...)) -> dict:
         # This is more reliable than rowcount for SQLite with ON CONFLICT DO NOTHING
         count_after = session.execute(select(func.count(Transaction.id))).scalar()
         inserted_count = count_after - count_before
+        refresh_import_job(session, job_id)
+        refresh_spend_rollups(session, import_job_id=job_id)
 
         job.status = "completed"
         job.error_count = job.total_rows - inserted_count
 
+    mark_similarity_index_stale()
+
     return {
         "message": "Import completed.",
         "import_job_id": job_id,
@@ -255,11 +263,15 @@ async def clear_ledger() -> dict:
         count_before = session.execute(select(func.count(Transaction.id))).scalar()
         import_jobs_count = session.execute(select(func.count(ImportJob.id))).scalar()
         
-        # Delete all transactions
+        # Delete the Format 3 projection, spend rollups and all transactions
+        session.execute(delete(Format3Row))
+        session.execute(delete(SpendRollup))
         session.execute(delete(Transaction))
         
         # Also clear import jobs for clean state
         session.execute(delete(ImportJob))
+        # Deleting transactions cascaded to their classifications.
+        refresh_batch_counters(session)
         
         # Explicitly commit the deletions
         session.commit()
@@ -272,6 +284,8 @@ async def clear_ledger() -> dict:
                 detail=f"Failed to clear all transactions. {count_after} remain.",
             )
     
+    reset_similarity_index()
+    
     return {
         "message": "Ledger cleared successfully",
         "transactions_deleted": count_before,
@@ -1,35 +1,27 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException, status
-from sqlalchemy import func, select
+from fastapi import APIRouter, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, select, update
 
 from app.db import get_session
-from app.models import Manager, CardholderManager, Account, Cardholder, ClassificationBatch, Classification, Transaction
-from app.schemas import ManagerOut, ManagerAccountOut, ClassificationBatchOut, Format2Item, BatchRejectRequest
-from app.services.format2_projection import project_to_format2
+from app.models import Manager, CardholderManager, ManagerHierarchy, Account, Cardholder, ClassificationBatch, Classification, cardholder_display_name
+from app.schemas import ManagerOut, ManagerAccountOut, ManagerParentUpdate, ClassificationBatchOut, BatchRejectRequest
+from app.services.batch_counters import refresh_batch_counters
+from app.services.batch_items import parse_item_cursor, stream_batch_items
+from app.services.finance_derivation import derive_batch_finance_fields
+from app.services.format3_projection import refresh_format3_rows
+from app.services.manager_directory import manager_directory
+from app.services.manager_hierarchy import is_under, managed_cardholder_ids, manages_cardholder
+from app.services.similarity_index import mark_similarity_index_stale
 
 
 router = APIRouter()
 
 
-# Temporary mapping of manager IDs to emails based on historic import data.
-# This mirrors the mapping used in the cardholders router so that Admin/Finance
-# can see a meaningful identifier for each manager while SSO is not yet wired up.
-MANAGER_EMAIL_MAP = {
-    1: "andrewe@gekkos.com",
-    2: "melindap@gekkos.com",
-    3: "nigelg@gekkos.com",
-    4: "markd@gekkos.com",
-    5: "dano@gekkos.com",
-    6: "timb@gekkos.com",
-    7: "michaelt@gekkos.com",
-    8: "waynel@gekkos.com",
-}
-
-
 @router.get("", response_model=List[ManagerOut])
 async def list_managers() -> List[ManagerOut]:
     """
@@ -37,39 +29,48 @@ async def list_managers() -> List[ManagerOut]:
 
     For now, managers are fairly minimal:
     - Identified primarily by ID
-    - Email is inferred from MANAGER_EMAIL_MAP (historic data) when available
+    - Email is the linked user's, else inferred from the historic import data
 
-    This will later be replaced / enriched once SSO is implemented and
-    managers are linked directly to User records.
+    Served from the in-process manager directory.
     """
     with get_session() as session:
-        managers = list(session.execute(select(Manager)).scalars())
-
-        # Preload cardholder counts for each manager so the Admin/Finance UI
-        # can see which managers are actively used.
-        manager_ids = [m.id for m in managers]
-        counts: dict[int, int] = {}
-        if manager_ids:
-            rows = session.execute(
-                select(CardholderManager.manager_id)
-                .where(CardholderManager.manager_id.in_(manager_ids))
-            ).scalars()
-            for manager_id in rows:
-                counts[manager_id] = counts.get(manager_id, 0) + 1
-
-        items: List[ManagerOut] = []
-        for m in managers:
-            email = MANAGER_EMAIL_MAP.get(m.id)
-            # ManagerOut currently does not require cardholder_count, but if it
-            # is later extended, we can easily enrich it here.
-            items.append(
-                ManagerOut(
-                    id=m.id,
-                    user_id=m.user_id,
-                    email=email,
-                )
+        return manager_directory(session).managers()
+
+
+@router.put("/{manager_id}/parent", response_model=ManagerOut)
+async def set_manager_parent(manager_id: int, payload: ManagerParentUpdate) -> ManagerOut:
+    """
+    Set the manager this manager reports to (or clear it with null).
+
+    The manager then sees everything beneath them in their inbox, and so does
+    everyone above them. A manager cannot report to themselves or to anyone
+    beneath them.
+    """
+    with get_session() as session:
+        manager = session.get(Manager, manager_id)
+        if not manager:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Manager with id {manager_id} not found.",
             )
-    return items
+        
+        parent_id = payload.parent_manager_id
+        if parent_id is not None:
+            if not session.get(Manager, parent_id):
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Manager with id {parent_id} not found.",
+                )
+            if is_under(session, parent_id, manager_id):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Manager {parent_id} reports to manager {manager_id}; that would create a cycle.",
+                )
+        
+        # The closure rows follow the change in the same flush.
+        manager.parent_manager_id = parent_id
+        session.flush()
+        return manager_directory(session).manager(manager_id)
 
 
 @router.get("/{manager_id}/accounts", response_model=List[ManagerAccountOut])
@@ -87,12 +88,8 @@ async def list_manager_accounts(manager_id: int) -> List[ManagerAccountOut]:
                 detail=f"Manager with id {manager_id} not found.",
             )
 
-        # Find all cardholders linked to this manager
-        cardholder_ids = session.execute(
-            select(CardholderManager.cardholder_id).where(
-                CardholderManager.manager_id == manager_id
-            )
-        ).scalars().all()
+        # Find all cardholders under this manager (including via managers beneath them)
+        cardholder_ids = session.execute(managed_cardholder_ids(manager_id).distinct()).scalars().all()
 
         if not cardholder_ids:
             return []
@@ -125,9 +122,15 @@ async def list_manager_accounts(manager_id: int) -> List[ManagerAccountOut]:
 
 # Manager Inbox endpoints
 @router.get("/{manager_id}/inbox", response_model=dict)
-async def get_manager_inbox(manager_id: int) -> dict:
+async def get_manager_inbox(
+    manager_id: int,
+    max_depth: Optional[int] = Query(default=None, ge=0, description="0 = own cardholders only; all levels when omitted"),
+) -> dict:
     """
     Get Manager inbox: list of cardholder batches awaiting approval.
+
+    Includes batches of cardholders under managers who report to this one,
+    at any depth; `depth` is 0 for the manager's own cardholders.
     """
     with get_session() as session:
         manager = session.get(Manager, manager_id)
@@ -137,59 +140,77 @@ async def get_manager_inbox(manager_id: int) -> dict:
                 detail=f"Manager with id {manager_id} not found.",
             )
         
-        # Get cardholder IDs for this manager
-        cardholder_ids = list(
-            session.execute(
-                select(CardholderManager.cardholder_id).where(
-                    CardholderManager.manager_id == manager_id
-                )
-            ).scalars()
+        # Submitted batches under this manager, with the shallowest level each is reached at.
+        conditions = [
+            ManagerHierarchy.ancestor_id == manager_id,
+            ClassificationBatch.owner_type == "cardholder",
+            ClassificationBatch.status == "completed",
+        ]
+        if max_depth is not None:
+            conditions.append(ManagerHierarchy.depth <= max_depth)
+        under = (
+            select(ClassificationBatch.id.label("batch_id"), func.min(ManagerHierarchy.depth).label("depth"))
+            .join(CardholderManager, CardholderManager.cardholder_id == ClassificationBatch.owner_id)
+            .join(ManagerHierarchy, ManagerHierarchy.descendant_id == CardholderManager.manager_id)
+            .where(*conditions)
+            .group_by(ClassificationBatch.id)
+            .subquery("under")
         )
+        display_name = cardholder_display_name()
         
-        if not cardholder_ids:
-            return {"items": []}
-        
-        # Get batches for these cardholders that are completed (submitted)
-        batches = list(
-            session.execute(
-                select(ClassificationBatch).where(
-                    ClassificationBatch.owner_type == "cardholder",
-                    ClassificationBatch.owner_id.in_(cardholder_ids),
-                    ClassificationBatch.status == "completed"
-                ).order_by(ClassificationBatch.submitted_at.desc())
-            ).scalars()
-        )
+        rows = session.execute(
+            select(
+                ClassificationBatch.id,
+                ClassificationBatch.owner_id,
+                display_name,
+                ClassificationBatch.transaction_count,
+                ClassificationBatch.debit_total,
+                ClassificationBatch.credit_total,
+                ClassificationBatch.status,
+                ClassificationBatch.submitted_at,
+                ClassificationBatch.title,
+                ClassificationBatch.label,
+                under.c.depth,
+            )
+            .join(under, under.c.batch_id == ClassificationBatch.id)
+            .outerjoin(Cardholder, Cardholder.id == ClassificationBatch.owner_id)
+            .order_by(ClassificationBatch.submitted_at.desc())
+        ).all()
         
         items = []
-        for batch in batches:
-            cardholder = session.get(Cardholder, batch.owner_id)
-            tx_count = session.execute(
-                select(func.count(Classification.transaction_id)).where(
-                    Classification.batch_id == batch.id
-                )
-            ).scalar() or 0
-            
+        for batch_id, cardholder_id, cardholder_name, tx_count, debit_total, credit_total, batch_status, submitted_at, title, label, depth in rows:
             items.append({
-                "batch_id": batch.id,
-                "cardholder_id": batch.owner_id,
-                "cardholder_display_name": cardholder.get_display_name() if cardholder else f"Cardholder {batch.owner_id}",
+                "batch_id": batch_id,
+                "cardholder_id": cardholder_id,
+                "cardholder_display_name": cardholder_name or f"Cardholder {cardholder_id}",
                 "transaction_count": tx_count,
-                "status": batch.status,
-                "submitted_at": batch.submitted_at,
-                "title": batch.title,
-                "label": batch.label,
+                "debit_total": float(debit_total or 0),
+                "credit_total": float(credit_total or 0),
+                "status": batch_status,
+                "submitted_at": submitted_at,
+                "title": title,
+                "label": label,
+                "depth": depth,
             })
     
     return {"items": items}
 
 
-@router.get("/{manager_id}/batches/{batch_id}/items", response_model=dict)
+@router.get("/{manager_id}/batches/{batch_id}/items")
 async def get_manager_batch_items(
     manager_id: int,
     batch_id: int,
-) -> dict:
+    sort: str = Query(default="date", pattern="^(date|amount)$"),
+    order: str = Query(default="asc", pattern="^(asc|desc)$"),
+    cursor: Optional[str] = Query(default=None, description="next_cursor from the previous page"),
+    limit: Optional[int] = Query(default=None, ge=1, le=5000, description="Page size; all items when omitted"),
+) -> StreamingResponse:
     """
     Get Format 2 items for a manager batch review.
+
+    Items come from one joined query, sorted by `sort` (date or amount) and
+    streamed as {"items": [...], "next_cursor": ...}. With `limit`, pass the
+    returned `next_cursor` as `cursor` to fetch the next page.
     """
     with get_session() as session:
         batch = session.get(ClassificationBatch, batch_id)
@@ -207,32 +228,66 @@ async def get_manager_batch_items(
             )
         
         # Check if cardholder is under this manager
-        link = session.execute(
-            select(CardholderManager).where(
-                CardholderManager.manager_id == manager_id,
-                CardholderManager.cardholder_id == batch.owner_id
-            ).limit(1)
-        ).scalar_one_or_none()
-        
-        if not link:
+        if not manages_cardholder(session, manager_id, batch.owner_id):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Batch does not belong to a cardholder under this manager.",
             )
-        
-        classifications = list(
-            session.execute(
-                select(Classification).where(Classification.batch_id == batch_id)
-            ).scalars()
+
+    after = None
+    if cursor:
+        try:
+            after = parse_item_cursor(sort, cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid cursor: {cursor}",
+            )
+    
+    return StreamingResponse(
+        stream_batch_items(batch_id, sort, order == "desc", after, limit),
+        media_type="application/json",
+    )
+
+
+def _transition_batch(
+    session,
+    batch: ClassificationBatch,
+    action: str,
+    batch_values: dict,
+    classification_values: dict,
+) -> list[int]:
+    """
+    Move a submitted ("completed") batch and all of its classifications to a
+    new status with two UPDATE statements.
+
+    The batch UPDATE is guarded by status = 'completed', so a concurrent
+    approve/reject of the same batch changes nothing and gets a 400. Returns
+    the ids of the transactions whose classifications were updated.
+    """
+    moved = session.execute(
+        update(ClassificationBatch)
+        .where(ClassificationBatch.id == batch.id, ClassificationBatch.status == "completed")
+        .values(**batch_values)
+    ).rowcount
+    if not moved:
+        session.refresh(batch)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Batch must be in 'completed' status to {action}. Current status: {batch.status}",
         )
-        
-        items: List[Format2Item] = []
-        for classification in classifications:
-            transaction = session.get(Transaction, classification.transaction_id)
-            if transaction:
-                items.append(project_to_format2(transaction, classification))
-        
-        return {"items": items}
+
+    transaction_ids = list(
+        session.execute(
+            update(Classification)
+            .where(Classification.batch_id == batch.id)
+            .values(**classification_values)
+            .returning(Classification.transaction_id)
+            .execution_options(synchronize_session=False)
+        ).scalars()
+    )
+    refresh_batch_counters(session, [batch.id])
+    return transaction_ids
 
 
 @router.post("/{manager_id}/batches/{batch_id}/approve", response_model=ClassificationBatchOut)
@@ -241,7 +296,8 @@ async def approve_manager_batch(
     batch_id: int,
 ) -> ClassificationBatchOut:
     """
-    Approve a cardholder batch. Marks batch and all classifications as manager_approved.
+    Approve a cardholder batch. Marks batch and all classifications as manager_approved
+    and derives their Pronto fields (FinanceExtension, ready_for_pronto).
     """
     with get_session() as session:
         batch = session.get(ClassificationBatch, batch_id)
@@ -258,47 +314,28 @@ async def approve_manager_batch(
                 detail="Batch is not a cardholder batch.",
             )
         
-        link = session.execute(
-            select(CardholderManager).where(
-                CardholderManager.manager_id == manager_id,
-                CardholderManager.cardholder_id == batch.owner_id
-            ).limit(1)
-        ).scalar_one_or_none()
-        
-        if not link:
+        if not manages_cardholder(session, manager_id, batch.owner_id):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Batch does not belong to a cardholder under this manager.",
             )
         
         # Status guard: only completed (submitted) batches can be approved
-        if batch.status != "completed":
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Batch must be in 'completed' status to approve. Current status: {batch.status}",
-            )
-        
-        # Update batch
-        batch.status = "approved"
-        batch.approved_at = datetime.utcnow()
-        
-        # Update all classifications in batch
-        classifications = list(
-            session.execute(
-                select(Classification).where(Classification.batch_id == batch_id)
-            ).scalars()
+        now = datetime.utcnow()
+        transaction_ids = _transition_batch(
+            session,
+            batch,
+            "approve",
+            {"status": "approved", "approved_at": now},
+            {"status": "manager_approved", "source": "manager", "last_updated_at": now},
         )
         
-        for classification in classifications:
-            classification.status = "manager_approved"
-            classification.source = "manager"
-            classification.last_updated_at = datetime.utcnow()
-        
-        session.flush()
+        derive_batch_finance_fields(session, batch_id)
+        refresh_format3_rows(session, transaction_ids)
         
-        tx_count = len(classifications)
+        tx_count = len(transaction_ids)
         
-        return ClassificationBatchOut(
+        result = ClassificationBatchOut(
             id=batch.id,
             owner_type=batch.owner_type,
             owner_id=batch.owner_id,
@@ -315,6 +352,9 @@ async def approve_manager_batch(
             approved_at=batch.approved_at,
             transaction_count=tx_count,
         )
+    
+    mark_similarity_index_stale()
+    return result
 
 
 @router.post("/{manager_id}/batches/{batch_id}/reject", response_model=ClassificationBatchOut)
@@ -342,54 +382,33 @@ async def reject_manager_batch(
                 detail="Batch is not a cardholder batch.",
             )
         
-        link = session.execute(
-            select(CardholderManager).where(
-                CardholderManager.manager_id == manager_id,
-                CardholderManager.cardholder_id == batch.owner_id
-            ).limit(1)
-        ).scalar_one_or_none()
-        
-        if not link:
+        if not manages_cardholder(session, manager_id, batch.owner_id):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Batch does not belong to a cardholder under this manager.",
             )
         
-        # Status guard: only completed (submitted) batches can be rejected
-        if batch.status != "completed":
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Batch must be in 'completed' status to reject. Current status: {batch.status}",
-            )
-        
         if not payload.reason or not payload.reason.strip():
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Rejection reason is required.",
             )
         
-        # Update batch
-        batch.status = "rejected"
-        batch.rejection_reason = payload.reason.strip()
-        
-        # Update all classifications in batch
-        classifications = list(
-            session.execute(
-                select(Classification).where(Classification.batch_id == batch_id)
-            ).scalars()
+        # Status guard: only completed (submitted) batches can be rejected
+        reason = payload.reason.strip()
+        transaction_ids = _transition_batch(
+            session,
+            batch,
+            "reject",
+            {"status": "rejected", "rejection_reason": reason},
+            {"status": "rejected", "rejection_reason": reason, "source": "manager", "last_updated_at": datetime.utcnow()},
         )
         
-        for classification in classifications:
-            classification.status = "rejected"
-            classification.rejection_reason = payload.reason.strip()
-            classification.source = "manager"
-            classification.last_updated_at = datetime.utcnow()
-        
-        session.flush()
+        refresh_format3_rows(session, transaction_ids)
         
-        tx_count = len(classifications)
+        tx_count = len(transaction_ids)
         
-        return ClassificationBatchOut(
+        result = ClassificationBatchOut(
             id=batch.id,
             owner_type=batch.owner_type,
             owner_id=batch.owner_id,
@@ -406,5 +425,8 @@ async def reject_manager_batch(
             approved_at=batch.approved_at,
             transaction_count=tx_count,
         )
+    
+    mark_similarity_index_stale()
+    return result
 
 
@@ -1,9 +1,30 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Query, status
+
+from app.db import get_session
+from app.models import MLTrainingRun
+from app.services.ml_training import queue_training_run, start_training_process
 
 
 router = APIRouter()
 
 
+def _run_out(run: MLTrainingRun) -> dict:
+    return {
+        "run_id": run.id,
+        "status": run.status,
+        "full_retrain": run.full_retrain,
+        "watermark_from": run.watermark_from,
+        "watermark_to": run.watermark_to,
+        "base_model_version": run.base_model_version,
+        "model_version": run.model_version,
+        "examples_trained": run.examples_trained,
+        "error": run.error,
+        "created_at": run.created_at,
+        "started_at": run.started_at,
+        "completed_at": run.completed_at,
+    }
+
+
 @router.post("/predict")
 async def predict() -> dict:
     """
@@ -14,11 +35,40 @@ async def predict() -> dict:
 
 
 @router.post("/train")
-async def train() -> dict:
+async def train(
+    full: bool = Query(default=False, description="Rebuild from the cached training dataset instead of updating incrementally"),
+) -> dict:
     """
-    MVP stub:
-    - Triggers ML model training.
+    Queue an incremental training run.
+
+    Training runs in a separate process on classifications confirmed or
+    approved since the last completed run; the new model version is swapped
+    into API workers once published. The first run (or `full=true`) trains a
+    fresh model from the historic workbooks plus all confirmed classifications.
+    Only one run is queued at a time: if a run is already pending or running,
+    that run is returned instead.
     """
-    return {"message": "Stub: ML training triggered"}
+    with get_session() as session:
+        run, created = queue_training_run(session, full_retrain=full)
+        if not created:
+            return {**_run_out(run), "message": "Training already in progress"}
+        result = _run_out(run)
+
+    # The run row is committed before the worker starts so it can load it.
+    start_training_process(result["run_id"])
+    return {**result, "message": "Training queued"}
 
 
+@router.get("/train/{run_id}")
+async def get_training_run(run_id: int) -> dict:
+    """
+    Return status and watermarks for a training run.
+    """
+    with get_session() as session:
+        run = session.get(MLTrainingRun, run_id)
+        if not run:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Training run {run_id} not found.",
+            )
+        return _run_out(run)
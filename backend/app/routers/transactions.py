@@ -6,8 +6,9 @@ from fastapi import APIRouter, Query, Header
 from sqlalchemy import select, or_
 
 from app.db import get_session
-from app.models import Transaction, Cardholder, Manager, CardholderManager, Account
+from app.models import Transaction, Cardholder, Manager, Account
 from app.schemas import TransactionOut
+from app.services.manager_hierarchy import managed_cardholder_ids
 
 
 router = APIRouter()
@@ -47,12 +48,8 @@ async def list_transactions(
 
         # Role-based filtering
         if manager_id:
-            # Manager view: Get all cardholders assigned to this manager
-            cardholder_links = session.execute(
-                select(CardholderManager.cardholder_id).where(
-                    CardholderManager.manager_id == manager_id
-                )
-            ).scalars().all()
+            # Manager view: Get all cardholders under this manager (at any depth)
+            cardholder_links = session.execute(managed_cardholder_ids(manager_id).distinct()).scalars().all()
             
             if cardholder_links:
                 # Get bank account numbers for these cardholders
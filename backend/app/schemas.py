@@ -27,11 +27,17 @@ class ManagerOut(BaseModel):
     id: int
     user_id: Optional[int] = None
     email: Optional[str] = None  # Manager email (from mapping until SSO is implemented)
+    parent_manager_id: Optional[int] = None  # Manager this one reports to
 
     class Config:
         from_attributes = True
 
 
+class ManagerParentUpdate(BaseModel):
+    """Set (or clear, with null) the manager a manager reports to."""
+    parent_manager_id: Optional[int] = None
+
+
 class CardholderOut(BaseModel):
     id: int
     name: str
@@ -45,6 +51,13 @@ class CardholderOut(BaseModel):
         from_attributes = True
 
 
+class CardholderSuggestion(BaseModel):
+    """Autocomplete entry."""
+    id: int
+    display_name: str
+    email: str
+
+
 class CardholderCreate(BaseModel):
     name: str
     surname: str
@@ -105,6 +118,34 @@ class Format2Item(BaseModel):
         from_attributes = True
 
 
+class Format3Item(BaseModel):
+    """Format 3 view: Format 2 fields plus FinanceExtension (Pronto) fields."""
+    transaction_id: int
+    import_job_id: Optional[int] = None
+    date: date
+    bank_account: str
+    narrative: str
+    debit_amount: Optional[float] = None
+    credit_amount: Optional[float] = None
+    description: Optional[str] = None
+    project: Optional[str] = None
+    cost_category: Optional[str] = None
+    gl_account: Optional[str] = None
+    status: str
+    account: Optional[str] = None
+    reference: Optional[str] = None
+    tax: Optional[float] = None
+    amount: Optional[float] = None
+    tax_code: Optional[str] = None
+    cbs: Optional[str] = None
+    export_batch_id: Optional[int] = None
+    ready_for_pronto: bool = False
+    exported_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
 # Classification batch schemas
 class ClassificationBatchOut(BaseModel):
     id: int
@@ -137,6 +178,11 @@ class ClassificationBatchCreate(BaseModel):
     transaction_ids: Optional[list[int]] = None  # Transactions to include in batch
 
 
+class BatchReleaseRequest(BaseModel):
+    cardholder_ids: Optional[list[int]] = None  # Release to all cardholders with transactions when omitted
+    label: Optional[str] = None
+
+
 class ClassificationBatchUpdate(BaseModel):
     status: Optional[str] = None
     title: Optional[str] = None
@@ -158,5 +204,74 @@ class BatchRejectRequest(BaseModel):
     reason: str  # Required rejection note
 
 
+class MLPredictionOut(BaseModel):
+    predicted_value: str
+    confidence: float
+    model_version: Optional[str] = None
+    predicted_at: datetime
+
+    class Config:
+        protected_namespaces = ()
+
+
+class PredictionAlternativesOut(BaseModel):
+    """Latest recorded prediction run for a transaction, alternatives per field."""
+    transaction_id: int
+    predictions: dict[str, list[MLPredictionOut]]
+
+
+
+
+class SimilarTransactionOut(BaseModel):
+    transaction_id: int
+    date: date
+    narrative: str
+    debit_amount: Optional[float] = None
+    credit_amount: Optional[float] = None
+    description: Optional[str] = None
+    project: Optional[str] = None
+    cost_category: Optional[str] = None
+    gl_account: Optional[str] = None
+    status: str
+    similarity: float
 
 
+class SimilarTransactionsOut(BaseModel):
+    """Previously confirmed transactions with the most similar narratives, best first."""
+    transaction_id: int
+    items: list[SimilarTransactionOut]
+
+
+class ExportBatchCreate(BaseModel):
+    """Filters for the ready rows to include; all ready rows when omitted."""
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    import_job_id: Optional[int] = None
+    created_by_user_id: Optional[int] = None
+
+
+class ExportBatchOut(BaseModel):
+    id: int
+    format: str
+    file_name: Optional[str] = None
+    checksum: Optional[str] = None
+    file_size: Optional[int] = None
+    record_count: Optional[int] = None
+    created_at: datetime
+    created_by_user_id: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+
+class SpendReportRow(BaseModel):
+    """One group of a spend report; dimensions not grouped by are None."""
+    period_start: Optional[date] = None
+    account_id: Optional[int] = None
+    cardholder_id: Optional[int] = None
+    manager_id: Optional[int] = None
+    cost_category: Optional[str] = None
+    gl_account: Optional[str] = None
+    transaction_count: int
+    debit_total: float
+    credit_total: float
@@ -0,0 +1,31 @@
+"""
+Matching of statement bank accounts to card accounts.
+
+Bank CSVs and the accounts table do not always carry the same form of a card
+number (full number vs. last four digits), so throughout the app a
+transaction belongs to an account when both end in the same four characters.
+These helpers express that rule in SQL so it can be used as a join condition
+instead of building one LIKE clause per account.
+"""
+from __future__ import annotations
+
+from sqlalchemy import and_, func
+from sqlalchemy.sql import ColumnElement
+
+
+def last4(column) -> ColumnElement:
+    """
+    Last four characters of a string column.
+
+    substr/length behave the same on Postgres and SQLite, unlike right().
+    """
+    return func.substr(column, func.length(column) - 3)
+
+
+def account_matches(bank_account_column, account_number_column) -> ColumnElement:
+    """Join condition: a transaction's bank account matches a card account by last 4 digits."""
+    return and_(
+        func.length(bank_account_column) >= 4,
+        func.length(account_number_column) >= 4,
+        last4(bank_account_column) == last4(account_number_column),
+    )
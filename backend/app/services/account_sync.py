@@ -0,0 +1,96 @@
+"""
+Set-based bootstrapping of card accounts from the ledger.
+
+sync_accounts_from_transactions() creates the missing accounts with one
+INSERT ... SELECT DISTINCT, and link_transactions_to_accounts() points
+unlinked transactions at their account with UPDATE ... FROM, so neither
+loads transactions into Python however large the ledger is. Only the spend
+rollup slices of the linked transactions are recomputed.
+
+Matching follows app.services.account_matching (same last four characters),
+preferring, in order: the account with exactly the statement's number, an
+account recorded as just the last four digits, then the oldest account.
+"""
+from __future__ import annotations
+
+from sqlalchemy import case, exists, func, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from app.models import Account, Transaction
+from app.services.account_matching import account_matches, last4
+from app.services.spend_rollups import refresh_spend_rollups
+
+
+def sync_accounts_from_transactions(session: Session) -> int:
+    """
+    Create an Account (labelled with its number) for each distinct
+    Transaction.bank_account that no existing account matches.
+    Returns the number of accounts created.
+    """
+    matched = exists().where(
+        or_(
+            Account.bank_account_number == Transaction.bank_account,
+            account_matches(Transaction.bank_account, Account.bank_account_number),
+        )
+    )
+    return session.execute(
+        insert(Account).from_select(
+            ["bank_account_number", "label"],
+            select(Transaction.bank_account, Transaction.bank_account)
+            .where(Transaction.bank_account.is_not(None), ~matched)
+            .distinct(),
+        )
+    ).rowcount
+
+
+def link_transactions_to_accounts(session: Session) -> int:
+    """
+    Set account_id on every transaction that has none and matches an account.
+    Returns the number of transactions linked.
+    """
+    preference = case(
+        (Account.bank_account_number == Transaction.bank_account, 0),
+        (Account.bank_account_number == last4(Transaction.bank_account), 1),
+        else_=2,
+    )
+    ranked = (
+        select(
+            Transaction.id.label("transaction_id"),
+            Account.id.label("account_id"),
+            func.row_number()
+            .over(partition_by=Transaction.id, order_by=(preference, Account.id))
+            .label("rank"),
+        )
+        .join(Account, account_matches(Transaction.bank_account, Account.bank_account_number))
+        .where(Transaction.account_id.is_(None))
+        .subquery("ranked")
+    )
+    linked = list(
+        session.execute(
+            update(Transaction)
+            .where(Transaction.id == ranked.c.transaction_id, ranked.c.rank == 1)
+            .values(account_id=ranked.c.account_id)
+            .returning(Transaction.id)
+            .execution_options(synchronize_session=False)
+        ).scalars()
+    )
+
+    # Numbers shorter than four characters only ever match exactly.
+    exact = (
+        select(Account.bank_account_number, func.min(Account.id).label("account_id"))
+        .where(func.length(Account.bank_account_number) < 4)
+        .group_by(Account.bank_account_number)
+        .subquery("exact")
+    )
+    linked += session.execute(
+        update(Transaction)
+        .where(Transaction.account_id.is_(None), Transaction.bank_account == exact.c.bank_account_number)
+        .values(account_id=exact.c.account_id)
+        .returning(Transaction.id)
+        .execution_options(synchronize_session=False)
+    ).scalars()
+
+    if linked:
+        # Rollups are sliced by account: the linked rows move out of the unlinked slices.
+        refresh_spend_rollups(session, linked, was_unlinked=True)
+    return len(linked)
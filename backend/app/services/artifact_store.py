@@ -0,0 +1,113 @@
+"""
+Local content-addressed artifact store for generated files (Pronto exports).
+
+Artifacts are stored once under their SHA-256:
+
+    <artifact dir>/<first two hex chars>/<sha256><suffix>
+
+and made read-only, so a stored artifact never changes and identical files
+share one copy. Files are produced in a staging directory on the same
+filesystem and moved into place atomically.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from pathlib import Path
+from typing import Iterator
+
+
+ARTIFACT_DIR = Path(os.getenv("CCC_ARTIFACT_DIR", Path(__file__).resolve().parents[2] / "artifacts"))
+
+# Bytes per read when hashing or serving an artifact.
+ARTIFACT_CHUNK_SIZE = 64 * 1024
+
+
+def staging_path(name: str) -> Path:
+    """Where to build a file before put_artifact() moves it into the store."""
+    staging = ARTIFACT_DIR / ".staging"
+    staging.mkdir(parents=True, exist_ok=True)
+    return staging / name
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(ARTIFACT_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def put_artifact(path: Path, suffix: str = "") -> tuple[str, str, int]:
+    """
+    Move a finished file into the store.
+
+    Returns (key, sha256, size); the key is the path relative to the store and
+    is what callers record. If the content is already stored, the new copy is
+    discarded.
+    """
+    sha256 = _sha256(path)
+    size = path.stat().st_size
+    key = f"{sha256[:2]}/{sha256}{suffix}"
+    destination = ARTIFACT_DIR / key
+    if destination.exists():
+        path.unlink()
+    else:
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, destination)
+        os.chmod(destination, 0o444)
+    return key, sha256, size
+
+
+def artifact_path(key: str) -> Path:
+    """Absolute path of a stored artifact; rejects keys that escape the store."""
+    root = ARTIFACT_DIR.resolve()
+    path = (root / key).resolve()
+    if root not in path.parents:
+        raise ValueError(f"Invalid artifact key: {key}")
+    return path
+
+
+def parse_byte_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    Parse a single-range "bytes=start-end" Range header into inclusive offsets.
+
+    Returns None when the header should be ignored (other units, multiple
+    ranges, malformed) so the full file is served, and raises ValueError when
+    the range is not satisfiable for a file of `size` bytes.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, dash, end_text = spec.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        start = int(start_text) if start_text else None
+        end = int(end_text) if end_text else None
+    except ValueError:
+        return None
+
+    if start is None:
+        # Suffix range: the last `end` bytes.
+        if end is None:
+            return None
+        if end == 0 or size == 0:
+            raise ValueError(header)
+        return max(0, size - end), size - 1
+    if start >= size or (end is not None and end < start):
+        raise ValueError(header)
+    return start, size - 1 if end is None else min(end, size - 1)
+
+
+def iter_artifact(path: Path, start: int = 0, end: int | None = None) -> Iterator[bytes]:
+    """Yield bytes start..end (inclusive) of a stored artifact in chunks."""
+    with path.open("rb") as handle:
+        handle.seek(start)
+        remaining = (end if end is not None else path.stat().st_size - 1) - start + 1
+        while remaining > 0:
+            chunk = handle.read(min(ARTIFACT_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
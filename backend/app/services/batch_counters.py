@@ -0,0 +1,98 @@
+"""
+Denormalised line counters on ClassificationBatch.
+
+Each batch carries transaction_count, per-status counts of its
+classifications and the debit/credit totals of its transactions, so inboxes
+and status checks read one row instead of aggregating classifications.
+
+Every write that moves classifications between batches or changes their
+status calls refresh_batch_counters() for the batches it touched, in the same
+transaction. That recomputes just those batches with one grouped
+UPDATE ... FROM. refresh_batch_counters(session) with no ids is the repair job:
+it recomputes every batch, for backfills and after out-of-band changes.
+"""
+from __future__ import annotations
+
+from typing import Iterable
+
+from sqlalchemy import case, func, select, update
+from sqlalchemy.orm import Session
+
+from app.models import Classification, ClassificationBatch, Transaction
+
+
+# Counter column -> classification statuses it counts (None: never classified).
+STATUS_COUNTERS = {
+    "unclassified_count": ("unclassified", None),
+    "predicted_count": ("predicted",),
+    "confirmed_count": ("user_confirmed",),
+    "approved_count": ("manager_approved",),
+    "rejected_count": ("rejected",),
+}
+
+COUNTER_FIELDS = ("transaction_count", *STATUS_COUNTERS, "debit_total", "credit_total")
+
+
+def _status_count(statuses: tuple[str | None, ...]):
+    named = [value for value in statuses if value is not None]
+    condition = Classification.status.in_(named)
+    if None in statuses:
+        condition = condition | Classification.status.is_(None)
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def _counters(batch_ids: list[int] | None):
+    """Counter values per batch with at least one classification."""
+    stmt = (
+        select(
+            Classification.batch_id.label("batch_id"),
+            func.count(Classification.transaction_id).label("transaction_count"),
+            *(_status_count(statuses).label(field) for field, statuses in STATUS_COUNTERS.items()),
+            func.coalesce(func.sum(Transaction.debit_amount), 0).label("debit_total"),
+            func.coalesce(func.sum(Transaction.credit_amount), 0).label("credit_total"),
+        )
+        .join(Transaction, Transaction.id == Classification.transaction_id)
+        .where(Classification.batch_id.is_not(None))
+        .group_by(Classification.batch_id)
+    )
+    if batch_ids is not None:
+        stmt = stmt.where(Classification.batch_id.in_(batch_ids))
+    return stmt.subquery("counters")
+
+
+def refresh_batch_counters(session: Session, batch_ids: Iterable[int | None] | None = None) -> int:
+    """
+    Recompute the counters of the given batches (every batch when None).
+    Returns the number of batches updated.
+    """
+    if batch_ids is not None:
+        batch_ids = sorted({batch_id for batch_id in batch_ids if batch_id is not None})
+        if not batch_ids:
+            return 0
+
+    # Pending ORM changes (new lines, status edits) must be counted.
+    session.flush()
+    counters = _counters(batch_ids)
+    updated = session.execute(
+        update(ClassificationBatch)
+        .where(ClassificationBatch.id == counters.c.batch_id)
+        .values({field: counters.c[field] for field in COUNTER_FIELDS})
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    # Batches left with no lines.
+    emptied = update(ClassificationBatch).where(
+        ClassificationBatch.id.not_in(select(counters.c.batch_id)),
+        ClassificationBatch.transaction_count != 0,
+    )
+    if batch_ids is not None:
+        emptied = emptied.where(ClassificationBatch.id.in_(batch_ids))
+    updated += session.execute(
+        emptied.values({field: 0 for field in COUNTER_FIELDS}).execution_options(synchronize_session=False)
+    ).rowcount
+
+    # Loaded batches re-read their counters on next access.
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, ClassificationBatch) and (batch_ids is None or obj.id in batch_ids):
+            session.expire(obj, COUNTER_FIELDS)
+    return updated
@@ -0,0 +1,106 @@
+"""
+Format 2 items of a classification batch, for the cardholder and manager
+review screens.
+
+Items are read with one Transaction/Classification join and a server-side
+cursor, and serialised to JSON as they are fetched, so a large batch neither
+costs a query per line nor has to be held in memory as one response body.
+Pages are keyset-based on (sort key, transaction_id); the cursor is
+"<sort value>:<transaction_id>".
+"""
+from __future__ import annotations
+
+import json
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from typing import Iterator
+
+from sqlalchemy import and_, func, or_, select
+
+from app.db import get_session
+from app.models import Classification, Transaction
+from app.services.format2_projection import project_to_format2
+
+
+BATCH_ITEM_SORTS = ("date", "amount")
+
+# Rows fetched per round trip while streaming.
+STREAM_CHUNK_SIZE = 500
+
+
+def _sort_key(sort: str):
+    # Format 2 amount: the debit, else the credit.
+    if sort == "amount":
+        return func.coalesce(Transaction.debit_amount, Transaction.credit_amount, 0)
+    return Transaction.date
+
+
+def parse_item_cursor(sort: str, cursor: str) -> tuple[object, int]:
+    """Split a "<sort value>:<transaction_id>" cursor; raises ValueError if malformed."""
+    value, _, transaction_id = cursor.rpartition(":")
+    try:
+        key = Decimal(value) if sort == "amount" else date.fromisoformat(value)
+    except InvalidOperation:
+        raise ValueError(cursor)
+    return key, int(transaction_id)
+
+
+def _cursor_value(sort: str, item) -> str:
+    if sort == "amount":
+        return str(Decimal(str(item.amount or 0)))
+    return item.date.isoformat()
+
+
+def batch_items_stmt(batch_id: int, sort: str = "date", descending: bool = False, after: tuple | None = None):
+    """Joined select of (Transaction, Classification) for a batch, in keyset order."""
+    key = _sort_key(sort)
+    stmt = (
+        select(Transaction, Classification)
+        .join(Classification, Classification.transaction_id == Transaction.id)
+        .where(Classification.batch_id == batch_id)
+    )
+    if after is not None:
+        after_key, after_id = after
+        if descending:
+            stmt = stmt.where(or_(key < after_key, and_(key == after_key, Transaction.id < after_id)))
+        else:
+            stmt = stmt.where(or_(key > after_key, and_(key == after_key, Transaction.id > after_id)))
+    if descending:
+        return stmt.order_by(key.desc(), Transaction.id.desc())
+    return stmt.order_by(key, Transaction.id)
+
+
+def stream_batch_items(
+    batch_id: int,
+    sort: str = "date",
+    descending: bool = False,
+    after: tuple | None = None,
+    limit: int | None = None,
+) -> Iterator[str]:
+    """
+    Yield the JSON body {"items": [...], "next_cursor": ...} in pieces.
+
+    Runs in its own session because the response is produced after the
+    endpoint returns. next_cursor is null on the last page (and always when
+    `limit` is None, which returns every item).
+    """
+    stmt = batch_items_stmt(batch_id, sort, descending, after)
+    if limit is not None:
+        # One extra row tells us whether another page exists.
+        stmt = stmt.limit(limit + 1)
+
+    yield '{"items": ['
+    written = 0
+    last = None
+    next_cursor = None
+    with get_session() as session:
+        result = session.execute(stmt.execution_options(yield_per=STREAM_CHUNK_SIZE))
+        for transaction, classification in result:
+            if limit is not None and written == limit:
+                next_cursor = f"{_cursor_value(sort, last)}:{last.transaction_id}"
+                break
+            last = project_to_format2(transaction, classification)
+            yield ("," if written else "") + last.model_dump_json()
+            written += 1
+        result.close()
+    yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
@@ -0,0 +1,84 @@
+"""
+Auto-predict every unclassified line of a classification batch.
+
+The batch's narratives are read with one Classification/Transaction join,
+scored in a single predict_top_k_many() call, and written back with one
+executemany UPDATE of classifications plus one bulk insert of the ranked
+alternatives, followed by the Format 3, spend rollup and batch counter
+refreshes. The elapsed time of each phase is returned so slow batches can be
+diagnosed from the response.
+"""
+from __future__ import annotations
+
+import time
+from datetime import datetime
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session
+
+from app.models import Classification, Transaction
+from app.services.batch_counters import refresh_batch_counters
+from app.services.format3_projection import refresh_format3_rows
+from app.services.ml_predictions import prediction_rows, record_predictions
+from app.services.ml_service import active_model, model_version, predict_top_k_many, top_predictions
+from app.services.spend_rollups import refresh_spend_rollups
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+def predict_batch(session: Session, batch_id: int) -> dict:
+    """
+    Predict Format 2 fields for the batch's unclassified classifications.
+
+    Returns {"transaction_ids": [...], "timings_ms": {"fetch", "predict", "write"}}.
+    """
+    started = time.perf_counter()
+    rows = session.execute(
+        select(Classification.transaction_id, Transaction.narrative)
+        .join(Transaction, Transaction.id == Classification.transaction_id)
+        .where(
+            Classification.batch_id == batch_id,
+            or_(Classification.status == "unclassified", Classification.status.is_(None)),
+        )
+        .order_by(Classification.transaction_id)
+    ).all()
+    timings = {"fetch": _elapsed_ms(started)}
+
+    started = time.perf_counter()
+    model = active_model()
+    alternatives = predict_top_k_many([narrative for _, narrative in rows], model=model)
+    timings["predict"] = _elapsed_ms(started)
+
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    version = model_version(model)
+    prediction_log: list[dict] = []
+    values: list[dict] = []
+    for (transaction_id, _), ranked in zip(rows, alternatives):
+        prediction_log.extend(prediction_rows(transaction_id, ranked, version, now))
+        predictions = top_predictions(ranked)
+        values.append(
+            {
+                "transaction_id": transaction_id,
+                "description": predictions.get("description"),
+                "project": predictions.get("project"),
+                "cost_category": predictions.get("cost_category"),
+                "gl_account": predictions.get("gl_account"),
+                "status": "predicted",
+                "source": "ml",
+                "last_updated_at": now,
+            }
+        )
+    if values:
+        # ORM bulk UPDATE by primary key: one executemany statement.
+        session.execute(update(Classification), values)
+    record_predictions(session, prediction_log)
+    transaction_ids = [transaction_id for transaction_id, _ in rows]
+    refresh_format3_rows(session, transaction_ids)
+    refresh_spend_rollups(session, transaction_ids)
+    refresh_batch_counters(session, [batch_id])
+    timings["write"] = _elapsed_ms(started)
+
+    return {"transaction_ids": transaction_ids, "timings_ms": timings}
@@ -0,0 +1,203 @@
+"""
+Set-based assignment of transactions to classification batches.
+
+link_to_batch() attaches transactions to a batch with one upsert. Releasing a
+Finance batch to cardholders creates one cardholder child batch per cardholder with transactions
+in the finance batch's import job, and points each transaction's
+Classification at its cardholder's batch. Everything runs as a handful of
+INSERT ... SELECT / UPDATE ... FROM statements, independent of how many
+transactions or cardholders the import touches. Both refresh the line
+counters of every batch they add lines to or take lines from.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Iterable
+
+from sqlalchemy import exists, func, insert, literal, select, update
+from sqlalchemy.orm import Session
+
+from app.models import Account, Cardholder, Classification, ClassificationBatch, Transaction, cardholder_display_name
+from app.services.account_matching import account_matches
+from app.services.batch_counters import refresh_batch_counters
+from app.services.bulk_ops import upsert_insert
+
+
+# Transaction ids per upsert statement when linking an explicit id list
+# (keeps bound parameters well under SQLite's limit).
+LINK_CHUNK_SIZE = 10000
+
+
+def link_to_batch(
+    session: Session,
+    batch_id: int,
+    transaction_ids: Iterable[int] | None = None,
+    import_job_id: int | None = None,
+) -> int:
+    """
+    Point the classifications of the given transactions (or of every
+    transaction in `import_job_id`) at a batch, creating missing
+    Classification rows, as INSERT ... SELECT ... ON CONFLICT DO UPDATE.
+
+    Ids without a transaction are ignored. Returns the number of rows linked.
+    """
+    source = select(Transaction.id, literal(batch_id), literal("unclassified"))
+    if transaction_ids is None:
+        selects = [source.where(Transaction.import_job_id == import_job_id)]
+    else:
+        ids = sorted(set(transaction_ids))
+        selects = [
+            source.where(Transaction.id.in_(ids[offset:offset + LINK_CHUNK_SIZE]))
+            for offset in range(0, len(ids), LINK_CHUNK_SIZE)
+        ]
+
+    linked = 0
+    touched = {batch_id}
+    for rows in selects:
+        # Batches the lines are taken from.
+        touched.update(
+            session.execute(
+                select(Classification.batch_id)
+                .where(Classification.transaction_id.in_(rows.with_only_columns(Transaction.id)))
+                .distinct()
+            ).scalars()
+        )
+        stmt = upsert_insert(session, Classification).from_select(["transaction_id", "batch_id", "status"], rows)
+        stmt = stmt.on_conflict_do_update(index_elements=["transaction_id"], set_={"batch_id": stmt.excluded.batch_id})
+        linked += session.execute(stmt).rowcount
+    refresh_batch_counters(session, touched)
+    return linked
+
+
+def _owners(import_job_id: int, cardholder_ids: Iterable[int] | None):
+    """
+    (transaction_id, cardholder_id) for each transaction of the import job.
+
+    A transaction whose bank account matches accounts of several cardholders
+    goes to the lowest cardholder id, so every transaction lands in exactly
+    one child batch.
+    """
+    conditions = [
+        Transaction.import_job_id == import_job_id,
+        Account.cardholder_id.is_not(None),
+    ]
+    if cardholder_ids is not None:
+        conditions.append(Account.cardholder_id.in_(list(cardholder_ids)))
+    return (
+        select(Transaction.id.label("transaction_id"), func.min(Account.cardholder_id).label("cardholder_id"))
+        .join(Account, account_matches(Transaction.bank_account, Account.bank_account_number))
+        .where(*conditions)
+        .group_by(Transaction.id)
+        .subquery("owners")
+    )
+
+
+def released_cardholder_ids(session: Session, finance_batch_id: int) -> set[int]:
+    """Cardholders that already have a child batch of this finance batch."""
+    return set(
+        session.execute(
+            select(ClassificationBatch.owner_id).where(
+                ClassificationBatch.parent_batch_id == finance_batch_id,
+                ClassificationBatch.owner_type == "cardholder",
+                ClassificationBatch.owner_id.is_not(None),
+            )
+        ).scalars()
+    )
+
+
+def release_finance_batch(
+    session: Session,
+    finance_batch: ClassificationBatch,
+    cardholder_ids: Iterable[int] | None = None,
+    label: str | None = None,
+    title: str | None = None,
+) -> tuple[list[int], list[int]]:
+    """
+    Create child batches for every cardholder (or the given ones) with
+    transactions in the finance batch's import job, and assign their
+    classifications to those batches. Batches are titled `title`, or
+    "<display name> - Classification".
+
+    Cardholders that already have a child batch are left untouched.
+    Returns (ids of the batches created, cardholder ids skipped as already released).
+    """
+    now = datetime.utcnow()
+    already_released = released_cardholder_ids(session, finance_batch.id)
+    owners = _owners(finance_batch.import_job_id, cardholder_ids)
+
+    pending = select(owners.c.cardholder_id)
+    skipped: list[int] = []
+    if already_released:
+        pending = pending.where(owners.c.cardholder_id.not_in(already_released))
+        skipped = sorted(
+            session.execute(
+                select(owners.c.cardholder_id).where(owners.c.cardholder_id.in_(already_released)).distinct()
+            ).scalars()
+        )
+
+    # 1. One child batch per cardholder still to release.
+    display_name = cardholder_display_name()
+    session.execute(
+        insert(ClassificationBatch).from_select(
+            ["owner_type", "owner_id", "parent_batch_id", "status", "title", "label", "created_at"],
+            select(
+                literal("cardholder"),
+                Cardholder.id,
+                literal(finance_batch.id),
+                literal("open"),
+                literal(title) if title else display_name + " - Classification",
+                literal(label),
+                literal(now),
+            ).where(Cardholder.id.in_(pending.distinct())),
+        )
+    )
+    # Every child batch not in already_released was created just now.
+    created = list(
+        session.execute(
+            select(ClassificationBatch.id)
+            .where(
+                ClassificationBatch.parent_batch_id == finance_batch.id,
+                ClassificationBatch.owner_type == "cardholder",
+                ClassificationBatch.owner_id.not_in(already_released),
+            )
+            .order_by(ClassificationBatch.id)
+        ).scalars()
+    )
+    if not created:
+        return [], skipped
+
+    new_batches = (
+        select(ClassificationBatch.id.label("batch_id"), ClassificationBatch.owner_id)
+        .where(ClassificationBatch.id.in_(created))
+        .subquery("new_batches")
+    )
+    assignments = (
+        select(owners.c.transaction_id, new_batches.c.batch_id)
+        .join(new_batches, new_batches.c.owner_id == owners.c.cardholder_id)
+        .subquery("assignments")
+    )
+
+    # 2. Classification rows for transactions that have never been classified.
+    session.execute(
+        insert(Classification).from_select(
+            ["transaction_id", "status"],
+            select(assignments.c.transaction_id, literal("unclassified")).where(
+                ~exists().where(Classification.transaction_id == assignments.c.transaction_id)
+            ),
+        )
+    )
+
+    # 3. Point every released transaction at its cardholder's batch.
+    previous_batch_ids = session.execute(
+        select(Classification.batch_id)
+        .where(Classification.transaction_id.in_(select(assignments.c.transaction_id)))
+        .distinct()
+    ).scalars().all()
+    session.execute(
+        update(Classification)
+        .where(Classification.transaction_id == assignments.c.transaction_id)
+        .values(batch_id=assignments.c.batch_id)
+        .execution_options(synchronize_session=False)
+    )
+    refresh_batch_counters(session, [*created, *previous_batch_ids])
+    return created, skipped
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import csv
+from io import StringIO
+from typing import Any, Iterable, Sequence
+
+from sqlalchemy import Table, insert
+from sqlalchemy.orm import Session
+
+
+# Above this many rows, Postgres inserts go through COPY instead of executemany.
+COPY_THRESHOLD = 5000
+
+
+def dialect_name(session: Session) -> str:
+    """Name of the database dialect behind the session (e.g. 'postgresql', 'sqlite')."""
+    return session.get_bind().dialect.name
+
+
+def upsert_insert(session: Session, table: Any):
+    """
+    Return a dialect-specific INSERT construct supporting ON CONFLICT clauses.
+
+    Postgres is the production database and SQLite is used for local dev; both
+    dialects expose on_conflict_do_nothing / on_conflict_do_update.
+    """
+    if dialect_name(session) == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+        return sqlite_insert(table)
+
+    from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+    return pg_insert(table)
+
+
+def copy_rows(session: Session, table: Table, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> None:
+    """
+    Stream rows into a Postgres table with COPY ... FROM STDIN.
+
+    Runs on the session's own connection so the rows share its transaction.
+    None is written as an unquoted empty field, which COPY's CSV format reads as NULL.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["" if value is None else value for value in row])
+    buffer.seek(0)
+
+    column_list = ", ".join(columns)
+    dbapi_connection = session.connection().connection
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table.name} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+
+def bulk_insert(session: Session, table: Table, rows: list[dict[str, Any]]) -> int:
+    """
+    Insert many rows in as few round trips as possible.
+
+    Small batches use a single executemany INSERT; large batches on Postgres use COPY.
+    Returns the number of rows written.
+    """
+    if not rows:
+        return 0
+
+    if len(rows) >= COPY_THRESHOLD and dialect_name(session) == "postgresql":
+        columns = list(rows[0].keys())
+        copy_rows(session, table, columns, ([row[column] for column in columns] for row in rows))
+    else:
+        session.execute(insert(table), rows)
+    return len(rows)
@@ -0,0 +1,223 @@
+"""
+Cardholder list for the admin screens, with each cardholder's manager.
+
+One outer-join query (cardholders -> first cardholder_managers link ->
+managers -> users) returns the rows, optionally filtered, sorted and paged.
+Results are cached per (search, sort, order, limit, offset) and dropped when
+a session that wrote to cardholders, cardholder_managers, managers or users
+commits; other worker processes see changes within LISTING_TTL seconds.
+
+Name lookups and autocomplete go through the indexed Cardholder.lookup_key
+(the normalised display name) instead of scanning the table.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Session
+
+from app.models import Cardholder, CardholderManager, Manager, User, cardholder_lookup_key
+from app.schemas import CardholderOut, ManagerOut
+from app.services.orm_invalidation import on_commit_after_write, session_wrote
+
+
+CARDHOLDER_SORTS = ("id", "name", "surname", "email")
+
+# Seconds before a worker re-reads a cached page to see other processes' writes.
+LISTING_TTL = 60.0
+
+# Distinct (search, sort, page) results kept; the least recently used go first.
+LISTING_CACHE_SIZE = 256
+
+# Sorts after any character a lookup key can continue with, closing a prefix range.
+_PREFIX_END = "\U0010ffff"
+
+_SORT_COLUMNS = {
+    "id": (Cardholder.id,),
+    "name": (Cardholder.name, Cardholder.surname, Cardholder.id),
+    "surname": (Cardholder.surname, Cardholder.name, Cardholder.id),
+    "email": (Cardholder.email, Cardholder.id),
+}
+
+_SEARCH_COLUMNS = (Cardholder.name, Cardholder.surname, Cardholder.email, Cardholder.display_name)
+
+
+def cardholder_listing_stmt(
+    search: str | None = None,
+    sort: str = "id",
+    descending: bool = False,
+    limit: int | None = None,
+    offset: int = 0,
+):
+    """
+    Select of cardholder columns plus their first-assigned manager's id,
+    user_id, user email and parent_manager_id (all NULL when unassigned).
+
+    Every whitespace-separated term of `search` must appear, case-insensitively,
+    in the name, surname, email or display name.
+    """
+    first_link = (
+        select(CardholderManager.cardholder_id, func.min(CardholderManager.id).label("link_id"))
+        .group_by(CardholderManager.cardholder_id)
+        .subquery()
+    )
+    stmt = (
+        select(
+            Cardholder.id,
+            Cardholder.name,
+            Cardholder.surname,
+            Cardholder.email,
+            Cardholder.user_id,
+            Cardholder.display_name,
+            Manager.id,
+            Manager.user_id,
+            User.email,
+            Manager.parent_manager_id,
+        )
+        .outerjoin(first_link, first_link.c.cardholder_id == Cardholder.id)
+        .outerjoin(CardholderManager, CardholderManager.id == first_link.c.link_id)
+        .outerjoin(Manager, Manager.id == CardholderManager.manager_id)
+        .outerjoin(User, User.id == Manager.user_id)
+    )
+
+    terms = (search or "").lower().split()
+    if terms:
+        stmt = stmt.where(
+            and_(
+                *(
+                    or_(*(func.lower(column).contains(term, autoescape=True) for column in _SEARCH_COLUMNS))
+                    for term in terms
+                )
+            )
+        )
+
+    columns = _SORT_COLUMNS[sort]
+    stmt = stmt.order_by(*(column.desc() if descending else column for column in columns))
+    if offset:
+        stmt = stmt.offset(offset)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+def _cardholder_out(row) -> CardholderOut:
+    (
+        cardholder_id, name, surname, email, user_id, display_name,
+        manager_id, manager_user_id, manager_email, parent_manager_id,
+    ) = row
+    manager = None
+    if manager_id is not None:
+        manager = ManagerOut(
+            id=manager_id,
+            user_id=manager_user_id,
+            email=manager_email,
+            parent_manager_id=parent_manager_id,
+        )
+    return CardholderOut(
+        id=cardholder_id,
+        name=name,
+        surname=surname,
+        email=email,
+        user_id=user_id,
+        # Same fallback as Cardholder.get_display_name().
+        display_name=display_name or f"{name} {surname}".strip(),
+        manager=manager,
+    )
+
+
+class CardholderListingCache:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pages: OrderedDict[tuple, tuple[float, list[CardholderOut]]] = OrderedDict()
+        # Bumped on every invalidation, so a page read before a commit isn't
+        # stored after it.
+        self.generation = 0
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._pages.clear()
+            self.generation += 1
+
+    def get(self, key: tuple) -> list[CardholderOut] | None:
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is None or time.monotonic() - entry[0] >= LISTING_TTL:
+                return None
+            self._pages.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: tuple, items: list[CardholderOut], generation: int) -> None:
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._pages[key] = (time.monotonic(), items)
+            self._pages.move_to_end(key)
+            while len(self._pages) > LISTING_CACHE_SIZE:
+                self._pages.popitem(last=False)
+
+
+_cache = CardholderListingCache()
+on_commit_after_write("cardholder_listing", (Cardholder, CardholderManager, Manager, User), _cache.invalidate)
+
+
+def list_cardholders(
+    session: Session,
+    search: str | None = None,
+    sort: str = "id",
+    descending: bool = False,
+    limit: int | None = None,
+    offset: int = 0,
+) -> list[CardholderOut]:
+    """Cardholders with their managers, served from the cache when possible."""
+    key = (" ".join((search or "").lower().split()), sort, descending, limit, offset)
+    # A session with uncommitted cardholder writes must see them, and must not
+    # cache them in case they are rolled back.
+    own_writes = session_wrote(session, "cardholder_listing")
+    if not own_writes:
+        items = _cache.get(key)
+        if items is not None:
+            return items
+
+    generation = _cache.generation
+    items = [_cardholder_out(row) for row in session.execute(cardholder_listing_stmt(search, sort, descending, limit, offset))]
+    if not own_writes:
+        _cache.put(key, items, generation)
+    return items
+
+
+def invalidate_cardholder_listing() -> None:
+    _cache.invalidate()
+
+
+def find_cardholder_by_name(session: Session, display_name: str) -> Cardholder | None:
+    """The oldest cardholder whose display name matches, ignoring case and spacing."""
+    return session.execute(
+        select(Cardholder)
+        .where(Cardholder.lookup_key == cardholder_lookup_key(display_name))
+        .order_by(Cardholder.id)
+        .limit(1)
+    ).scalar_one_or_none()
+
+
+def autocomplete_cardholders(session: Session, prefix: str, limit: int = 10) -> list[Cardholder]:
+    """Cardholders whose display name starts with `prefix`, ignoring case and spacing, by name."""
+    key = cardholder_lookup_key(prefix)
+    if not key:
+        return []
+    return list(
+        session.execute(
+            select(Cardholder)
+            .where(
+                # The range is what the index serves; startswith keeps it exact
+                # under collations that sort other strings into it.
+                Cardholder.lookup_key >= key,
+                Cardholder.lookup_key < key + _PREFIX_END,
+                Cardholder.lookup_key.startswith(key, autoescape=True),
+            )
+            .order_by(Cardholder.lookup_key, Cardholder.id)
+            .limit(limit)
+        ).scalars()
+    )
@@ -0,0 +1,98 @@
+"""
+Derive the Format 3 (Pronto) fields of approved transactions.
+
+The rules follow the historic "Credit Card Employees Upload" workbooks:
+
+    Account    project.cost_category; lines without a project are coded straight
+               to a GL account, which is the Pronto account
+    Reference  "<initial> <surname>-<first 15 chars of narrative>-<description>"
+    Amount     bank debit, credits as negatives
+    Tax CODE   F (GST-free) for foreign-currency and bank-fee lines, else T
+    Tax        GST included in the amount (amount / 11) for tax code T, else 0
+
+CBS (cost breakdown) codes are not derived: classifications carry no cost
+breakdown, and Classification.gl_account holds the GL code, not a CBS. The
+column is left as finance entered it.
+
+derive_batch_finance_fields() computes these for a whole batch in a single
+INSERT ... SELECT ... ON CONFLICT DO UPDATE into finance_extensions and marks
+the rows that resolved to an account ready_for_pronto. Rows already claimed
+by an export are left alone.
+"""
+from __future__ import annotations
+
+from sqlalchemy import and_, case, func, literal, or_, select
+from sqlalchemy.orm import Session
+
+from app.models import Cardholder, Classification, ClassificationBatch, FinanceExtension, Transaction
+from app.services.bulk_ops import upsert_insert
+
+
+# Cost categories that never carry GST (bank fees, cash advance fees).
+GST_FREE_COST_CATEGORIES = ("BFEE",)
+
+# Narrative marker the bank adds to foreign-currency lines.
+FOREIGN_MARKER = "%FRGN%"
+
+# Narrative characters quoted in the reference, as in the historic sheets.
+REFERENCE_NARRATIVE_LENGTH = 15
+
+REFERENCE_MAX_LENGTH = 200
+
+_COLUMNS = ["transaction_id", "account", "reference", "tax", "amount", "tax_code", "ready_for_pronto"]
+
+
+def _derived_select(batch_id: int):
+    """Derived FinanceExtension fields for every transaction in the batch, in _COLUMNS order."""
+    has_project = and_(Classification.project.is_not(None), Classification.cost_category.is_not(None))
+    account = case(
+        (has_project, Classification.project + "." + Classification.cost_category),
+        else_=Classification.gl_account,
+    )
+
+    amount = case(
+        (Transaction.debit_amount.is_not(None), Transaction.debit_amount),
+        else_=-Transaction.credit_amount,
+    )
+    gst_free = or_(
+        func.upper(Transaction.narrative).like(FOREIGN_MARKER),
+        Classification.cost_category.in_(GST_FREE_COST_CATEGORIES),
+    )
+    tax_code = case((gst_free, "F"), else_="T")
+    tax = case((gst_free, 0), else_=func.round(amount / 11, 2))
+
+    cardholder = func.substr(Cardholder.name, 1, 1) + " " + Cardholder.surname
+    reference = func.substr(
+        func.coalesce(cardholder, "")
+        + "-"
+        + func.substr(Transaction.narrative, 1, REFERENCE_NARRATIVE_LENGTH)
+        + func.coalesce("-" + Classification.description, ""),
+        1,
+        REFERENCE_MAX_LENGTH,
+    )
+
+    return (
+        # A line without an account can't be uploaded, so it isn't ready.
+        select(Transaction.id, account, reference, tax, amount, tax_code, account.is_not(None))
+        .join(Classification, Classification.transaction_id == Transaction.id)
+        .join(ClassificationBatch, ClassificationBatch.id == Classification.batch_id)
+        .outerjoin(
+            Cardholder,
+            and_(ClassificationBatch.owner_type == literal("cardholder"), Cardholder.id == ClassificationBatch.owner_id),
+        )
+        .where(Classification.batch_id == batch_id)
+    )
+
+
+def derive_batch_finance_fields(session: Session, batch_id: int) -> int:
+    """
+    Upsert derived FinanceExtension rows for every transaction in the batch,
+    ready_for_pronto when an account was derived. Returns the number of rows written.
+    """
+    stmt = upsert_insert(session, FinanceExtension).from_select(_COLUMNS, _derived_select(batch_id))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["transaction_id"],
+        set_={column: stmt.excluded[column] for column in _COLUMNS[1:]},
+        where=FinanceExtension.export_batch_id.is_(None),
+    )
+    return session.execute(stmt).rowcount
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Iterable
+
+from sqlalchemy import delete, false, func, insert, literal, select
+from sqlalchemy.orm import Session
+from sqlalchemy.types import DateTime
+
+from app.models import Classification, FinanceExtension, Format3Row, Transaction
+
+
+# Transactions refreshed per DELETE + INSERT ... SELECT round trip.
+REFRESH_CHUNK_SIZE = 1000
+
+_COLUMNS = [
+    "transaction_id",
+    "import_job_id",
+    "bank_account",
+    "date",
+    "narrative",
+    "debit_amount",
+    "credit_amount",
+    "description",
+    "project",
+    "cost_category",
+    "gl_account",
+    "status",
+    "account",
+    "reference",
+    "tax",
+    "amount",
+    "tax_code",
+    "cbs",
+    "export_batch_id",
+    "ready_for_pronto",
+    "exported_at",
+    "refreshed_at",
+]
+
+
+def _source_select(refreshed_at: datetime):
+    """The Format 3 three-way join, in Format3Row column order."""
+    return (
+        select(
+            Transaction.id,
+            Transaction.import_job_id,
+            Transaction.bank_account,
+            Transaction.date,
+            Transaction.narrative,
+            Transaction.debit_amount,
+            Transaction.credit_amount,
+            Classification.description,
+            Classification.project,
+            Classification.cost_category,
+            Classification.gl_account,
+            func.coalesce(Classification.status, "unclassified"),
+            FinanceExtension.account,
+            FinanceExtension.reference,
+            FinanceExtension.tax,
+            FinanceExtension.amount,
+            FinanceExtension.tax_code,
+            FinanceExtension.cbs,
+            FinanceExtension.export_batch_id,
+            func.coalesce(FinanceExtension.ready_for_pronto, false()),
+            FinanceExtension.exported_at,
+            literal(refreshed_at, DateTime(timezone=True)),
+        )
+        .outerjoin(Classification, Classification.transaction_id == Transaction.id)
+        .outerjoin(FinanceExtension, FinanceExtension.transaction_id == Transaction.id)
+    )
+
+
+def refresh_format3_rows(session: Session, transaction_ids: Iterable[int] | None = None) -> int:
+    """
+    Recompute Format 3 projection rows from the source tables.
+
+    With `transaction_ids`, only those transactions are refreshed (call this
+    after writing their Classification or FinanceExtension); without, the whole
+    projection is rebuilt. Runs in the caller's transaction and returns the
+    number of rows written.
+    """
+    now = datetime.utcnow()
+    if transaction_ids is None:
+        session.execute(delete(Format3Row))
+        result = session.execute(insert(Format3Row).from_select(_COLUMNS, _source_select(now)))
+        return result.rowcount
+
+    ids = sorted(set(transaction_ids))
+    written = 0
+    for offset in range(0, len(ids), REFRESH_CHUNK_SIZE):
+        chunk = ids[offset:offset + REFRESH_CHUNK_SIZE]
+        session.execute(delete(Format3Row).where(Format3Row.transaction_id.in_(chunk)))
+        result = session.execute(
+            insert(Format3Row).from_select(_COLUMNS, _source_select(now).where(Transaction.id.in_(chunk)))
+        )
+        written += result.rowcount
+    return written
+
+
+def refresh_import_job(session: Session, import_job_id: int) -> int:
+    """Refresh the projection rows for every transaction of an import job."""
+    ids = session.execute(select(Transaction.id).where(Transaction.import_job_id == import_job_id)).scalars()
+    return refresh_format3_rows(session, list(ids))
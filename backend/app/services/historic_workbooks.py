@@ -0,0 +1,177 @@
+"""
+Reader for the historic "Credit Card Employees Upload - <Month> - Pronto.xlsx"
+workbooks (Format 3).
+
+Each workbook has one sheet per cardholder laid out as:
+
+    Date | Narrative | Debit Amount | Credit Amount | Description | Project No |
+    Cost Category | GL account | | Account | Reference | Tax | Amount | Tax CODE | ...
+
+plus summary sheets (Header, Full Data, Pronto layout) which are skipped.
+Columns are located by header text, so small layout differences between
+months do not matter.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime
+from pathlib import Path
+from statistics import median
+
+
+HISTORIC_DIR = Path(__file__).resolve().parents[3] / "Historic Credit Card Employees Upload files"
+
+SUMMARY_SHEETS = {"Header", "Full Data", "Pronto layout"}
+
+# Row key -> header text prefix (case-insensitive, after stripping).
+_COLUMNS = {
+    "date": "date",
+    "narrative": "narrative",
+    "debit_amount": "debit amount",
+    "credit_amount": "credit amount",
+    "description": "description",
+    "project": "project no",
+    "cost_category": "cost category",
+    "gl_account": "gl account",
+    "account": "account",
+    "reference": "reference",
+    "tax": "tax",
+    "amount": "amount",
+    "tax_code": "tax code",
+    "cbs": "cbs",
+}
+
+
+def _load_workbook(path: Path):
+    try:
+        import openpyxl
+    except ImportError as e:
+        raise RuntimeError("Reading historic workbooks requires openpyxl (pip install openpyxl).") from e
+    return openpyxl.load_workbook(path, read_only=True, data_only=True)
+
+
+def _header_map(row: tuple) -> dict[str, int] | None:
+    """Map row keys to column indexes if `row` is a cardholder sheet header row."""
+    cells = [(c.strip().lower() if isinstance(c, str) else "") for c in row]
+    if "narrative" not in cells:
+        return None
+
+    mapping: dict[str, int] = {}
+    for key, prefix in _COLUMNS.items():
+        for index, cell in enumerate(cells):
+            # "tax", "amount" and "account" must match exactly so they don't
+            # pick up "Tax CODE" / "Debit Amount" / "GL account" instead.
+            matched = cell == prefix if key in ("tax", "amount", "account") else cell.startswith(prefix)
+            if matched and index not in mapping.values():
+                mapping[key] = index
+                break
+    return mapping
+
+
+def _text(value) -> str | None:
+    """Normalise a label cell: numbers like 1084.0 become "1084", blanks become None."""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value).strip()
+    return text or None
+
+
+def _code(value) -> str | None:
+    """Pronto codes (project, cost category) are typed in mixed case; normalise to upper."""
+    text = _text(value)
+    return text.upper() if text else None
+
+
+def _date(value) -> date | None:
+    """Cell dates are usually real dates, but some sheets hold "d/m/yyyy" strings."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        for fmt in ("%d/%m/%Y", "%d/%m/%y", "%Y-%m-%d"):
+            try:
+                return datetime.strptime(value.strip(), fmt).date()
+            except ValueError:
+                continue
+    return None
+
+
+def _amount(value) -> float | None:
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_workbook(path: Path) -> list[dict]:
+    """
+    Return one dict per coded transaction line in a historic workbook.
+
+    Keys: sheet, date, narrative, debit_amount, credit_amount, description,
+    project, cost_category, gl_account, account, reference, tax, amount,
+    tax_code, cbs.
+    """
+    workbook = _load_workbook(path)
+    rows: list[dict] = []
+    try:
+        for sheet in workbook.worksheets:
+            if sheet.title in SUMMARY_SHEETS:
+                continue
+
+            mapping = None
+            for values in sheet.iter_rows(values_only=True):
+                if mapping is None:
+                    mapping = _header_map(values)
+                    continue
+
+                def cell(key):
+                    index = mapping.get(key)
+                    return values[index] if index is not None and index < len(values) else None
+
+                tx_date = _date(cell("date"))
+                narrative = _text(cell("narrative"))
+                if tx_date is None or not narrative:
+                    continue
+
+                rows.append(
+                    {
+                        "sheet": sheet.title,
+                        "date": tx_date,
+                        "narrative": narrative,
+                        "debit_amount": _amount(cell("debit_amount")),
+                        "credit_amount": _amount(cell("credit_amount")),
+                        "description": _text(cell("description")),
+                        "project": _code(cell("project")),
+                        "cost_category": _code(cell("cost_category")),
+                        "gl_account": _text(cell("gl_account")),
+                        "account": _text(cell("account")),
+                        "reference": _text(cell("reference")),
+                        "tax": _text(cell("tax")),
+                        "amount": _amount(cell("amount")),
+                        "tax_code": _text(cell("tax_code")),
+                        "cbs": _text(cell("cbs")),
+                    }
+                )
+    finally:
+        workbook.close()
+    return rows
+
+
+def workbook_period(rows: list[dict]) -> date | None:
+    """
+    Statement period of a workbook, taken as the median transaction date.
+
+    The Header sheet's Document Date is typed by hand (and is wrong in at least
+    one historic month), so the transactions themselves are the reliable clock.
+    """
+    if not rows:
+        return None
+    return date.fromordinal(int(median(row["date"].toordinal() for row in rows)))
+
+
+def list_workbooks(directory: Path = HISTORIC_DIR) -> list[Path]:
+    return sorted(Path(directory).glob("*.xlsx"))
@@ -0,0 +1,105 @@
+"""
+In-process directory of managers for rendering ManagerOut.
+
+Managers, their user emails and the cardholder -> manager links are loaded
+once into memory, so routers that show managers next to cardholders do
+dictionary lookups instead of a CardholderManager query plus session.get()
+per row.
+
+The directory is invalidated when a session that wrote to managers, users or
+cardholder_managers commits (see app.services.orm_invalidation). Other worker
+processes pick up changes within DIRECTORY_TTL seconds.
+"""
+from __future__ import annotations
+
+import threading
+import time
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import CardholderManager, Manager, User
+from app.schemas import ManagerOut
+from app.services.orm_invalidation import on_commit_after_write, session_wrote
+
+
+# Seconds before a worker reloads the directory to see other processes' writes.
+DIRECTORY_TTL = 60.0
+
+
+class ManagerDirectory:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._managers: dict[int, ManagerOut] = {}
+        self._manager_by_cardholder: dict[int, int] = {}
+        self.loaded_at = float("-inf")
+        self.stale = True
+
+    def invalidate(self) -> None:
+        """Reload on the next lookup."""
+        self.stale = True
+
+    def refresh(self, session: Session, force: bool = False) -> None:
+        now = time.monotonic()
+        # A session that has written directory rows must see its own writes.
+        force = force or session_wrote(session, "manager_directory")
+        if not force and not self.stale and now - self.loaded_at < DIRECTORY_TTL:
+            return
+
+        with self._lock:
+            # Cleared before reading, so a commit landing mid-load marks it stale again.
+            self.stale = False
+            rows = session.execute(
+                select(Manager.id, Manager.user_id, User.email, Manager.parent_manager_id).outerjoin(
+                    User, User.id == Manager.user_id
+                )
+            ).all()
+            links = session.execute(
+                select(CardholderManager.cardholder_id, CardholderManager.manager_id).order_by(CardholderManager.id)
+            ).all()
+
+            managers = {
+                manager_id: ManagerOut(
+                    id=manager_id,
+                    user_id=user_id,
+                    email=email,
+                    parent_manager_id=parent_manager_id,
+                )
+                for manager_id, user_id, email, parent_manager_id in rows
+            }
+            manager_by_cardholder: dict[int, int] = {}
+            for cardholder_id, manager_id in links:
+                # A cardholder shows its first-assigned manager.
+                manager_by_cardholder.setdefault(cardholder_id, manager_id)
+
+            self._managers = managers
+            self._manager_by_cardholder = manager_by_cardholder
+            self.loaded_at = now
+            # Loaded through a session with uncommitted directory writes: don't
+            # keep it past this request, in case they are rolled back.
+            if session_wrote(session, "manager_directory"):
+                self.stale = True
+
+    def manager(self, manager_id: int | None) -> ManagerOut | None:
+        return self._managers.get(manager_id) if manager_id is not None else None
+
+    def managers(self) -> list[ManagerOut]:
+        """All managers, by id."""
+        return [self._managers[manager_id] for manager_id in sorted(self._managers)]
+
+    def manager_for_cardholder(self, cardholder_id: int) -> ManagerOut | None:
+        return self.manager(self._manager_by_cardholder.get(cardholder_id))
+
+
+_directory = ManagerDirectory()
+on_commit_after_write("manager_directory", (Manager, User, CardholderManager), _directory.invalidate)
+
+
+def manager_directory(session: Session) -> ManagerDirectory:
+    """The process-wide directory, reloaded if stale."""
+    _directory.refresh(session)
+    return _directory
+
+
+def invalidate_manager_directory() -> None:
+    _directory.invalidate()
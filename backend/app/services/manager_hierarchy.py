@@ -0,0 +1,85 @@
+"""
+Manager reporting hierarchy, stored as a closure table.
+
+Manager.parent_manager_id is the source of truth; manager_hierarchy holds one
+(ancestor, descendant, depth) row for every pair at any depth, including each
+manager's own (m, m, 0) row. "All cardholders under manager X" is then one
+join: manager_hierarchy(ancestor = X) -> cardholder_managers(manager_id =
+descendant).
+
+The closure rows are kept in step by mapper events in app.models whenever a
+Manager is inserted or its parent_manager_id changes through the ORM. Bulk
+statements bypass those events; run rebuild_manager_hierarchy() after them
+(the migration script does this for existing databases).
+"""
+from __future__ import annotations
+
+from sqlalchemy import delete, insert, literal, select
+from sqlalchemy.orm import Session
+
+from app.models import CardholderManager, Manager, ManagerHierarchy
+
+
+def managed_cardholder_ids(manager_id: int, max_depth: int | None = None):
+    """
+    Select of the cardholder ids under a manager: their own cardholders and,
+    unless `max_depth` is 0, those of every manager beneath them.
+    """
+    stmt = (
+        select(CardholderManager.cardholder_id)
+        .join(ManagerHierarchy, ManagerHierarchy.descendant_id == CardholderManager.manager_id)
+        .where(ManagerHierarchy.ancestor_id == manager_id)
+    )
+    if max_depth is not None:
+        stmt = stmt.where(ManagerHierarchy.depth <= max_depth)
+    return stmt
+
+
+def manages_cardholder(session: Session, manager_id: int, cardholder_id: int | None) -> bool:
+    """Whether the cardholder is under this manager at any depth."""
+    if cardholder_id is None:
+        return False
+    return session.execute(
+        managed_cardholder_ids(manager_id).where(CardholderManager.cardholder_id == cardholder_id).limit(1)
+    ).first() is not None
+
+
+def is_under(session: Session, manager_id: int, ancestor_id: int) -> bool:
+    """Whether `manager_id` is `ancestor_id` or reports to it at any depth."""
+    return session.get(ManagerHierarchy, (ancestor_id, manager_id)) is not None
+
+
+def rebuild_manager_hierarchy(session: Session) -> int:
+    """
+    Recompute every closure row from Manager.parent_manager_id, one depth
+    level per INSERT ... SELECT. Returns the number of rows written.
+    """
+    session.flush()
+    session.execute(delete(ManagerHierarchy))
+    written = session.execute(
+        insert(ManagerHierarchy).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(Manager.id, Manager.id, literal(0)),
+        )
+    ).rowcount
+
+    depth = 0
+    while True:
+        # Extend every path of length `depth` by the ancestor's own parent.
+        step = session.execute(
+            insert(ManagerHierarchy).from_select(
+                ["ancestor_id", "descendant_id", "depth"],
+                select(Manager.parent_manager_id, ManagerHierarchy.descendant_id, literal(depth + 1))
+                .join(Manager, Manager.id == ManagerHierarchy.ancestor_id)
+                .where(
+                    ManagerHierarchy.depth == depth,
+                    Manager.parent_manager_id.is_not(None),
+                    # Stops a (corrupt) cycle from looping forever.
+                    Manager.parent_manager_id != ManagerHierarchy.descendant_id,
+                ),
+            )
+        ).rowcount
+        if not step:
+            return written
+        written += step
+        depth += 1
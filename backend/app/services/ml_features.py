@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import math
+import re
+import zlib
+
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(narrative: str | None) -> list[str]:
+    """
+    Split a bank narrative into lowercase word tokens for the ML model.
+
+    Pure numbers (store numbers, terminal IDs, card suffixes) vary per line and
+    carry no category signal, so they are dropped; single characters likewise.
+    """
+    tokens = _TOKEN_RE.findall((narrative or "").lower())
+    return [token for token in tokens if len(token) > 1 and not token.isdigit()]
+
+
+# Buckets for hashed character n-grams (feature hashing keeps vectors fixed-size).
+NGRAM_DIMENSIONS = 1 << 18
+
+
+def hashed_ngrams(narrative: str | None, n: int = 3, dimensions: int = NGRAM_DIMENSIONS) -> dict[int, float]:
+    """
+    L2-normalised sparse vector of hashed character n-grams over the narrative's tokens.
+
+    Character n-grams make "WOOLWORTHS 3066 ALFREDTON" and "WOOLWORTHS ALFREDTON AUS"
+    close even when merchant strings are truncated differently. crc32 is used
+    rather than hash() so bucket ids are stable across processes.
+    """
+    text = f" {' '.join(tokenize(narrative))} "
+    counts: dict[int, float] = {}
+    for i in range(len(text) - n + 1):
+        bucket = zlib.crc32(text[i:i + n].encode("utf-8")) % dimensions
+        counts[bucket] = counts.get(bucket, 0.0) + 1.0
+    norm = math.sqrt(sum(value * value for value in counts.values()))
+    return {bucket: value / norm for bucket, value in counts.items()} if norm else {}
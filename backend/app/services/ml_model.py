@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import tempfile
+from pathlib import Path
+from typing import Iterable
+
+
+# Fields the trained model predicts; description stays a copy of the narrative.
+MODEL_FIELDS = ("project", "cost_category", "gl_account")
+
+# Historic workbooks are coded in Pronto (cost codes such as "SALP"), while the
+# app labels classifications with its own categories ("Meals & Entertainment").
+# Each label space trains its own heads so neither outvotes the other.
+LABEL_SPACES = ("app", "pronto")
+
+# Bump when the model layout changes; older published models are rebuilt.
+MODEL_FORMAT = 2
+
+MODEL_DIR = Path(os.getenv("CCC_MODEL_DIR", Path(__file__).resolve().parents[2] / "ml_models"))
+CURRENT_POINTER = "current.json"
+
+
+def label_heads(label_space: str = "app") -> dict[str, str]:
+    """Model head holding each field's labels in a label space."""
+    if label_space == "app":
+        return {field: field for field in MODEL_FIELDS}
+    return {field: f"{label_space}_{field}" for field in MODEL_FIELDS}
+
+
+MODEL_HEADS = tuple(head for label_space in LABEL_SPACES for head in label_heads(label_space).values())
+
+
+class TokenModel:
+    """
+    Multinomial naive Bayes over narrative tokens, one classifier per head
+    (field and label space, see label_heads).
+
+    The model is just label and token counts, so training is incremental:
+    partial_fit() adds new examples to the counts without revisiting old ones,
+    and forget() subtracts examples that were relabelled or withdrawn.
+    """
+
+    def __init__(self, version: str) -> None:
+        self.version = version
+        self.format = MODEL_FORMAT
+        self.example_count = 0
+        self.vocabulary: set[str] = set()
+        # head -> label -> number of examples with that label
+        self.label_counts: dict[str, dict[str, int]] = {head: {} for head in MODEL_HEADS}
+        # head -> label -> token -> occurrences
+        self.token_counts: dict[str, dict[str, dict[str, int]]] = {head: {} for head in MODEL_HEADS}
+        # head -> label -> total token occurrences
+        self.token_totals: dict[str, dict[str, int]] = {head: {} for head in MODEL_HEADS}
+
+    def partial_fit(self, examples: Iterable[tuple[list[str], dict[str, str | None]]]) -> int:
+        """
+        Add (tokens, labels) examples to the counts. Labels are keyed by head;
+        labels that are None are skipped. Returns the number of examples added.
+        """
+        added = 0
+        for tokens, labels in examples:
+            added += 1
+            self.vocabulary.update(tokens)
+            for head in MODEL_HEADS:
+                label = labels.get(head)
+                if not label:
+                    continue
+                self.label_counts[head][label] = self.label_counts[head].get(label, 0) + 1
+                counts = self.token_counts[head].setdefault(label, {})
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                self.token_totals[head][label] = self.token_totals[head].get(label, 0) + len(tokens)
+        self.example_count += added
+        return added
+
+    def forget(self, examples: Iterable[tuple[list[str], dict[str, str | None]]]) -> int:
+        """
+        Subtract (tokens, labels) examples previously added with partial_fit().
+        Counts that reach zero are dropped; the vocabulary is left as is.
+        Returns the number of examples removed.
+        """
+        removed = 0
+        for tokens, labels in examples:
+            removed += 1
+            for head in MODEL_HEADS:
+                label = labels.get(head)
+                if not label or label not in self.label_counts[head]:
+                    continue
+                _decrement(self.label_counts[head], label, 1)
+                counts = self.token_counts[head].get(label, {})
+                for token in tokens:
+                    _decrement(counts, token, 1)
+                _decrement(self.token_totals[head], label, len(tokens))
+                if label not in self.label_counts[head]:
+                    self.token_counts[head].pop(label, None)
+                    self.token_totals[head].pop(label, None)
+        self.example_count = max(self.example_count - removed, 0)
+        return removed
+
+    def predict_top_k(self, tokens: list[str], k: int, label_space: str = "app") -> dict[str, list[tuple[str, float]]]:
+        """
+        Ranked (label, probability) pairs per field in a label space; fields
+        without training labels are empty.
+        """
+        return self.predict_top_k_many([tokens], k, label_space)[0]
+
+    def predict_top_k_many(
+        self,
+        token_lists: list[list[str]],
+        k: int,
+        label_space: str = "app",
+    ) -> list[dict[str, list[tuple[str, float]]]]:
+        """
+        predict_top_k() for many narratives at once. Label priors and per-token
+        log likelihoods are computed once per batch instead of once per row.
+        """
+        vocab_size = len(self.vocabulary) + 1
+        # field -> [(label, log prior, token counts, denominator, token log-likelihood memo)]
+        fields: dict[str, list[tuple[str, float, dict[str, int], int, dict[str, float]]]] = {}
+        for field, head in label_heads(label_space).items():
+            labels = self.label_counts[head]
+            total_examples = sum(labels.values())
+            fields[field] = [
+                (
+                    label,
+                    math.log(label_count / total_examples),
+                    self.token_counts[head].get(label, {}),
+                    self.token_totals[head].get(label, 0) + vocab_size,
+                    {},
+                )
+                for label, label_count in labels.items()
+            ]
+
+        results = []
+        for tokens in token_lists:
+            result: dict[str, list[tuple[str, float]]] = {}
+            for field, labels in fields.items():
+                if not labels:
+                    result[field] = []
+                    continue
+
+                scores: dict[str, float] = {}
+                for label, score, counts, denominator, memo in labels:
+                    for token in tokens:
+                        log_likelihood = memo.get(token)
+                        if log_likelihood is None:
+                            log_likelihood = memo[token] = math.log((counts.get(token, 0) + 1) / denominator)
+                        score += log_likelihood
+                    scores[label] = score
+
+                # Softmax over log scores for calibrated-ish probabilities.
+                best = max(scores.values())
+                exp_scores = {label: math.exp(score - best) for label, score in scores.items()}
+                norm = sum(exp_scores.values())
+                ranked = sorted(exp_scores.items(), key=lambda item: -item[1])[:k]
+                result[field] = [(label, round(value / norm, 4)) for label, value in ranked]
+            results.append(result)
+        return results
+
+    def to_dict(self) -> dict:
+        return {
+            "version": self.version,
+            "format": self.format,
+            "example_count": self.example_count,
+            "vocabulary": sorted(self.vocabulary),
+            "label_counts": self.label_counts,
+            "token_counts": self.token_counts,
+            "token_totals": self.token_totals,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TokenModel":
+        model = cls(data["version"])
+        model.format = data.get("format", 1)
+        model.example_count = data.get("example_count", 0)
+        model.vocabulary = set(data.get("vocabulary", []))
+        for head in MODEL_HEADS:
+            model.label_counts[head] = data.get("label_counts", {}).get(head, {})
+            model.token_counts[head] = data.get("token_counts", {}).get(head, {})
+            model.token_totals[head] = data.get("token_totals", {}).get(head, {})
+        return model
+
+    def copy(self, version: str) -> "TokenModel":
+        """Deep copy under a new version, so training never mutates a published model."""
+        data = json.loads(json.dumps(self.to_dict()))
+        data["version"] = version
+        return TokenModel.from_dict(data)
+
+
+def _decrement(counts: dict[str, int], key: str, amount: int) -> None:
+    remaining = counts.get(key, 0) - amount
+    if remaining > 0:
+        counts[key] = remaining
+    else:
+        counts.pop(key, None)
+
+
+def _write_json_atomic(path: Path, data: dict) -> None:
+    """Write JSON to a temp file in the same directory and rename it into place."""
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as handle:
+            json.dump(data, handle)
+        os.replace(tmp_name, path)
+    except Exception:
+        os.unlink(tmp_name)
+        raise
+
+
+def pointer_path(model_dir: Path = MODEL_DIR) -> Path:
+    return model_dir / CURRENT_POINTER
+
+
+def load_current_model(model_dir: Path = MODEL_DIR) -> TokenModel | None:
+    """Load the model the current pointer refers to, or None if nothing is published."""
+    pointer = pointer_path(model_dir)
+    if not pointer.exists():
+        return None
+    with pointer.open() as handle:
+        file_name = json.load(handle)["file_name"]
+    with (model_dir / file_name).open() as handle:
+        return TokenModel.from_dict(json.load(handle))
+
+
+def publish_model(model: TokenModel, model_dir: Path = MODEL_DIR) -> Path:
+    """
+    Write a model version to disk and atomically point `current.json` at it.
+
+    Running API workers notice the pointer change and reload (see
+    ml_service.active_model), so readers only ever see a complete model.
+    """
+    model_dir.mkdir(parents=True, exist_ok=True)
+    file_name = f"model-{model.version}.json"
+    _write_json_atomic(model_dir / file_name, model.to_dict())
+    _write_json_atomic(pointer_path(model_dir), {"version": model.version, "file_name": file_name})
+    return model_dir / file_name
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Iterable
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+
+from app.models import MLPrediction
+from app.services.bulk_ops import bulk_insert
+
+
+def prediction_rows(
+    transaction_id: int,
+    alternatives: dict[str, list[tuple[str, float]]],
+    model_version: str | None,
+    predicted_at: datetime,
+) -> list[dict]:
+    """
+    Flatten ranked alternatives for one transaction into MLPrediction row dicts.
+
+    All rows from one prediction run share predicted_at, which is what
+    latest_predictions() groups on.
+    """
+    rows = []
+    for field_name, values in alternatives.items():
+        for value, confidence in values:
+            rows.append(
+                {
+                    "transaction_id": transaction_id,
+                    "field_name": field_name,
+                    "predicted_value": value[:500],
+                    "confidence": float(confidence),
+                    "model_version": model_version,
+                    "predicted_at": predicted_at,
+                }
+            )
+    return rows
+
+
+def record_predictions(session: Session, rows: list[dict]) -> int:
+    """Bulk insert MLPrediction rows built by prediction_rows(). Returns rows written."""
+    return bulk_insert(session, MLPrediction.__table__, rows)
+
+
+def latest_predictions(session: Session, transaction_ids: Iterable[int]) -> dict[int, dict[str, list[dict]]]:
+    """
+    Return the most recent prediction run per transaction and field.
+
+    Result shape: {transaction_id: {field_name: [{predicted_value, confidence,
+    model_version, predicted_at}, ...]}} with alternatives ordered by confidence.
+    Served from the (transaction_id, field_name, predicted_at) index.
+    """
+    ids = list(transaction_ids)
+    if not ids:
+        return {}
+
+    latest = (
+        select(
+            MLPrediction.transaction_id,
+            MLPrediction.field_name,
+            func.max(MLPrediction.predicted_at).label("predicted_at"),
+        )
+        .where(MLPrediction.transaction_id.in_(ids))
+        .group_by(MLPrediction.transaction_id, MLPrediction.field_name)
+        .subquery()
+    )
+    rows = session.execute(
+        select(
+            MLPrediction.transaction_id,
+            MLPrediction.field_name,
+            MLPrediction.predicted_value,
+            MLPrediction.confidence,
+            MLPrediction.model_version,
+            MLPrediction.predicted_at,
+        )
+        .join(
+            latest,
+            and_(
+                MLPrediction.transaction_id == latest.c.transaction_id,
+                MLPrediction.field_name == latest.c.field_name,
+                MLPrediction.predicted_at == latest.c.predicted_at,
+            ),
+        )
+        .order_by(MLPrediction.transaction_id, MLPrediction.field_name, MLPrediction.confidence.desc())
+    ).all()
+
+    result: dict[int, dict[str, list[dict]]] = {}
+    for row in rows:
+        result.setdefault(row.transaction_id, {}).setdefault(row.field_name, []).append(
+            {
+                "predicted_value": row.predicted_value,
+                "confidence": row.confidence,
+                "model_version": row.model_version,
+                "predicted_at": row.predicted_at,
+            }
+        )
+    return result
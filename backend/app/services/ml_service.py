@@ -1,65 +1,179 @@
 from __future__ import annotations
 
+import time
 from typing import TYPE_CHECKING
 
+from app.services.ml_features import tokenize
+from app.services.ml_model import TokenModel, load_current_model, pointer_path
+
 if TYPE_CHECKING:
     from app.models import Transaction
 
 
-def predict_classification(transaction: "Transaction") -> dict[str, str | None]:
+# Version tag recorded on MLPrediction rows produced by the keyword stub.
+MODEL_VERSION = "keyword-stub-v1"
+
+# How often (seconds) a worker stats the model pointer for a newly published version.
+MODEL_RELOAD_INTERVAL = 5.0
+
+# Number of alternatives kept per field when recording predictions.
+TOP_K = 3
+
+# (cost_category, keywords, gl_account) in priority order: the first rule with a
+# keyword hit wins, matching the original if/elif chain.
+_COST_CATEGORY_RULES: list[tuple[str, tuple[str, ...], str]] = [
+    ("Meals & Entertainment", ("coffee", "cafe", "restaurant", "food"), "6000"),
+    ("Travel & Fuel", ("fuel", "petrol", "gas"), "6100"),
+    ("Office Supplies", ("office", "stationery", "supplies"), "6200"),
+    ("Travel & Accommodation", ("hotel", "accommodation", "lodging"), "6100"),
+]
+_FALLBACK_CATEGORY = ("Other", "6999")  # Other expenses
+
+
+def keyword_top_k(transaction: "Transaction", k: int = TOP_K) -> dict[str, list[tuple[str, float]]]:
     """
-    ML stub: Simple keyword-based prediction for Format 2 fields.
-    
-    In M3, this is a deterministic rule-based stub. Future milestones will
-    replace this with actual ML model inference.
-    
+    ML stub: ranked alternatives with confidences for each Format 2 field.
+
+    Cost categories are ranked by rule priority: the first matching rule (the
+    original stub's pick), the other matching rules, then "Other". Confidence
+    halves at each step down that list before normalising, so every category
+    outscores all those below it combined. GL accounts sum the confidence of
+    the categories that map to them, so the top GL account is always the top
+    category's.
+
     Returns:
-        dict with keys: description, project, cost_category, gl_account
+        dict with keys description, project, cost_category, gl_account, each a
+        list of (value, confidence) pairs ordered best first (possibly empty).
     """
-    narrative_lower = (transaction.narrative or "").lower()
-    
-    # Simple keyword matching for cost_category
-    cost_category = None
-    if any(word in narrative_lower for word in ["coffee", "cafe", "restaurant", "food"]):
-        cost_category = "Meals & Entertainment"
-    elif any(word in narrative_lower for word in ["fuel", "petrol", "gas"]):
-        cost_category = "Travel & Fuel"
-    elif any(word in narrative_lower for word in ["office", "stationery", "supplies"]):
-        cost_category = "Office Supplies"
-    elif any(word in narrative_lower for word in ["hotel", "accommodation", "lodging"]):
-        cost_category = "Travel & Accommodation"
-    else:
-        cost_category = "Other"
-    
+    return _keyword_top_k(transaction.narrative, k)
+
+
+def _keyword_top_k(narrative: str | None, k: int) -> dict[str, list[tuple[str, float]]]:
+    narrative = narrative or ""
+    narrative_lower = narrative.lower()
+
+    ranked = [
+        (category, gl_account)
+        for category, keywords, gl_account in _COST_CATEGORY_RULES
+        if any(word in narrative_lower for word in keywords)
+    ]
+    ranked.append(_FALLBACK_CATEGORY)
+    weights = [0.5 ** index for index in range(len(ranked))]
+    total = sum(weights)
+
+    cost_category = [(category, round(weight / total, 4)) for (category, _), weight in zip(ranked, weights)]
+
+    gl_scores: dict[str, float] = {}
+    for (_, gl_account), weight in zip(ranked, weights):
+        gl_scores[gl_account] = gl_scores.get(gl_account, 0.0) + weight / total
+    gl_account = [(value, round(score, 4)) for value, score in gl_scores.items()]
+    gl_account.sort(key=lambda item: -item[1])
+
     # Simple project extraction (look for common project codes)
-    project = None
+    project: list[tuple[str, float]] = []
     if "project" in narrative_lower:
-        # Try to extract project identifier
         words = narrative_lower.split()
         for i, word in enumerate(words):
             if word == "project" and i + 1 < len(words):
-                project = words[i + 1].upper()
+                project.append((words[i + 1].upper(), 1.0))
                 break
-    
-    # Default GL account based on cost category
-    gl_account = None
-    if cost_category == "Meals & Entertainment":
-        gl_account = "6000"
-    elif cost_category == "Travel & Fuel":
-        gl_account = "6100"
-    elif cost_category == "Office Supplies":
-        gl_account = "6200"
-    elif cost_category == "Travel & Accommodation":
-        gl_account = "6100"
-    else:
-        gl_account = "6999"  # Other expenses
-    
+
     # Description: use narrative as-is for now
-    description = transaction.narrative[:500] if transaction.narrative else None
-    
+    description = [(narrative[:500], 1.0)] if narrative else []
+
     return {
-        "description": description,
-        "project": project,
-        "cost_category": cost_category,
-        "gl_account": gl_account,
+        "description": description[:k],
+        "project": project[:k],
+        "cost_category": cost_category[:k],
+        "gl_account": gl_account[:k],
     }
+
+
+class _ModelCache:
+    """Per-process handle on the published model, swapped when the pointer changes."""
+
+    def __init__(self) -> None:
+        self.model: TokenModel | None = None
+        self.pointer_mtime: float | None = None
+        self.checked_at = float("-inf")
+
+    def get(self) -> TokenModel | None:
+        now = time.monotonic()
+        if now - self.checked_at < MODEL_RELOAD_INTERVAL:
+            return self.model
+        self.checked_at = now
+
+        try:
+            mtime = pointer_path().stat().st_mtime
+        except FileNotFoundError:
+            return self.model
+        if mtime != self.pointer_mtime:
+            # Load fully before assigning, so concurrent predictions keep using
+            # the old model until the new one is ready.
+            model = load_current_model()
+            self.model = model
+            self.pointer_mtime = mtime
+        return self.model
+
+
+_model_cache = _ModelCache()
+
+
+def active_model() -> TokenModel | None:
+    """The latest published trained model, or None while only the keyword stub is available."""
+    return _model_cache.get()
+
+
+def model_version(model: TokenModel | None) -> str:
+    """Version tag to record for predictions made with `model`."""
+    return model.version if model else MODEL_VERSION
+
+
+def predict_top_k(
+    transaction: "Transaction",
+    k: int = TOP_K,
+    model: TokenModel | None = None,
+) -> dict[str, list[tuple[str, float]]]:
+    """
+    Ranked alternatives per Format 2 field.
+
+    Uses the trained model (the active one unless `model` is given) and falls
+    back to the keyword stub for fields the model has no labels for yet.
+    """
+    return predict_top_k_many([transaction.narrative], k, model)[0]
+
+
+def predict_top_k_many(
+    narratives: list[str | None],
+    k: int = TOP_K,
+    model: TokenModel | None = None,
+) -> list[dict[str, list[tuple[str, float]]]]:
+    """predict_top_k() for a list of narratives, scored by the model as one batch."""
+    keyword = [_keyword_top_k(narrative, k) for narrative in narratives]
+    model = model or active_model()
+    if model is None:
+        return keyword
+
+    trained = model.predict_top_k_many([tokenize(narrative) for narrative in narratives], k)
+    return [
+        {field: model_values.get(field) or values for field, values in keyword_values.items()}
+        for keyword_values, model_values in zip(keyword, trained)
+    ]
+
+
+def top_predictions(alternatives: dict[str, list[tuple[str, float]]]) -> dict[str, str | None]:
+    """Collapse ranked alternatives to the single best value per field."""
+    return {field: (values[0][0] if values else None) for field, values in alternatives.items()}
+
+
+def predict_classification(transaction: "Transaction", model: TokenModel | None = None) -> dict[str, str | None]:
+    """
+    Best prediction for each Format 2 field.
+
+    Uses `model`, else the latest trained model published by /internal/ml/train
+    when one exists, otherwise the deterministic keyword stub.
+
+    Returns:
+        dict with keys: description, project, cost_category, gl_account
+    """
+    return top_predictions(predict_top_k(transaction, k=1, model=model))
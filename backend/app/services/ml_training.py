@@ -0,0 +1,265 @@
+"""
+Incremental ML training worker.
+
+Runs in its own process (started by POST /internal/ml/train) so training never
+competes with API requests for the interpreter:
+
+    python -m app.services.ml_training <run_id>
+
+Each run looks at classifications updated since the previous completed run,
+using last_updated_at as the watermark (re-read with an overlap, so rows
+stamped earlier but committed later are not missed), and publishes the updated model for
+running workers to pick up. Every classification records the labels it
+contributed to the model (Classification.trained_*), so a run adds rows that
+became user_confirmed or manager_approved, subtracts the old labels of rows
+that were relabelled or are no longer trainable, and skips rows whose labels
+did not change. The first run, any run queued as a full retrain, and any run
+whose current model predates MODEL_FORMAT instead builds a fresh model from the
+cached training dataset (historic workbooks plus all confirmed
+classifications, see training_dataset.py).
+"""
+from __future__ import annotations
+
+import subprocess
+import sys
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.db import get_session
+from app.models import Classification, MLTrainingRun, Transaction
+from app.services.ml_features import tokenize
+from app.services.ml_model import MODEL_FIELDS, MODEL_FORMAT, TokenModel, load_current_model, publish_model
+from app.services.training_dataset import TRAINABLE_STATUSES, build_dataset, iter_examples
+
+# A pending/running run older than this is assumed dead and no longer blocks new runs.
+STALE_RUN_AFTER = timedelta(hours=1)
+
+ACTIVE_RUN_STATUSES = ("pending", "running")
+
+# Incremental runs re-read this much before the watermark, so a row stamped
+# earlier but committed after a later one is still picked up. Rows re-read with
+# unchanged labels match their trained_* columns and are skipped.
+WATERMARK_OVERLAP = timedelta(minutes=2)
+
+BACKEND_DIR = Path(__file__).resolve().parents[2]
+
+
+def start_training_process(run_id: int) -> subprocess.Popen:
+    """Launch the training worker for a run in a separate Python process."""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "app.services.ml_training", str(run_id)],
+        cwd=BACKEND_DIR,
+        start_new_session=True,
+    )
+    # Reap the child when it exits so finished workers don't linger as zombies.
+    threading.Thread(target=process.wait, daemon=True).start()
+    return process
+
+
+def active_run_id(session) -> int | None:
+    """ID of a pending or running training run that is not stale, if any."""
+    cutoff = datetime.utcnow() - STALE_RUN_AFTER
+    return session.execute(
+        select(MLTrainingRun.id).where(
+            MLTrainingRun.status.in_(ACTIVE_RUN_STATUSES),
+            MLTrainingRun.created_at >= cutoff,
+        ).order_by(MLTrainingRun.id.desc()).limit(1)
+    ).scalar_one_or_none()
+
+
+def fail_stale_runs(session) -> int:
+    """Mark pending/running runs older than STALE_RUN_AFTER as failed. Returns how many."""
+    now = datetime.utcnow()
+    return session.execute(
+        update(MLTrainingRun)
+        .where(MLTrainingRun.status.in_(ACTIVE_RUN_STATUSES), MLTrainingRun.created_at < now - STALE_RUN_AFTER)
+        .values(status="failed", error="Abandoned: still active after the stale run timeout.", completed_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def queue_training_run(session, full_retrain: bool = False) -> tuple[MLTrainingRun, bool]:
+    """
+    Queue a pending run unless one is already active. Returns (run, created).
+
+    uq_ml_training_runs_active admits a single pending/running run, so when two
+    requests race, the losing insert fails and the winner's run is returned.
+    """
+    fail_stale_runs(session)
+    existing_id = active_run_id(session)
+    if existing_id is None:
+        run = MLTrainingRun(status="pending", full_retrain=full_retrain)
+        try:
+            with session.begin_nested():
+                session.add(run)
+        except IntegrityError:
+            existing_id = active_run_id(session)
+        else:
+            return run, True
+    return session.get(MLTrainingRun, existing_id), False
+
+
+_TRAINED_COLUMNS = {field: f"trained_{field}" for field in MODEL_FIELDS}
+
+# Rows a run may need to add to, or subtract from, the model.
+_IN_MODEL_OR_TRAINABLE = or_(Classification.status.in_(TRAINABLE_STATUSES), Classification.trained_at.is_not(None))
+
+
+def _label_changes(session, watermark_from: datetime | None, watermark_to: datetime) -> list[tuple]:
+    """
+    (transaction_id, tokens, trained labels, labels) for classifications updated
+    inside the watermark window whose labels differ from what they contributed
+    to the model. Trained labels are None for rows not in the model; labels are
+    None for rows that are not (or no longer) trainable.
+    """
+    stmt = (
+        select(
+            Classification.transaction_id,
+            Transaction.narrative,
+            Classification.status,
+            Classification.trained_at,
+            *(getattr(Classification, field) for field in MODEL_FIELDS),
+            *(getattr(Classification, column) for column in _TRAINED_COLUMNS.values()),
+        )
+        .join(Transaction, Transaction.id == Classification.transaction_id)
+        .where(_IN_MODEL_OR_TRAINABLE, Classification.last_updated_at <= watermark_to)
+        .order_by(Classification.transaction_id)
+        .execution_options(yield_per=1000)
+    )
+    if watermark_from is not None:
+        stmt = stmt.where(Classification.last_updated_at >= watermark_from - WATERMARK_OVERLAP)
+
+    changes = []
+    for row in session.execute(stmt):
+        labels = None
+        if row.status in TRAINABLE_STATUSES:
+            labels = {field: getattr(row, field) for field in MODEL_FIELDS}
+        trained = None
+        if row.trained_at is not None:
+            trained = {field: getattr(row, column) for field, column in _TRAINED_COLUMNS.items()}
+        if labels != trained:
+            changes.append((row.transaction_id, tokenize(row.narrative), trained, labels))
+    return changes
+
+
+def _record_changes(session, changes: list[tuple], trained_at: datetime) -> None:
+    """Store the labels each changed row now contributes to the model."""
+    session.execute(
+        update(Classification),
+        [
+            {
+                "transaction_id": transaction_id,
+                **{column: labels[field] if labels else None for field, column in _TRAINED_COLUMNS.items()},
+                "trained_at": trained_at if labels else None,
+            }
+            for transaction_id, _, _, labels in changes
+        ],
+    )
+
+
+def _record_dataset(session, segments: list[dict], trained_at: datetime) -> None:
+    """After a full retrain, exactly the dataset's classifications are in the model."""
+    session.execute(
+        update(Classification)
+        .where(Classification.trained_at.is_not(None))
+        .values({**{column: None for column in _TRAINED_COLUMNS.values()}, "trained_at": None})
+        .execution_options(synchronize_session=False)
+    )
+    for segment in segments:
+        if segment["kind"] != "classifications" or not segment["row_count"]:
+            continue
+        columns = segment["columns"]
+        session.execute(
+            update(Classification),
+            [
+                {
+                    "transaction_id": transaction_id,
+                    **{column: columns[field][index] for field, column in _TRAINED_COLUMNS.items()},
+                    "trained_at": trained_at,
+                }
+                for index, transaction_id in enumerate(columns["transaction_id"])
+            ],
+        )
+
+
+def run_training(run_id: int) -> None:
+    """Train the next model version for a queued MLTrainingRun and publish it."""
+    try:
+        current_model = load_current_model()
+
+        with get_session() as session:
+            run = session.get(MLTrainingRun, run_id)
+            if not run:
+                raise ValueError(f"MLTrainingRun {run_id} not found.")
+            rebuild = run.full_retrain or current_model is None or current_model.format != MODEL_FORMAT
+
+            watermark_from = None if rebuild else session.execute(
+                select(func.max(MLTrainingRun.watermark_to)).where(MLTrainingRun.status == "completed")
+            ).scalar()
+            # Snapshot the upper bound now so rows confirmed during training wait for the next run.
+            watermark_to = session.execute(
+                select(func.max(Classification.last_updated_at)).where(_IN_MODEL_OR_TRAINABLE)
+            ).scalar()
+            if watermark_from is not None and (watermark_to is None or watermark_to < watermark_from):
+                # Never move the watermark backwards.
+                watermark_to = watermark_from
+
+            run.status = "running"
+            run.started_at = datetime.utcnow()
+            run.watermark_from = watermark_from
+            run.watermark_to = watermark_to
+
+        examples = 0
+        new_version = current_model.version if current_model else None
+
+        if rebuild or watermark_to is not None:
+            new_version = f"nb-{run_id}-{datetime.utcnow():%Y%m%d%H%M%S}"
+            trained_at = datetime.utcnow()
+            with get_session() as session:
+                if rebuild:
+                    model = TokenModel(new_version)
+                    segments = build_dataset(session, watermark_to)
+                    examples = model.partial_fit(iter_examples(segments))
+                    if examples:
+                        _record_dataset(session, segments, trained_at)
+                else:
+                    model = current_model.copy(new_version)
+                    changes = _label_changes(session, watermark_from, watermark_to)
+                    model.forget((tokens, trained) for _, tokens, trained, _ in changes if trained)
+                    model.partial_fit((tokens, labels) for _, tokens, _, labels in changes if labels)
+                    examples = len(changes)
+                    if examples:
+                        _record_changes(session, changes, trained_at)
+                # Published before the session commits, so the recorded labels
+                # never describe a model that failed to publish.
+                if examples:
+                    publish_model(model)
+            if not examples:
+                new_version = current_model.version if current_model else None
+
+        with get_session() as session:
+            run = session.get(MLTrainingRun, run_id)
+            run.status = "completed"
+            run.base_model_version = None if rebuild or not current_model else current_model.version
+            run.model_version = new_version
+            run.examples_trained = examples
+            run.completed_at = datetime.utcnow()
+    except Exception as e:
+        with get_session() as session:
+            run = session.get(MLTrainingRun, run_id)
+            if run:
+                run.status = "failed"
+                run.error = str(e)[:1000]
+                run.completed_at = datetime.utcnow()
+        raise
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python -m app.services.ml_training <run_id>")
+        sys.exit(1)
+    run_training(int(sys.argv[1]))
@@ -0,0 +1,65 @@
+"""
+Invalidate in-process caches when a session that wrote certain tables commits.
+
+    on_commit_after_write("manager_directory", (Manager, User), directory.invalidate)
+
+Writes are detected with ORM session events: objects flushed as new, dirty or
+deleted, and bulk INSERT/UPDATE/DELETE statements run through Session.execute.
+The callback runs once per committing session; rolled-back writes are ignored.
+Writes made outside the ORM (or by other processes) are not seen, so caches
+using this should also expire on a timer.
+"""
+from __future__ import annotations
+
+from itertools import chain
+from typing import Callable
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+_watchers: list[tuple[str, tuple[type, ...], Callable[[], None]]] = []
+
+
+def on_commit_after_write(name: str, models: tuple[type, ...], callback: Callable[[], None]) -> None:
+    """Call `callback` after any session that wrote one of `models` commits."""
+    _watchers.append((f"wrote:{name}", models, callback))
+
+
+def session_wrote(session: Session, name: str) -> bool:
+    """Whether this session has uncommitted writes watched under `name`."""
+    return session.info.get(f"wrote:{name}", False)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flushed_writes(session, flush_context) -> None:
+    # new/dirty/deleted still hold the pre-flush state here.
+    objects = list(chain(session.new, session.dirty, session.deleted))
+    for key, models, _ in _watchers:
+        if any(isinstance(obj, models) for obj in objects):
+            session.info[key] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk_writes(orm_execute_state) -> None:
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None:
+        return
+    for key, models, _ in _watchers:
+        if issubclass(mapper.class_, models):
+            orm_execute_state.session.info[key] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session) -> None:
+    for key, _, callback in _watchers:
+        if session.info.pop(key, False):
+            callback()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session) -> None:
+    for key, _, _ in _watchers:
+        session.info.pop(key, None)
@@ -0,0 +1,149 @@
+"""
+Pronto upload export.
+
+An export batch claims every FinanceExtension row that is ready_for_pronto and
+not yet exported with one set-based UPDATE, then streams the claimed rows to a
+CSV in the "Pronto layout" column order used by the historic upload workbooks:
+
+    Account, Reference, Tax, Amount, Tax CODE, TAX Amount (left blank), CBS
+
+Rows are read with a server-side cursor and written in chunks, so memory use
+does not grow with the size of the export.
+"""
+from __future__ import annotations
+
+import csv
+import os
+import tempfile
+from datetime import date, datetime
+from pathlib import Path
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app.models import Classification, FinanceExtension, Format3Row, Transaction
+
+
+# Rows fetched per round trip and written per chunk.
+EXPORT_CHUNK_SIZE = 2000
+
+PRONTO_HEADER = ["Account", "Reference", "Tax", "Amount", "Tax CODE", "TAX Amount", "CBS"]
+
+# Every historic upload line is an invoice line ("I").
+PRONTO_TAX_TYPE = "I"
+
+
+def claim_ready_rows(
+    session: Session,
+    export_batch_id: int,
+    exported_at: datetime,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    import_job_id: int | None = None,
+) -> int:
+    """
+    Assign all ready, not yet exported rows (optionally filtered by transaction
+    date or import job) to the export batch. Returns the number of rows claimed.
+
+    Claiming before writing the file means two concurrent exports can never
+    both pick up the same row.
+    """
+    conditions = [
+        FinanceExtension.ready_for_pronto.is_(True),
+        FinanceExtension.export_batch_id.is_(None),
+    ]
+    tx_conditions = []
+    if date_from:
+        tx_conditions.append(Transaction.date >= date_from)
+    if date_to:
+        tx_conditions.append(Transaction.date <= date_to)
+    if import_job_id is not None:
+        tx_conditions.append(Transaction.import_job_id == import_job_id)
+    if tx_conditions:
+        conditions.append(FinanceExtension.transaction_id.in_(select(Transaction.id).where(*tx_conditions)))
+
+    result = session.execute(
+        update(FinanceExtension)
+        .where(*conditions)
+        .values(export_batch_id=export_batch_id, exported_at=exported_at)
+        .execution_options(synchronize_session=False)
+    )
+    # Keep the Format 3 projection's export columns in step with the claim.
+    session.execute(
+        update(Format3Row)
+        .where(
+            Format3Row.transaction_id.in_(
+                select(FinanceExtension.transaction_id).where(FinanceExtension.export_batch_id == export_batch_id)
+            )
+        )
+        .values(export_batch_id=export_batch_id, exported_at=exported_at)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def _amount(row) -> object:
+    """FinanceExtension amount, falling back to the bank debit (credits as negatives)."""
+    if row.amount is not None:
+        return row.amount
+    if row.debit_amount is not None:
+        return row.debit_amount
+    if row.credit_amount is not None:
+        return -row.credit_amount
+    return None
+
+
+def pronto_row(row) -> list:
+    """One Pronto upload line. Account falls back to project.cost_category as in the historic sheets."""
+    account = row.account
+    if not account and row.project and row.cost_category:
+        account = f"{row.project}.{row.cost_category}"
+    values = [account, row.reference, PRONTO_TAX_TYPE, _amount(row), row.tax_code, None, row.cbs]
+    return ["" if value is None else value for value in values]
+
+
+def write_export_file(session: Session, export_batch_id: int, path: Path) -> int:
+    """
+    Stream the batch's rows to `path` as a Pronto upload CSV, oldest transaction
+    first. The file is written to a temporary name and renamed into place, so a
+    partial file is never visible. Returns the number of lines written.
+    """
+    stmt = (
+        select(
+            FinanceExtension.account,
+            FinanceExtension.reference,
+            FinanceExtension.amount,
+            FinanceExtension.tax_code,
+            FinanceExtension.cbs,
+            Transaction.debit_amount,
+            Transaction.credit_amount,
+            Classification.project,
+            Classification.cost_category,
+        )
+        .join(Transaction, Transaction.id == FinanceExtension.transaction_id)
+        .outerjoin(Classification, Classification.transaction_id == FinanceExtension.transaction_id)
+        .where(FinanceExtension.export_batch_id == export_batch_id)
+        .order_by(Transaction.date, Transaction.id)
+        .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    )
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    written = 0
+    try:
+        with os.fdopen(fd, "w", newline="", encoding="utf-8") as handle:
+            writer = csv.writer(handle)
+            writer.writerow(PRONTO_HEADER)
+            for chunk in session.execute(stmt).partitions():
+                writer.writerows(pronto_row(row) for row in chunk)
+                written += len(chunk)
+        os.replace(tmp_name, path)
+    except Exception:
+        os.unlink(tmp_name)
+        raise
+    return written
+
+
+def export_file_name(export_batch_id: int, created_at: datetime) -> str:
+    """Download name for an export batch's file."""
+    return f"pronto-upload-{created_at:%Y%m%d}-{export_batch_id}.csv"
@@ -0,0 +1,252 @@
+"""
+In-memory nearest-neighbour index over confirmed classifications.
+
+Confirmed (user_confirmed / manager_approved) transactions are grouped by
+normalised narrative, and each distinct narrative is stored as a hashed
+character n-gram vector in an inverted index (bucket -> [(doc, weight)]). A query only touches the posting lists of its
+own buckets, scoring candidates by IDF-weighted cosine similarity, so lookups
+stay in the low milliseconds without scanning every confirmed row.
+
+The index is per process and refreshed incrementally: classifications updated
+since the last refresh (by last_updated_at) are added, replaced or removed.
+Imports and classification edits mark the index stale so the next lookup
+refreshes immediately; otherwise workers re-check at most every
+INDEX_REFRESH_INTERVAL seconds to pick up changes made by other processes.
+"""
+from __future__ import annotations
+
+import heapq
+import math
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select
+
+from app.models import Classification, Transaction
+from app.services.ml_features import hashed_ngrams, tokenize
+from app.services.training_dataset import TRAINABLE_STATUSES
+
+
+# How often (seconds) a worker checks the database for newly confirmed rows.
+INDEX_REFRESH_INTERVAL = 5.0
+
+# Incremental refreshes re-read this much before the watermark, so a row stamped
+# earlier but committed after a later one is still picked up.
+WATERMARK_OVERLAP = timedelta(minutes=2)
+
+# Buckets present in more than this share of documents ("aus", "pty") carry
+# little signal but have the longest posting lists, so queries skip them.
+MAX_DF_RATIO = 0.5
+MIN_DOCS_FOR_DF_CUTOFF = 100
+
+# Postings scanned (rarest buckets first) to collect candidates; the best
+# candidates are then rescored exactly against the full query vector.
+POSTING_BUDGET = 5000
+MIN_CANDIDATES = 50
+
+# Posting lists are compacted once removed documents exceed this share.
+COMPACT_RATIO = 0.25
+
+
+class SimilarityIndex:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._reset()
+        self.checked_at = float("-inf")
+        self.stale = True
+
+    def _reset(self) -> None:
+        # One document per distinct normalised narrative: card statements repeat
+        # the same merchant strings, so this keeps posting lists short.
+        self._docs: list[dict[int, dict] | None] = []
+        self._doc_texts: list[str | None] = []
+        self._doc_by_text: dict[str, int] = {}
+        self._text_by_transaction: dict[int, str] = {}
+        self._postings: dict[int, list[tuple[int, float]]] = {}
+        self._df: dict[int, int] = {}
+        self._removed = 0
+        self.watermark: datetime | None = None
+
+    @property
+    def size(self) -> int:
+        return len(self._doc_by_text)
+
+    def _add(self, row: dict) -> None:
+        self._remove(row["transaction_id"])
+        text = " ".join(tokenize(row["narrative"]))
+        self._text_by_transaction[row["transaction_id"]] = text
+        doc = self._doc_by_text.get(text)
+        if doc is not None:
+            self._docs[doc][row["transaction_id"]] = row
+            return
+
+        doc = len(self._docs)
+        self._docs.append({row["transaction_id"]: row})
+        self._doc_texts.append(text)
+        self._doc_by_text[text] = doc
+        for bucket, weight in hashed_ngrams(text).items():
+            self._postings.setdefault(bucket, []).append((doc, weight))
+            self._df[bucket] = self._df.get(bucket, 0) + 1
+
+    def _remove(self, transaction_id: int) -> None:
+        text = self._text_by_transaction.pop(transaction_id, None)
+        if text is None:
+            return
+        doc = self._doc_by_text[text]
+        rows = self._docs[doc]
+        del rows[transaction_id]
+        if rows:
+            return
+
+        for bucket in hashed_ngrams(text):
+            self._df[bucket] -= 1
+        # Postings are left in place and skipped until the next compaction.
+        del self._doc_by_text[text]
+        self._docs[doc] = None
+        self._doc_texts[doc] = None
+        self._removed += 1
+
+    def _compact(self) -> None:
+        rows = [row for doc in self._docs if doc is not None for row in doc.values()]
+        watermark = self.watermark
+        self._reset()
+        for row in rows:
+            self._add(row)
+        self.watermark = watermark
+
+    def reset(self) -> None:
+        """Drop everything; the next refresh rebuilds from scratch."""
+        with self._lock:
+            self._reset()
+            self.stale = True
+
+    def mark_stale(self) -> None:
+        """Force a refresh on the next lookup (call after imports or classification edits)."""
+        self.stale = True
+
+    def refresh(self, session, force: bool = False) -> None:
+        """Apply classifications updated since the watermark."""
+        now = time.monotonic()
+        if not force and not self.stale and now - self.checked_at < INDEX_REFRESH_INTERVAL:
+            return
+
+        with self._lock:
+            self.checked_at = now
+            self.stale = False
+
+            stmt = (
+                select(
+                    Classification.transaction_id,
+                    Classification.status,
+                    Classification.description,
+                    Classification.project,
+                    Classification.cost_category,
+                    Classification.gl_account,
+                    Classification.last_updated_at,
+                    Transaction.date,
+                    Transaction.narrative,
+                    Transaction.debit_amount,
+                    Transaction.credit_amount,
+                )
+                .join(Transaction, Transaction.id == Classification.transaction_id)
+                .order_by(Classification.last_updated_at)
+                .execution_options(yield_per=1000)
+            )
+            if self.watermark is None:
+                stmt = stmt.where(Classification.status.in_(TRAINABLE_STATUSES))
+            else:
+                # Re-adding a row already indexed is idempotent, so the overlap is safe.
+                stmt = stmt.where(Classification.last_updated_at >= self.watermark - WATERMARK_OVERLAP)
+
+            for row in session.execute(stmt).mappings():
+                if row["status"] in TRAINABLE_STATUSES:
+                    self._add(dict(row))
+                else:
+                    self._remove(row["transaction_id"])
+                if row["last_updated_at"] and (self.watermark is None or row["last_updated_at"] > self.watermark):
+                    self.watermark = row["last_updated_at"]
+
+            if self._removed > COMPACT_RATIO * max(len(self._docs), 1):
+                self._compact()
+
+    def _idf(self, bucket: int, n_docs: int) -> float | None:
+        """IDF weight of a bucket, or None if it is absent or too common to be worth scanning."""
+        df = self._df.get(bucket, 0)
+        if not df or (n_docs >= MIN_DOCS_FOR_DF_CUTOFF and df > MAX_DF_RATIO * n_docs):
+            return None
+        return math.log((n_docs + 1) / (df + 1)) + 1.0
+
+    def query(self, narrative: str | None, k: int = 5, exclude: int | None = None) -> list[tuple[dict, float]]:
+        """
+        The k most similar indexed transactions to `narrative`, as (row, similarity)
+        best first. Transactions sharing a narrative are returned most recent first.
+        """
+        vector = hashed_ngrams(narrative)
+        n_docs = self.size
+        if not vector or not n_docs:
+            return []
+
+        weights: dict[int, float] = {}
+        self_score = 0.0
+        for bucket, query_weight in vector.items():
+            idf = self._idf(bucket, n_docs)
+            if idf is not None:
+                weights[bucket] = query_weight * idf
+                self_score += weights[bucket] * query_weight
+        if not self_score:
+            return []
+
+        # Rare buckets are the most selective and have the shortest posting lists.
+        scores: dict[int, float] = {}
+        scanned = 0
+        exhaustive = True
+        for bucket in sorted(weights, key=self._df.__getitem__):
+            if scanned >= POSTING_BUDGET:
+                exhaustive = False
+                break
+            weight = weights[bucket]
+            postings = self._postings[bucket]
+            scanned += len(postings)
+            for doc, doc_weight in postings:
+                scores[doc] = scores.get(doc, 0.0) + weight * doc_weight
+
+        if not exhaustive:
+            # Budget exhausted: rescore the leading candidates on every bucket.
+            candidates = heapq.nlargest(max(MIN_CANDIDATES, 10 * k), scores, key=scores.__getitem__)
+            scores = {
+                doc: sum(weights.get(bucket, 0.0) * doc_weight for bucket, doc_weight in hashed_ngrams(self._doc_texts[doc]).items())
+                for doc in candidates
+                if self._docs[doc]
+            }
+
+        results: list[tuple[dict, float]] = []
+        # Every document holds at least one row, so k + 1 documents cover k results
+        # even when one of them is the excluded transaction itself.
+        for score, doc in heapq.nlargest(k + 1, ((score, doc) for doc, score in scores.items() if self._docs[doc])):
+            # Normalise against the query's self-similarity so scores read as 0..1.
+            similarity = min(1.0, score / self_score)
+            rows = sorted(self._docs[doc].values(), key=lambda row: row["date"] or date.min, reverse=True)
+            for row in rows:
+                if row["transaction_id"] != exclude:
+                    results.append((row, similarity))
+            if len(results) >= k:
+                break
+        return results[:k]
+
+
+_index = SimilarityIndex()
+
+
+def similarity_index(session) -> SimilarityIndex:
+    """The process-wide index, refreshed if stale."""
+    _index.refresh(session)
+    return _index
+
+
+def mark_similarity_index_stale() -> None:
+    _index.mark_stale()
+
+
+def reset_similarity_index() -> None:
+    _index.reset()
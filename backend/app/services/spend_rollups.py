@@ -0,0 +1,190 @@
+"""
+Spend rollups for finance reporting.
+
+SpendRollup holds transaction counts and debit/credit totals per
+(grain, period_start, account, cardholder, cost_category, gl_account) at day
+and month grain. Reports read only these rows, so they cost the same whatever
+the size of the ledger.
+
+The rollups are maintained incrementally: after transactions are imported,
+their classifications change or their account's cardholder changes, every
+(period, account) slice they fall in is deleted and re-aggregated from the
+source tables with one INSERT ... SELECT ... GROUP BY per grain. Slices are
+selected as account_id = ? AND date >= ? AND date < ? ranges, which
+ix_transactions_account_date serves, so a refresh reads only the rows of the
+touched slices. Recomputing whole slices, rather than applying deltas, means a
+refresh never has to know what a row looked like before it changed.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta
+from typing import Iterable
+
+from sqlalchemy import Date, and_, cast, delete, func, insert, literal, or_, select
+from sqlalchemy.orm import Session
+from sqlalchemy.types import DateTime
+
+from app.models import Account, Classification, SpendRollup, Transaction
+from app.services.bulk_ops import dialect_name
+
+
+ROLLUP_GRAINS = ("day", "month")
+
+# Transactions per refresh round trip when refreshing an explicit id list.
+REFRESH_CHUNK_SIZE = 1000
+
+# (period, account) slices deleted and re-aggregated per statement.
+SLICE_CHUNK_SIZE = 200
+
+_COLUMNS = [
+    "grain",
+    "period_start",
+    "account_id",
+    "cardholder_id",
+    "cost_category",
+    "gl_account",
+    "transaction_count",
+    "debit_total",
+    "credit_total",
+    "refreshed_at",
+]
+
+
+def period_start(session: Session, grain: str, column):
+    """SQL expression for the first day of the `grain` period containing `column`."""
+    if grain == "day":
+        return column
+    if dialect_name(session) == "sqlite":
+        return func.date(column, "start of month", type_=Date)
+    return cast(func.date_trunc("month", column), Date)
+
+
+def period_end(grain: str, start: date) -> date:
+    """First day after the `grain` period starting on `start`."""
+    if grain == "day":
+        return start + timedelta(days=1)
+    return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def _account_is(column, account_id: int | None):
+    return column.is_(None) if account_id is None else column == account_id
+
+
+def _source_select(session: Session, grain: str, refreshed_at: datetime):
+    period = period_start(session, grain, Transaction.date)
+    cardholder_id = func.coalesce(Transaction.cardholder_id, Account.cardholder_id)
+    return (
+        select(
+            literal(grain),
+            period,
+            Transaction.account_id,
+            cardholder_id,
+            Classification.cost_category,
+            Classification.gl_account,
+            func.count(Transaction.id),
+            func.coalesce(func.sum(Transaction.debit_amount), 0),
+            func.coalesce(func.sum(Transaction.credit_amount), 0),
+            literal(refreshed_at, DateTime(timezone=True)),
+        )
+        .outerjoin(Account, Account.id == Transaction.account_id)
+        .outerjoin(Classification, Classification.transaction_id == Transaction.id)
+        .group_by(
+            period,
+            Transaction.account_id,
+            cardholder_id,
+            Classification.cost_category,
+            Classification.gl_account,
+        )
+    )
+
+
+def _touched_slices(session: Session, grain: str, transaction_filter, was_unlinked: bool) -> set[tuple[date, int | None]]:
+    period = period_start(session, grain, Transaction.date)
+    rows = session.execute(
+        select(period, Transaction.account_id)
+        .where(transaction_filter, Transaction.date.is_not(None))
+        .distinct()
+    ).all()
+    slices = {(start, account_id) for start, account_id in rows}
+    if was_unlinked:
+        slices |= {(start, None) for start, _ in rows}
+    return slices
+
+
+def _refresh_slices(
+    session: Session, grain: str, slices: list[tuple[date, int | None]], refreshed_at: datetime
+) -> int:
+    session.execute(
+        delete(SpendRollup)
+        .where(
+            SpendRollup.grain == grain,
+            or_(
+                *(
+                    and_(SpendRollup.period_start == start, _account_is(SpendRollup.account_id, account_id))
+                    for start, account_id in slices
+                )
+            ),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    source = _source_select(session, grain, refreshed_at).where(
+        or_(
+            *(
+                and_(
+                    _account_is(Transaction.account_id, account_id),
+                    Transaction.date >= start,
+                    Transaction.date < period_end(grain, start),
+                )
+                for start, account_id in slices
+            )
+        )
+    )
+    return session.execute(insert(SpendRollup).from_select(_COLUMNS, source)).rowcount
+
+
+def refresh_spend_rollups(
+    session: Session,
+    transaction_ids: Iterable[int] | None = None,
+    import_job_id: int | None = None,
+    account_ids: Iterable[int] | None = None,
+    was_unlinked: bool = False,
+) -> int:
+    """
+    Recompute the rollup slices touched by the given transactions (or by every
+    transaction of `import_job_id`, or of the given accounts). With none of
+    them, all rollups are rebuilt.
+
+    Pass `was_unlinked` when the transactions have just been linked to an
+    account, so the unlinked slices they moved out of are recomputed too.
+
+    Runs in the caller's transaction and returns the number of rollup rows written.
+    """
+    now = datetime.utcnow()
+    if transaction_ids is None and import_job_id is None and account_ids is None:
+        session.execute(delete(SpendRollup))
+        written = 0
+        for grain in ROLLUP_GRAINS:
+            source = _source_select(session, grain, now).where(Transaction.date.is_not(None))
+            written += session.execute(insert(SpendRollup).from_select(_COLUMNS, source)).rowcount
+        return written
+
+    if transaction_ids is None and import_job_id is not None:
+        filters = [Transaction.import_job_id == import_job_id]
+    elif transaction_ids is None:
+        filters = [Transaction.account_id.in_(sorted(set(account_ids)))]
+    else:
+        ids = sorted(set(transaction_ids))
+        filters = [
+            Transaction.id.in_(ids[offset:offset + REFRESH_CHUNK_SIZE])
+            for offset in range(0, len(ids), REFRESH_CHUNK_SIZE)
+        ]
+
+    written = 0
+    for grain in ROLLUP_GRAINS:
+        slices: set[tuple[date, int | None]] = set()
+        for transaction_filter in filters:
+            slices |= _touched_slices(session, grain, transaction_filter, was_unlinked)
+        ordered = sorted(slices, key=lambda item: (item[0], item[1] or 0))
+        for offset in range(0, len(ordered), SLICE_CHUNK_SIZE):
+            written += _refresh_slices(session, grain, ordered[offset:offset + SLICE_CHUNK_SIZE], now)
+    return written
@@ -0,0 +1,236 @@
+"""
+Cached, pre-featurised training dataset.
+
+Parsing the historic Pronto workbooks is the slowest step of any training run,
+so each workbook is converted once into a cached segment:
+
+    <cache dir>/workbook-<sha256 of file>.json.gz
+
+A segment is gzipped JSON holding one list per column (not Parquet or NumPy
+arrays, which this backend does not depend on), so loading it is a single
+json.loads with no xlsx parsing or tokenising.
+
+Segments are keyed by file content hash, so only new or edited workbooks are
+re-parsed. Confirmed classifications from the database are cached the same
+way in a segment keyed by (watermark, row count) and rebuilt only when newer
+confirmations exist.
+
+Each segment stores parallel columns: date, narrative, tokens (the model's
+features), project, cost_category, gl_account. Classification segments also
+carry transaction_id, so a full retrain can record what each row contributed.
+
+Workbook labels are Pronto codes and classification labels are app
+categories, so iter_examples() trains them into separate model heads (see
+ml_model.LABEL_SPACES).
+
+Rebuild the cache from the command line with:
+
+    python -m app.services.training_dataset
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+from sqlalchemy import func, select
+
+from app.models import Classification, Transaction
+from app.services.historic_workbooks import HISTORIC_DIR, list_workbooks, read_workbook, workbook_period
+from app.services.ml_features import tokenize
+from app.services.ml_model import MODEL_FIELDS, label_heads
+
+
+DATASET_CACHE_DIR = Path(
+    os.getenv("CCC_DATASET_CACHE_DIR", Path(__file__).resolve().parents[2] / "ml_cache")
+)
+
+# Bump when the segment layout or featurisation changes to invalidate old segments.
+SEGMENT_FORMAT = 2
+
+TRAINABLE_STATUSES = ("user_confirmed", "manager_approved")
+
+# Label space of each segment kind.
+SEGMENT_LABEL_SPACES = {"workbook": "pronto", "classifications": "app"}
+
+_COLUMNS = ("date", "narrative", "tokens") + MODEL_FIELDS
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _to_columns(rows: list[dict]) -> dict[str, list]:
+    """Featurise rows and pivot them into parallel columns."""
+    return {
+        "date": [row["date"].isoformat() if row.get("date") else None for row in rows],
+        "narrative": [row["narrative"] for row in rows],
+        "tokens": [tokenize(row["narrative"]) for row in rows],
+        **{field: [row.get(field) for row in rows] for field in MODEL_FIELDS},
+    }
+
+
+def _write_segment(path: Path, segment: dict) -> None:
+    """Write a gzipped segment atomically so concurrent readers never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as handle:
+            handle.write(json.dumps(segment, separators=(",", ":")).encode("utf-8"))
+        os.replace(tmp_name, path)
+    except Exception:
+        os.unlink(tmp_name)
+        raise
+
+
+def _read_segment(path: Path) -> dict | None:
+    if not path.exists():
+        return None
+    with gzip.open(path, "rb") as handle:
+        segment = json.loads(handle.read())
+    return segment if segment.get("format") == SEGMENT_FORMAT else None
+
+
+def workbook_segment(path: Path, cache_dir: Path = DATASET_CACHE_DIR) -> dict:
+    """Return the cached segment for a workbook, parsing it only if its content changed."""
+    sha256 = file_sha256(path)
+    cache_path = cache_dir / f"workbook-{sha256}.json.gz"
+    segment = _read_segment(cache_path)
+    if segment is not None:
+        return segment
+
+    rows = read_workbook(path)
+    period = workbook_period(rows)
+    segment = {
+        "format": SEGMENT_FORMAT,
+        "kind": "workbook",
+        "source": path.name,
+        "sha256": sha256,
+        "period": period.isoformat() if period else None,
+        "row_count": len(rows),
+        "columns": _to_columns(rows),
+    }
+    _write_segment(cache_path, segment)
+    return segment
+
+
+def classification_segment(session, watermark_to: datetime | None = None, cache_dir: Path = DATASET_CACHE_DIR) -> dict:
+    """
+    Return the cached segment of confirmed/approved classifications up to `watermark_to`.
+
+    The segment key is the watermark plus the row count, so it is rebuilt only
+    when classifications were confirmed since it was written.
+    """
+    conditions = [Classification.status.in_(TRAINABLE_STATUSES)]
+    if watermark_to is not None:
+        conditions.append(Classification.last_updated_at <= watermark_to)
+
+    max_updated, row_count = session.execute(
+        select(func.max(Classification.last_updated_at), func.count(Classification.transaction_id)).where(*conditions)
+    ).one()
+    key = hashlib.sha256(f"{max_updated}|{row_count}".encode("utf-8")).hexdigest()[:16]
+    cache_path = cache_dir / f"classifications-{key}.json.gz"
+    segment = _read_segment(cache_path)
+    if segment is not None:
+        return segment
+
+    rows = [
+        {
+            "transaction_id": row.id,
+            "date": row.date,
+            "narrative": row.narrative,
+            "project": row.project,
+            "cost_category": row.cost_category,
+            "gl_account": row.gl_account,
+        }
+        for row in session.execute(
+            select(
+                Transaction.id,
+                Transaction.date,
+                Transaction.narrative,
+                Classification.project,
+                Classification.cost_category,
+                Classification.gl_account,
+            )
+            .join(Transaction, Transaction.id == Classification.transaction_id)
+            .where(*conditions)
+            .order_by(Transaction.date, Transaction.id)
+            .execution_options(yield_per=1000)
+        )
+    ]
+    segment = {
+        "format": SEGMENT_FORMAT,
+        "kind": "classifications",
+        "source": "classifications",
+        "key": key,
+        "watermark": max_updated.isoformat() if max_updated else None,
+        "row_count": len(rows),
+        "columns": {"transaction_id": [row["transaction_id"] for row in rows], **_to_columns(rows)},
+    }
+    _write_segment(cache_path, segment)
+    return segment
+
+
+def build_dataset(
+    session=None,
+    watermark_to: datetime | None = None,
+    workbook_dir: Path = HISTORIC_DIR,
+    cache_dir: Path = DATASET_CACHE_DIR,
+    prune: bool = True,
+) -> list[dict]:
+    """
+    Return all training segments: one per historic workbook (ordered by period)
+    followed by confirmed classifications when a session is given.
+
+    With `prune`, cache files no longer backing any segment are deleted.
+    """
+    segments = [workbook_segment(path, cache_dir) for path in list_workbooks(workbook_dir)]
+    segments.sort(key=lambda segment: segment["period"] or "")
+    if session is not None:
+        segments.append(classification_segment(session, watermark_to, cache_dir))
+
+    if prune and cache_dir.exists():
+        keep = {f"workbook-{s['sha256']}.json.gz" for s in segments if s["kind"] == "workbook"}
+        keep |= {f"classifications-{s['key']}.json.gz" for s in segments if s["kind"] == "classifications"}
+        patterns = ["workbook-*.json.gz"] + (["classifications-*.json.gz"] if session is not None else [])
+        for pattern in patterns:
+            for cache_file in cache_dir.glob(pattern):
+                if cache_file.name not in keep:
+                    cache_file.unlink()
+    return segments
+
+
+def segment_rows(segment: dict) -> list[dict]:
+    """Pivot a segment's columns back into row dicts (dates stay ISO strings)."""
+    columns = segment["columns"]
+    return [dict(zip(_COLUMNS, values)) for values in zip(*(columns[name] for name in _COLUMNS))]
+
+
+def iter_examples(segments: list[dict]) -> Iterator[tuple[list[str], dict[str, str | None]]]:
+    """
+    Yield (tokens, labels) pairs in the shape TokenModel.partial_fit expects,
+    with labels keyed by the heads of the segment's label space.
+    """
+    for segment in segments:
+        columns = segment["columns"]
+        heads = label_heads(SEGMENT_LABEL_SPACES[segment["kind"]])
+        labels = [(heads[field], columns[field]) for field in MODEL_FIELDS]
+        for index, tokens in enumerate(columns["tokens"]):
+            yield tokens, {head: values[index] for head, values in labels}
+
+
+if __name__ == "__main__":
+    from app.db import get_session
+
+    with get_session() as session:
+        for segment in build_dataset(session):
+            print(f"  {segment['kind']:<16} {segment['source']:<60} {segment['row_count']:>7} rows")
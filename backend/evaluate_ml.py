@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Offline evaluation and latency benchmark for classification predictors.
+
+Replays the historic Format 3 workbooks as a time-ordered split: the most
+recent month(s) are the test set and everything earlier is training data.
+For each predictor it reports, per field (cost_category, gl_account, project):
+- accuracy and top-k accuracy on labelled test rows
+- calibration: expected calibration error (ECE) and a reliability table
+and, over the test narratives:
+- single-row prediction latency (p50/p99); for the served predictors this
+  times predict_classification(), the call the app makes per transaction
+- batched prediction latency (p50/p99 per batch, mean per row), one batched
+  inference call per batch
+- memory: model footprint and peak allocation while predicting
+
+Workbook labels are Pronto codes ("SALP"), while the app's prediction path
+returns app categories ("Meals & Entertainment"). Accuracy is only reported
+for predictors whose `label_space` is "pronto"; the others are benchmarked
+for latency and memory only.
+
+Built-in predictors:
+- keyword-stub: the rule-based stub behind predict_classification (app)
+- naive-bayes: the incremental TokenModel trained on the training months,
+  predicting from its Pronto heads
+- naive-bayes-served: a model with the training months loaded into its app
+  heads, behind the app's prediction path (ml_service, with the keyword stub
+  for fields the model has no labels for)
+- active-model: the model currently published to CCC_MODEL_DIR, behind the
+  app's prediction path, if any (app)
+
+Any replacement model can be benchmarked with --predictor module:factory,
+where factory(train_rows) returns an object with `name`, `version` and
+`predict_top_k(narratives, k) -> list[dict[field, list[(label, confidence)]]]`,
+and optionally `label_space` (default "pronto") and `predict_one(narrative)`
+to time single-row calls with.
+
+Workbooks are read through the training dataset cache, so only new or
+changed workbooks are re-parsed. The report is JSON (stdout, or --output).
+
+Usage:
+    python3 evaluate_ml.py
+    python3 evaluate_ml.py --test-months 2 --output ml_report.json
+"""
+import argparse
+import importlib
+import json
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+# Add backend to path
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+from app.services.historic_workbooks import HISTORIC_DIR, list_workbooks
+from app.services.ml_features import tokenize
+from app.services.ml_model import MODEL_FIELDS, TokenModel, label_heads
+from app.services.ml_service import TOP_K, active_model, keyword_top_k, predict_classification, predict_top_k_many
+from app.services.training_dataset import DATASET_CACHE_DIR, segment_rows, workbook_segment
+
+
+EVAL_FIELDS = ("cost_category", "gl_account", "project")
+CALIBRATION_BINS = 10
+
+
+class KeywordStubPredictor:
+    name = "keyword-stub"
+    version = "keyword-stub-v1"
+    label_space = "app"
+
+    def predict_top_k(self, narratives, k):
+        return [keyword_top_k(SimpleNamespace(narrative=narrative), k) for narrative in narratives]
+
+
+class TokenModelPredictor:
+    label_space = "pronto"
+
+    def __init__(self, name, model):
+        self.name = name
+        self.model = model
+        self.version = model.version
+
+    def predict_top_k(self, narratives, k):
+        return self.model.predict_top_k_many([tokenize(narrative) for narrative in narratives], k, self.label_space)
+
+
+class ServedPredictor:
+    """
+    A TokenModel behind ml_service, exactly as the API and batch auto-predict
+    use it. The app path predicts from the model's app heads; `label_space`
+    says which labels those heads were trained on.
+    """
+
+    def __init__(self, name, model, label_space="app"):
+        self.name = name
+        self.model = model
+        self.version = model.version
+        self.label_space = label_space
+
+    def predict_top_k(self, narratives, k):
+        return predict_top_k_many(narratives, k, model=self.model)
+
+    def predict_one(self, narrative):
+        return predict_classification(SimpleNamespace(narrative=narrative), model=self.model)
+
+
+def _train_offline_model(train_rows, label_space):
+    """A TokenModel with the workbook labels trained into the heads of `label_space`."""
+    heads = label_heads(label_space)
+    model = TokenModel("nb-offline")
+    model.partial_fit((row["tokens"], {heads[field]: row[field] for field in MODEL_FIELDS}) for row in train_rows)
+    return model
+
+
+def naive_bayes_factory(train_rows):
+    return TokenModelPredictor("naive-bayes", _train_offline_model(train_rows, "pronto"))
+
+
+def naive_bayes_served_factory(train_rows):
+    # The app path only reads app heads, so load the Pronto codes there to
+    # time it against a model of realistic size.
+    return ServedPredictor("naive-bayes-served", _train_offline_model(train_rows, "app"), label_space="pronto")
+
+
+def active_model_factory(train_rows):
+    model = active_model()
+    return ServedPredictor("active-model", model) if model else None
+
+
+PREDICTORS = {
+    "keyword-stub": lambda train_rows: KeywordStubPredictor(),
+    "naive-bayes": naive_bayes_factory,
+    "naive-bayes-served": naive_bayes_served_factory,
+    "active-model": active_model_factory,
+}
+
+
+def load_predictor_factory(spec):
+    """Resolve "module:callable" to a predictor factory."""
+    module_name, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def load_months(directory, cache_dir):
+    """Return [(period, path, rows)] ordered oldest first, periods as ISO dates."""
+    months = []
+    for path in list_workbooks(directory):
+        segment = workbook_segment(path, cache_dir)
+        if segment["row_count"]:
+            months.append((segment["period"], path, segment_rows(segment)))
+    months.sort(key=lambda month: month[0])
+    return months
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def evaluate_accuracy(predictor, test_rows, k):
+    """Per-field accuracy, top-k accuracy and calibration over labelled test rows."""
+    predictions = predictor.predict_top_k([row["narrative"] for row in test_rows], k)
+    report = {}
+    for field in EVAL_FIELDS:
+        bins = [[0, 0.0, 0] for _ in range(CALIBRATION_BINS)]  # count, confidence sum, correct
+        support = correct = correct_k = 0
+        for row, predicted in zip(test_rows, predictions):
+            label = row.get(field)
+            if not label:
+                continue
+            support += 1
+            alternatives = predicted.get(field) or []
+            top_label, confidence = alternatives[0] if alternatives else (None, 0.0)
+            hit = top_label == label
+            correct += hit
+            correct_k += any(value == label for value, _ in alternatives)
+
+            index = min(CALIBRATION_BINS - 1, int(confidence * CALIBRATION_BINS))
+            bins[index][0] += 1
+            bins[index][1] += confidence
+            bins[index][2] += hit
+
+        reliability = []
+        ece = 0.0
+        for index, (count, confidence_sum, hits) in enumerate(bins):
+            if not count:
+                continue
+            mean_confidence = confidence_sum / count
+            accuracy = hits / count
+            ece += count / support * abs(mean_confidence - accuracy)
+            reliability.append(
+                {
+                    "lower": index / CALIBRATION_BINS,
+                    "upper": (index + 1) / CALIBRATION_BINS,
+                    "count": count,
+                    "mean_confidence": round(mean_confidence, 4),
+                    "accuracy": round(accuracy, 4),
+                }
+            )
+
+        report[field] = {
+            "support": support,
+            "accuracy": round(correct / support, 4) if support else None,
+            f"top_{k}_accuracy": round(correct_k / support, 4) if support else None,
+            "ece": round(ece, 4) if support else None,
+            "reliability": reliability,
+        }
+    return report
+
+
+def benchmark_latency(predictor, narratives, k, batch_size, repeats):
+    """p50/p99 latency for single-row and batched predictions, in milliseconds."""
+    predict_one = getattr(predictor, "predict_one", None) or (lambda narrative: predictor.predict_top_k([narrative], k))
+    single = []
+    for _ in range(repeats):
+        for narrative in narratives:
+            start = time.perf_counter()
+            predict_one(narrative)
+            single.append((time.perf_counter() - start) * 1000)
+
+    batched = []
+    rows = 0
+    for _ in range(repeats):
+        for offset in range(0, len(narratives), batch_size):
+            batch = narratives[offset:offset + batch_size]
+            start = time.perf_counter()
+            predictor.predict_top_k(batch, k)
+            batched.append((time.perf_counter() - start) * 1000)
+            rows += len(batch)
+
+    return {
+        "single": {
+            "calls": len(single),
+            "p50_ms": round(_percentile(single, 50), 4),
+            "p99_ms": round(_percentile(single, 99), 4),
+        },
+        "batched": {
+            "batch_size": batch_size,
+            "calls": len(batched),
+            "p50_ms": round(_percentile(batched, 50), 4),
+            "p99_ms": round(_percentile(batched, 99), 4),
+            "mean_per_row_ms": round(sum(batched) / rows, 4),
+        },
+    }
+
+
+def measure_predict_memory(predictor, narratives, k):
+    """Peak Python allocation (KiB) while predicting the whole test set in one batch."""
+    tracemalloc.start()
+    try:
+        predictor.predict_top_k(narratives, k)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+
+def build_predictor(factory, train_rows):
+    """Build a predictor and measure the memory it retains (KiB)."""
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        predictor = factory(train_rows)
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return predictor, round(max(0, after - before) / 1024, 1)
+
+
+def run(args):
+    months = load_months(args.workbooks, args.cache_dir)
+    if len(months) <= args.test_months:
+        raise SystemExit(f"Need more than {args.test_months} month(s) of workbooks, found {len(months)}.")
+
+    train_months = months[:-args.test_months]
+    test_months = months[-args.test_months:]
+    train_rows = [row for _, _, rows in train_months for row in rows]
+    test_rows = [row for _, _, rows in test_months for row in rows]
+    narratives = [row["narrative"] for row in test_rows]
+
+    factories = {name: PREDICTORS[name] for name in args.predictors}
+    for spec in args.predictor or []:
+        factories[spec] = load_predictor_factory(spec)
+
+    results = {}
+    for name, factory in factories.items():
+        predictor, model_kib = build_predictor(factory, train_rows)
+        if predictor is None:
+            results[name] = {"skipped": "predictor not available"}
+            continue
+        label_space = getattr(predictor, "label_space", "pronto")
+        results[predictor.name] = {
+            "version": predictor.version,
+            "label_space": label_space,
+            "fields": (
+                evaluate_accuracy(predictor, test_rows, args.k)
+                if label_space == "pronto"
+                else {"skipped": "predicts app categories; workbook labels are Pronto codes"}
+            ),
+            "latency": benchmark_latency(predictor, narratives, args.k, args.batch_size, args.repeats),
+            "memory": {
+                "model_kib": model_kib,
+                "peak_predict_kib": measure_predict_memory(predictor, narratives, args.k),
+            },
+        }
+
+    return {
+        "generated_at": datetime.utcnow().isoformat(),
+        "k": args.k,
+        "months": [
+            {
+                "file": path.name,
+                "period": period,
+                "rows": len(rows),
+                "split": "test" if index >= len(train_months) else "train",
+            }
+            for index, (period, path, rows) in enumerate(months)
+        ],
+        "train_rows": len(train_rows),
+        "test_rows": len(test_rows),
+        "predictors": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate and benchmark ML predictors on historic workbooks.")
+    parser.add_argument("--workbooks", type=Path, default=HISTORIC_DIR, help="Directory of historic Pronto .xlsx files")
+    parser.add_argument("--cache-dir", type=Path, default=DATASET_CACHE_DIR, help="Training dataset cache directory")
+    parser.add_argument("--test-months", type=int, default=1, help="Most recent months held out for testing")
+    parser.add_argument("--k", type=int, default=TOP_K, help="Alternatives per field (top-k accuracy)")
+    parser.add_argument("--batch-size", type=int, default=100, help="Rows per batched prediction call")
+    parser.add_argument("--repeats", type=int, default=3, help="Passes over the test set for latency timing")
+    parser.add_argument(
+        "--predictors",
+        nargs="+",
+        default=list(PREDICTORS),
+        choices=list(PREDICTORS),
+        help="Built-in predictors to evaluate",
+    )
+    parser.add_argument("--predictor", action="append", help="Extra predictor factory as module:callable")
+    parser.add_argument("--output", type=Path, help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        args.output.write_text(report)
+        print(f"Report written to {args.output}")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -65,33 +65,30 @@ def parse_name(name_str):
     return "", ""
 
 
+def get_or_create_user(session, email):
+    """Get or create the User with this email (emails are stored lower-case)."""
+    email = email.lower()
+    user = session.execute(select(User).where(User.email == email)).scalar_one_or_none()
+    if user is None:
+        user = User(name=email.split("@")[0], email=email)
+        session.add(user)
+        session.flush()
+    return user
+
+
 def get_or_create_manager(session, manager_email):
-    """Get or create a Manager by email."""
-    # First, try to find a User with this email
-    user = session.execute(
-        select(User).where(User.email == manager_email.lower())
-    ).scalar_one_or_none()
-    
-    if user:
-        # Check if Manager already exists for this user
-        manager = session.execute(
-            select(Manager).where(Manager.user_id == user.id)
-        ).scalar_one_or_none()
-        if manager:
-            return manager
-    
-    # Create a Manager (without user_id for now, since we don't have Users)
-    # We'll just create managers without user links for now
+    """Get or create the Manager linked to the User with this email. Returns (manager, created)."""
+    user = get_or_create_user(session, manager_email)
     manager = session.execute(
-        select(Manager).where(Manager.user_id == None)
+        select(Manager).where(Manager.user_id == user.id).order_by(Manager.id)
     ).scalars().first()
-    
-    # For now, create a new manager for each unique email
-    # In a real system, we'd link to Users
-    manager = Manager(user_id=None)
+    if manager is not None:
+        return manager, False
+
+    manager = Manager(user_id=user.id)
     session.add(manager)
     session.flush()
-    return manager
+    return manager, True
 
 
 def import_cardholders():
@@ -120,14 +117,11 @@ def import_cardholders():
             
             # Get or create manager
             if manager_email not in manager_cache:
-                # For now, create managers without user links
-                # We'll need to handle this differently - maybe create a mapping
-                manager = Manager(user_id=None)
-                session.add(manager)
-                session.flush()
+                manager, created = get_or_create_manager(session, manager_email)
                 manager_cache[manager_email] = manager
-                managers_created += 1
-                print(f"  Created manager for {manager_email}")
+                if created:
+                    managers_created += 1
+                    print(f"  Created manager for {manager_email}")
             
             manager = manager_cache[manager_email]
             
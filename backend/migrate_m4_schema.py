@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Additive migration for post-M3 schema changes.
+
+Brings an existing database up to date with app.models without dropping data:
+- Creates tables that do not exist yet.
+- Adds columns missing from existing tables (new columns are nullable or carry
+  a server default, so ALTER TABLE ... ADD COLUMN is safe).
+- Creates indexes declared on the models that are missing in the database.
+- Rebuilds the manager_hierarchy closure table from managers.parent_manager_id.
+- Recomputes the line counters stored on classification_batches.
+- Rebuilds the format3_rows projection and the spend_rollups from the ledger.
+- Fills cardholders.lookup_key for cardholders created before the column existed.
+- Links managers that have no user to the User with an email given on the
+  command line (--manager-email ID=EMAIL, repeatable); managers left without a
+  user are listed.
+- Records the labels classifications already trained on contributed to the
+  published model (classifications.trained_*).
+
+Safe to run repeatedly.
+
+Usage:
+    python3 migrate_m4_schema.py [--manager-email ID=EMAIL ...]
+    OR
+    source .venv/bin/activate && python3 migrate_m4_schema.py
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+# Add backend to path
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+# Set SQLite DB URL for local dev
+os.environ.setdefault("CCC_DB_URL", "sqlite:///./ccc.db")
+
+try:
+    from sqlalchemy import func, inspect, select, text, update
+    from sqlalchemy.orm import Session
+    from app.db import engine, Base
+    from app import models  # noqa: F401  - ensure models are imported so metadata is populated
+    from app.services.batch_counters import refresh_batch_counters
+    from app.services.format3_projection import refresh_format3_rows
+    from app.services.manager_hierarchy import rebuild_manager_hierarchy
+    from app.services.spend_rollups import refresh_spend_rollups
+    from app.services.training_dataset import TRAINABLE_STATUSES
+    from import_cardholders import get_or_create_user
+except ImportError as e:
+    print(f"Error: {e}")
+    print("Please activate the virtual environment first:")
+    print("  source .venv/bin/activate")
+    print("  python3 migrate_m4_schema.py")
+    sys.exit(1)
+
+
+def _column_ddl(column) -> str:
+    """Render the ADD COLUMN clause for a model column."""
+    ddl = f"{column.name} {column.type.compile(dialect=engine.dialect)}"
+    if column.server_default is not None:
+        default = column.server_default.arg
+        ddl += f" DEFAULT '{default}'" if isinstance(default, str) else f" DEFAULT {default}"
+    if not column.nullable and column.server_default is not None:
+        ddl += " NOT NULL"
+    return ddl
+
+
+def migrate(manager_emails: dict[int, str] | None = None):
+    """Create missing tables, columns and indexes, then backfill derived data."""
+    print("Starting M4 schema migration...")
+
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    # New tables are created with their indexes in one go.
+    new_tables = [t for t in Base.metadata.sorted_tables if t.name not in existing_tables]
+    for table in new_tables:
+        print(f"  Creating {table.name} table...")
+    Base.metadata.create_all(engine, tables=new_tables)
+
+    with engine.begin() as conn:
+        # uq_ml_training_runs_active allows one pending/running run; older ones are dead.
+        if "ml_training_runs" in existing_tables:
+            conn.execute(text(
+                "UPDATE ml_training_runs SET status = 'failed', error = 'Abandoned: superseded by a newer run.' "
+                "WHERE status IN ('pending', 'running') AND id < "
+                "(SELECT MAX(id) FROM ml_training_runs WHERE status IN ('pending', 'running'))"
+            ))
+
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    print(f"  Adding {column.name} column to {table.name}...")
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {_column_ddl(column)}"))
+
+            indexes = {ix["name"] for ix in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    print(f"  Creating index {index.name} on {table.name}...")
+                    index.create(conn)
+
+    # Closure rows for managers that existed before the hierarchy table.
+    print("  Rebuilding manager_hierarchy...")
+    with Session(engine) as session:
+        rebuild_manager_hierarchy(session)
+        session.commit()
+
+    print("  Filling cardholder lookup keys...")
+    with Session(engine) as session:
+        for cardholder in session.query(models.Cardholder).filter(models.Cardholder.lookup_key.is_(None)):
+            cardholder.lookup_key = models.cardholder_lookup_key(cardholder.get_display_name())
+        session.commit()
+
+    # import_cardholders.py used to create managers without a user, and nothing
+    # on the row says who they are: only link the ones given explicitly.
+    with Session(engine) as session:
+        for manager_id, email in sorted((manager_emails or {}).items()):
+            manager = session.get(models.Manager, manager_id)
+            if manager is None:
+                print(f"  Warning: manager {manager_id} does not exist, not linking {email}")
+            elif manager.user_id is None:
+                print(f"  Linking manager {manager_id} to {email}...")
+                manager.user_id = get_or_create_user(session, email).id
+        session.flush()
+        unlinked = session.execute(
+            select(models.Manager.id).where(models.Manager.user_id.is_(None)).order_by(models.Manager.id)
+        ).scalars().all()
+        if unlinked:
+            print(f"  Managers without a user (link with --manager-email ID=EMAIL): {', '.join(map(str, unlinked))}")
+        session.commit()
+
+    # Counters for batches created before the columns existed.
+    print("  Recomputing classification batch counters...")
+    with Session(engine) as session:
+        refresh_batch_counters(session)
+        session.commit()
+
+    # Derived tables for ledgers imported before they existed.
+    print("  Rebuilding format3_rows...")
+    with Session(engine) as session:
+        refresh_format3_rows(session)
+        session.commit()
+
+    print("  Rebuilding spend_rollups...")
+    with Session(engine) as session:
+        refresh_spend_rollups(session)
+        session.commit()
+
+    # Rows up to the last completed run's watermark were trained on with their current labels.
+    print("  Recording trained classification labels...")
+    with Session(engine) as session:
+        watermark = session.execute(
+            select(func.max(models.MLTrainingRun.watermark_to)).where(models.MLTrainingRun.status == "completed")
+        ).scalar()
+        if watermark is not None:
+            Classification = models.Classification
+            session.execute(
+                update(Classification)
+                .where(
+                    Classification.trained_at.is_(None),
+                    Classification.status.in_(TRAINABLE_STATUSES),
+                    Classification.last_updated_at <= watermark,
+                )
+                .values(
+                    trained_project=Classification.project,
+                    trained_cost_category=Classification.cost_category,
+                    trained_gl_account=Classification.gl_account,
+                    trained_at=watermark,
+                )
+            )
+        session.commit()
+
+    print("Migration complete!")
+
+
+def _manager_email(value: str) -> tuple[int, str]:
+    manager_id, sep, email = value.partition("=")
+    if not sep or not manager_id.strip().isdigit() or "@" not in email:
+        raise argparse.ArgumentTypeError(f"expected ID=EMAIL, got {value!r}")
+    return int(manager_id), email.strip().lower()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bring an existing database up to date with app.models.")
+    parser.add_argument(
+        "--manager-email",
+        type=_manager_email,
+        action="append",
+        default=[],
+        metavar="ID=EMAIL",
+        help="Link manager ID (if it has no user) to the user with EMAIL, creating the user if needed",
+    )
+    args = parser.parse_args()
+    migrate(dict(args.manager_email))
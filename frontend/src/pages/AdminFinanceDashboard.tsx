@@ -410,41 +410,46 @@ export function AdminFinanceDashboard() {
     setError(null);
     const results: Array<{ cardholderId: number; success: boolean; message: string }> = [];
     
-    for (const cardholderId of cardholderIds) {
-      try {
-        const response = await fetch(`/api/cardholders/${cardholderId}/batches/from-finance`, {
-          method: "POST",
-          headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({
-            owner_type: "cardholder",
-            parent_batch_id: batchId,
-            title: `Cardholder ${cardholderId} - Classification`,
-            label: `Batch ${batchId}`,
-          }),
-        });
-        
-        if (!response.ok) {
-          const body = await response.json().catch(() => null);
-          const detail = body?.detail ?? response.statusText;
-          results.push({
-            cardholderId,
-            success: false,
-            message: typeof detail === "string" ? detail : JSON.stringify(detail),
-          });
-        } else {
-          const data = await response.json();
+    try {
+      const response = await fetch(`/api/finance/batches/${batchId}/release`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+          cardholder_ids: cardholderIds,
+          label: `Batch ${batchId}`,
+        }),
+      });
+      
+      if (!response.ok) {
+        const body = await response.json().catch(() => null);
+        const detail = body?.detail ?? response.statusText;
+        const message = typeof detail === "string" ? detail : JSON.stringify(detail);
+        for (const cardholderId of cardholderIds) {
+          results.push({ cardholderId, success: false, message });
+        }
+      } else {
+        const data = (await response.json()) as {
+          released: Array<{ owner_id: number; transaction_count: number }>;
+          already_released_ids: number[];
+        };
+        for (const batch of data.released) {
           results.push({
-            cardholderId,
+            cardholderId: batch.owner_id,
             success: true,
-            message: `Batch with ${data.transaction_count} transactions`,
+            message: `Batch with ${batch.transaction_count} transactions`,
           });
         }
-      } catch (e) {
-        const err = e as Error;
+        for (const cardholderId of data.already_released_ids) {
+          results.push({ cardholderId, success: true, message: "Already released" });
+        }
+      }
+    } catch (e) {
+      const err = e as Error;
+      for (const cardholderId of cardholderIds) {
         results.push({
           cardholderId,
           success: false,
-          message: err.message || "Failed to create batch",
+          message: err.message || "Failed to release batch",
         });
       }
     }
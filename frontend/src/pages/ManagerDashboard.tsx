@@ -25,6 +25,8 @@ type ManagerInboxItem = {
   cardholder_id: number;
   cardholder_display_name: string;
   transaction_count: number;
+  debit_total: number;
+  credit_total: number;
   status: string;
   submitted_at: string | null;
   title: string | null;
@@ -487,6 +489,7 @@ export function ManagerDashboard() {
                       <th style={{ textAlign: "left", padding: "0.4rem 0.6rem" }}>Cardholder</th>
                       <th style={{ textAlign: "left", padding: "0.4rem 0.6rem" }}>Batch</th>
                       <th style={{ textAlign: "right", padding: "0.4rem 0.6rem" }}>Transactions</th>
+                      <th style={{ textAlign: "right", padding: "0.4rem 0.6rem" }}>Amount</th>
                       <th style={{ textAlign: "left", padding: "0.4rem 0.6rem" }}>Submitted</th>
                       <th style={{ textAlign: "left", padding: "0.4rem 0.6rem" }}>Actions</th>
                     </tr>
@@ -494,7 +497,7 @@ export function ManagerDashboard() {
                   <tbody>
                     {inbox.length === 0 ? (
                       <tr>
-                        <td colSpan={5} style={{ padding: "0.6rem", textAlign: "center", opacity: 0.7 }}>
+                        <td colSpan={6} style={{ padding: "0.6rem", textAlign: "center", opacity: 0.7 }}>
                           {isLoadingInbox ? "Loading inbox..." : "No batches awaiting approval."}
                         </td>
                       </tr>
@@ -504,6 +507,7 @@ export function ManagerDashboard() {
                           <td style={{ padding: "0.4rem 0.6rem", fontWeight: "bold" }}>{item.cardholder_display_name}</td>
                           <td style={{ padding: "0.4rem 0.6rem" }}>{item.label || item.title || `Batch ${item.batch_id}`}</td>
                           <td style={{ padding: "0.4rem 0.6rem", textAlign: "right" }}>{item.transaction_count}</td>
+                          <td style={{ padding: "0.4rem 0.6rem", textAlign: "right" }}>{item.debit_total.toFixed(2)}</td>
                           <td style={{ padding: "0.4rem 0.6rem", whiteSpace: "nowrap" }}>
                             {item.submitted_at ? new Date(item.submitted_at).toLocaleDateString() : ""}
                           </td>